@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""
+Use KinJector from asyncio programs without blocking the event loop.
+
+The pcbnew calls for loading, injecting, ejecting and saving boards are
+run in a dedicated pool of threads, so an asyncio service can keep handling
+requests while boards are being processed. Each board is locked while it's
+being used so two tasks can't change it at the same time. An executor can
+be shared by several event loops (e.g., one per asyncio.run() call), and
+each loop gets its own locks.
+
+This module needs Python 3.7, so it isn't imported by the kinjector package:
+
+    from kinjector import aio
+
+    data_dict = await aio.load_data("rules.yaml")
+    await aio.inject_and_save(data_dict, "my_board.kicad_pcb")
+"""
+
+import asyncio
+import functools
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from .backend import pcbnew
+from .fileio import file_format, local_board, open_file, read_data
+from .fragments import resolve_file_refs
+from .kinjector import Board, refill_zones, release_board
+
+
+class BoardExecutor(object):
+    """Run the blocking KinJector work for an asyncio program in a pool of threads."""
+
+    def __init__(self, max_workers=1):
+        """
+        Create an executor for board work.
+
+        Args:
+            max_workers: Number of boards that can be worked on at the same
+                time. pcbnew isn't made to be used from several threads, so
+                keep this at 1 unless you're sure your version can handle it.
+        """
+
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="kinjector"
+        )
+        # Semaphore for each event loop, made when the loop first needs it.
+        self.semaphores = weakref.WeakKeyDictionary()
+
+        # Locks for each event loop, with a lock for each board file. A lock
+        # goes away once no task is using it.
+        self.locks = weakref.WeakKeyDictionary()
+
+    def board_lock(self, brd_or_file):
+        """Return the lock in the running loop for a board file or a BOARD object loaded from one."""
+
+        if isinstance(brd_or_file, str):
+            key = os.path.realpath(brd_or_file)
+        elif brd_or_file.GetFileName():
+            key = os.path.realpath(brd_or_file.GetFileName())
+        else:
+            key = id(brd_or_file)  # A board that wasn't loaded from a file.
+        loop = asyncio.get_running_loop()
+        locks = self.locks.get(loop)
+        if locks is None:
+            locks = self.locks[loop] = weakref.WeakValueDictionary()
+        lock = locks.get(key)
+        if lock is None:
+            lock = locks[key] = asyncio.Lock()
+        return lock
+
+    async def run(self, func, *args, **kwargs):
+        """Call a blocking function in the pool of threads and return its result."""
+
+        loop = asyncio.get_running_loop()
+        semaphore = self.semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self.semaphores[loop] = asyncio.Semaphore(self.max_workers)
+        async with semaphore:
+            return await loop.run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs)
+            )
+
+    async def load_data(self, file):
+        """Return the data in a JSON/YAML file with its fragment references resolved."""
+
+        def load():
+            with open_file(file, "r") as fp:
+                data = read_data(fp, file_format(file))
+            return resolve_file_refs(data, file)
+
+        # Reading data doesn't use pcbnew, so it doesn't wait for the board work.
+        return await asyncio.get_running_loop().run_in_executor(None, load)
+
+    async def load_board(self, file):
+        """Return the KiCad BOARD object loaded from a board file (which may be compressed)."""
+
+        def load():
+            with local_board(file) as brd_file:
+                return pcbnew.LoadBoard(brd_file)
+
+        async with self.board_lock(file):
+            return await self.run(load)
+
+    async def eject(self, brd_or_file, **board_args):
+        """
+        Return the data ejected from a board.
+
+        Args:
+            brd_or_file: A KiCad BOARD object or the path to a board file.
+                A board loaded from a file is released once it's ejected.
+            board_args: Arguments for creating the Board object that does the
+                ejecting (e.g., compact=True or include=["tracks"]).
+        """
+
+        ejector = Board(**board_args)
+        if isinstance(brd_or_file, str):
+            file = brd_or_file
+
+            def load_and_eject():
+                with local_board(file) as brd_file:
+                    brd = pcbnew.LoadBoard(brd_file)
+                try:
+                    return ejector.eject(brd)
+                finally:
+                    # The board is only needed here, so don't leave it to the collector.
+                    release_board(brd)
+
+            async with self.board_lock(file):
+                return await self.run(load_and_eject)
+
+        async with self.board_lock(brd_or_file):
+            return await self.run(ejector.eject, brd_or_file)
+
+    async def inject(self, data_dict, brd):
+        """Inject data into a KiCad BOARD object without saving it."""
+
+        async with self.board_lock(brd):
+            await self.run(Board().inject, data_dict, brd)
+
+    async def inject_and_save(self, data_dict, file, refill=True):
+        """
+        Inject data into a board file and save it.
+
+        Args:
+            data_dict: Data to inject, like the data from load_data().
+            file: Path to the board file (which may be compressed).
+            refill: If true, refill the zones affected by the data before saving.
+
+        Returns:
+            The number of zones that were refilled.
+        """
+
+        def inject_and_save():
+            with local_board(file, save=True) as brd_file:
+                brd = pcbnew.LoadBoard(brd_file)
+                try:
+                    Board().inject(data_dict, brd)
+                    num_zones = refill_zones(brd) if refill else 0
+                    brd.Save(brd_file)
+                finally:
+                    release_board(brd)
+            return num_zones
+
+        async with self.board_lock(file):
+            return await self.run(inject_and_save)
+
+    def shutdown(self, wait=True):
+        """Stop the threads once the work that's already started is done."""
+
+        self.executor.shutdown(wait=wait)
+
+
+# Executor used by the functions below.
+default_executor = None
+
+
+def get_executor():
+    """Return the executor used by the module-level functions, making it if needed."""
+
+    global default_executor
+    if default_executor is None:
+        default_executor = BoardExecutor()
+    return default_executor
+
+
+async def load_data(file):
+    """Return the data in a JSON/YAML file. See BoardExecutor.load_data()."""
+
+    return await get_executor().load_data(file)
+
+
+async def load_board(file):
+    """Return the KiCad BOARD object loaded from a board file. See BoardExecutor.load_board()."""
+
+    return await get_executor().load_board(file)
+
+
+async def eject(brd_or_file, **board_args):
+    """Return the data ejected from a board. See BoardExecutor.eject()."""
+
+    return await get_executor().eject(brd_or_file, **board_args)
+
+
+async def inject(data_dict, brd):
+    """Inject data into a KiCad BOARD object. See BoardExecutor.inject()."""
+
+    return await get_executor().inject(data_dict, brd)
+
+
+async def inject_and_save(data_dict, file, refill=True):
+    """Inject data into a board file and save it. See BoardExecutor.inject_and_save()."""
+
+    return await get_executor().inject_and_save(data_dict, file, refill)
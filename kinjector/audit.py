@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""
+Audit a set of KiCad boards against the values in a reference data file.
+
+Only the fields named in the reference are ejected from each board, and
+the boards are divided among several worker processes so a whole product
+line can be checked in about the time it takes to load a few boards.
+"""
+
+import multiprocessing
+
+from .backend import pcbnew
+from .fileio import local_board
+from .kinjector import (
+    Board,
+    Mapping,
+    ModulePosition,
+    ModulesByRef,
+    diff_dicts,
+    json_pointer_keys,
+    plain_data,
+    release_board,
+)
+from .sections import SectionIndex
+from .sexpr import find_child
+
+# Sides of the parts on the copper layers of a board file.
+layer_sides = {"F.Cu": "top", "B.Cu": "bottom"}
+
+
+def reference_fields(reference, prefix=""):
+    """
+    Return the field patterns (see Board()) that select every value in reference board data.
+
+    Keys holding a "." can't be named in a field pattern, so everything
+    below the key before them is selected instead.
+    """
+
+    fields = []
+    for key, value in reference.items():
+        if "." in str(key):
+            return [prefix[:-1]] if prefix else [None]
+        if isinstance(value, Mapping) and value:
+            sub_fields = reference_fields(value, prefix + str(key) + ".")
+            if None in sub_fields:
+                return [None]
+            fields.extend(sub_fields)
+        else:
+            fields.append(prefix + str(key))
+    return fields
+
+
+def get_pointer(data, pointer):
+    """Return the value at a JSON Pointer in some data, or raise KeyError."""
+
+    for key in json_pointer_keys(pointer):
+        if not isinstance(data, Mapping):
+            raise KeyError(key)
+        data = data[key]
+    return data
+
+
+def find_deviations(reference_dict, data_dict):
+    """
+    Compare the data ejected from a board against reference data.
+
+    Args:
+        reference_dict: Reference data dict (e.g., {"board": {"plot": {...}}}).
+        data_dict: Data dict ejected from the board.
+
+    Returns:
+        A list of (JSON Pointer, expected value, actual value) for each value
+        in the reference that's different in the board data. The actual
+        value is None if the board data doesn't have it. Values in the
+        board data that aren't in the reference are ignored.
+    """
+
+    deviations = []
+    for op in diff_dicts(data_dict, reference_dict):
+        if op["op"] == "remove":
+            continue  # Not in the reference, so it isn't checked.
+        try:
+            actual = get_pointer(data_dict, op["path"])
+        except KeyError:
+            actual = None
+        deviations.append((op["path"], op["value"], actual))
+    return sorted(deviations, key=lambda deviation: deviation[0])
+
+
+def indexed_positions(board_file, reference_dict, save_index=False):
+    """
+    Read the part positions in reference data straight from a board file.
+
+    Only the (at ...) and (layer ...) of the referenced parts are read
+    through a SectionIndex, so the board isn't loaded. The sidecar file of
+    the index is only written next to the board if save_index is true.
+
+    Returns:
+        The board data with the positions, or None if the reference holds
+        anything but part positions or the board file can't be indexed.
+    """
+
+    reference_board = reference_dict.get(Board.dict_key)
+    if not isinstance(reference_board, Mapping) or list(reference_board) != [
+        ModulesByRef.dict_key
+    ]:
+        return None
+    reference_modules = reference_board[ModulesByRef.dict_key]
+    if not isinstance(reference_modules, Mapping):
+        return None
+    for module in reference_modules.values():
+        if not isinstance(module, Mapping) or list(module) != [ModulePosition.dict_key]:
+            return None
+
+    try:
+        index = SectionIndex(board_file, save=save_index)
+    except (ValueError, IOError, OSError):
+        return None  # Compressed or unreadable, so the board has to be loaded.
+    with index:
+        modules = {}
+        for ref in reference_modules:
+            if ref not in index.modules:
+                continue  # A missing part is reported as a deviation.
+            x, y, angle = index.module_position(ref)
+            position = {"x": x, "y": y, "angle": angle}
+            layer = find_child(index.module_node(ref), "layer")
+            if layer is None or layer[1] not in layer_sides:
+                return None
+            position["side"] = layer_sides[layer[1]]
+            modules[ref] = {ModulePosition.dict_key: position}
+    return {Board.dict_key: {ModulesByRef.dict_key: modules}}
+
+
+def audit_board(task):
+    """Eject the referenced fields from a board and return its deviations from the reference."""
+
+    board_file, reference_dict, fields, save_index = task
+    try:
+        # Part positions can be read without loading the board.
+        data_dict = indexed_positions(board_file, reference_dict, save_index)
+        if data_dict is None:
+            with local_board(board_file) as brd_file:
+                brd = pcbnew.LoadBoard(brd_file)
+            try:
+                data_dict = plain_data(Board(fields=fields).eject(brd))
+            finally:
+                release_board(brd)
+    except Exception as e:
+        return board_file, [], "{}: {}".format(type(e).__name__, e)
+    return board_file, find_deviations(reference_dict, data_dict), None
+
+
+def audit_boards(reference_dict, board_files, jobs=None, save_index=False):
+    """
+    Compare boards against reference data in parallel.
+
+    Args:
+        reference_dict: Reference data dict holding the board data that
+            every board should have.
+        board_files: Paths to the KiCad board files (which may be compressed).
+        jobs: Number of worker processes. Defaults to the number of CPUs.
+        save_index: If true, the section indexes used for reading part
+            positions are stored in sidecar files next to the boards.
+
+    Returns:
+        A list with the board file, the list of deviations (see
+        find_deviations()) and an error message (None if the board could
+        be ejected) for each board, in the same order as board_files.
+    """
+
+    fields = reference_fields(reference_dict.get(Board.dict_key, {}))
+    fields = None if None in fields else fields
+    tasks = [
+        (board_file, reference_dict, fields, save_index) for board_file in board_files
+    ]
+    if not tasks:
+        return []
+
+    jobs = max(1, min(jobs or multiprocessing.cpu_count(), len(tasks)))
+    if jobs == 1:
+        return [audit_board(task) for task in tasks]
+    pool = multiprocessing.Pool(jobs, maxtasksperchild=1)
+    try:
+        return pool.map(audit_board, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def audit_report(results):
+    """
+    Return the lines of a report of the deviations found by audit_boards().
+
+    The deviations of each board are listed first, followed by the number
+    of boards that deviate for each key.
+    """
+
+    lines = []
+    boards_by_key = {}
+    for board_file, deviations, error in results:
+        if error is not None:
+            lines.append("{}: ERROR {}".format(board_file, error))
+            continue
+        if not deviations:
+            lines.append("{}: OK".format(board_file))
+            continue
+        lines.append("{}: {} deviation(s)".format(board_file, len(deviations)))
+        for pointer, expected, actual in deviations:
+            lines.append("    {}: {!r} (expected {!r})".format(pointer, actual, expected))
+            boards_by_key.setdefault(pointer, []).append(board_file)
+
+    if boards_by_key:
+        lines.append("")
+        lines.append("Deviations by key:")
+        for pointer in sorted(boards_by_key):
+            lines.append(
+                "    {}: {} of {} boards".format(
+                    pointer, len(boards_by_key[pointer]), len(results)
+                )
+            )
+    return lines
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+"""
+Select the module that provides the pcbnew API.
+
+By default this is KiCad's own pcbnew module. Setting the KINJECTOR_BACKEND
+environment variable to "fake" uses the pure-Python stand-in in
+kinjector.fake_pcbnew instead, so KinJector can be tested without KiCad.
+The variable has to be set before kinjector is imported.
+
+The rest of KinJector gets the pcbnew API from here:
+
+    from .backend import pcbnew
+"""
+
+import os
+import sys
+
+backend = os.environ.get("KINJECTOR_BACKEND", "pcbnew").lower()
+
+if backend == "fake":
+    from . import fake_pcbnew as pcbnew
+    from .fake_pcbnew import *
+elif backend == "pcbnew":
+    sys.path.append('/usr/lib/python3/dist-packages')
+    import pcbnew
+    from pcbnew import *
+else:
+    raise ImportError(
+        "Unknown KINJECTOR_BACKEND {!r} (use 'pcbnew' or 'fake').".format(backend)
+    )
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+"""
+Read and write part positions as centroid (pick-and-place) CSV files.
+
+The rows are converted one at a time as they're read or written, so the
+positions of a board with many thousands of parts never have to be held
+in a dict of part data.
+"""
+
+import csv
+
+from .kinjector import (
+    ModuleIndex,
+    ModulePosition,
+    ModulesByRef,
+    mark_zones_stale,
+)
+
+# Data for each column of a centroid file, in the default column order.
+roles = ("ref", "x", "y", "rotation", "side")
+
+# Default names of the columns in the header of a centroid file.
+default_columns = {
+    "ref": "Ref",
+    "x": "PosX",
+    "y": "PosY",
+    "rotation": "Rot",
+    "side": "Side",
+}
+
+# Nanometers in each unit of length.
+unit_scales = {"nm": 1, "mm": 1000000, "mil": 25400}
+
+
+def parse_side(value):
+    """Return "top" or "bottom" for the side of a part (e.g., "Top", "T", "bottom", "B")."""
+
+    side = value.strip().lower()
+    if side.startswith("t"):
+        return "top"
+    if side.startswith("b"):
+        return "bottom"
+    raise ValueError("Unknown side of the board: {!r}".format(value))
+
+
+def read_centroids(fp, columns=None, units="mm", origin=(0, 0)):
+    """
+    Generate the positions of parts from an open centroid CSV file.
+
+    Args:
+        fp: File object opened for reading. The first row of the file is a
+            header with the names of the columns.
+        columns: Dict with the column name for each of "ref", "x", "y",
+            "rotation" and "side". Missing entries use default_columns.
+            Names are matched without regard to case. Only the ref column
+            has to be in the file.
+        units: Units of the X and Y values: "mm", "mil" or "nm".
+        origin: (X, Y) position on the board (in nm) of the origin of the
+            X and Y values.
+
+    Yields:
+        The reference of each part and a dict with its position data,
+        e.g. ("R1", {"position": {"x": 1000000, "y": 2000000, "angle": 90.0}}).
+
+    Raises:
+        ValueError: If the header has no ref column or a value can't be read.
+    """
+
+    column_names = dict(default_columns, **(columns or {}))
+    scale = unit_scales[units]
+
+    reader = csv.reader(fp)
+    try:
+        header = [name.strip().lower() for name in next(reader)]
+    except StopIteration:
+        return  # Empty file.
+
+    # Find where the data for each role is in a row.
+    indices = {}
+    for role in roles:
+        try:
+            indices[role] = header.index(column_names[role].lower())
+        except ValueError:
+            pass  # Column isn't in the file.
+    if "ref" not in indices:
+        raise ValueError("No {!r} column in the header.".format(column_names["ref"]))
+
+    ref_index = indices.pop("ref")
+    for row in reader:
+        if not row:
+            continue  # Skip blank lines.
+        try:
+            pos = {}
+            for role, index in indices.items():
+                value = row[index]
+                if not value.strip():
+                    continue  # Empty cells keep the current value.
+                if role == "x":
+                    pos["x"] = int(round(origin[0] + float(value) * scale))
+                elif role == "y":
+                    pos["y"] = int(round(origin[1] + float(value) * scale))
+                elif role == "rotation":
+                    pos["angle"] = float(value)
+                else:
+                    pos["side"] = parse_side(value)
+        except (IndexError, ValueError) as e:
+            raise ValueError("Line {}: {}".format(reader.line_num, e))
+        yield row[ref_index].strip(), {ModulePosition.dict_key: pos}
+
+
+def board_centroids(brd):
+    """Generate the reference and position record of each part of a KiCad BOARD object, sorted by reference."""
+
+    index = ModuleIndex.of(brd).by_ref
+    position = ModulePosition()
+    for ref in sorted(index):
+        yield ref, position.eject_record(index[ref])
+
+
+def write_centroids(fp, parts, columns=None, units="mm", origin=(0, 0)):
+    """
+    Write the positions of parts to an open centroid CSV file.
+
+    Args:
+        fp: File object opened for writing.
+        parts: Iterable of (reference, position dict) pairs, like the ones
+            from board_centroids(). It can be a generator. Position data
+            that's missing from a dict is left empty in the file.
+        columns: Dict with the column name for each of "ref", "x", "y",
+            "rotation" and "side". Missing entries use default_columns.
+        units: Units of the X and Y values: "mm", "mil" or "nm".
+        origin: (X, Y) position on the board (in nm) of the origin of the
+            X and Y values.
+
+    Returns:
+        The number of parts that were written.
+    """
+
+    column_names = dict(default_columns, **(columns or {}))
+    scale = float(unit_scales[units])
+
+    writer = csv.writer(fp, lineterminator="\n")
+    writer.writerow([column_names[role] for role in roles])
+    num_parts = 0
+    for ref, pos in parts:
+        # Missing position data leaves an empty cell.
+        row = [ref, "", "", "", pos.get("side", "")]
+        if "x" in pos:
+            row[1] = "{:g}".format((pos["x"] - origin[0]) / scale)
+        if "y" in pos:
+            row[2] = "{:g}".format((pos["y"] - origin[1]) / scale)
+        if "angle" in pos:
+            row[3] = "{:g}".format(pos["angle"])
+        writer.writerow(row)
+        num_parts += 1
+    return num_parts
+
+
+def inject_centroids(fp, brd, columns=None, units="mm", origin=(0, 0)):
+    """
+    Move the parts of a KiCad BOARD object to the positions in an open centroid CSV file.
+
+    The positions are injected one row at a time as the file is read. See
+    read_centroids() for the arguments.
+
+    Returns:
+        The number of parts in the file that were found on the board.
+    """
+
+    mark_zones_stale(brd)
+    return ModulesByRef().inject_parts(
+        read_centroids(fp, columns, units, origin), brd
+    )
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""
+Find the output files affected by the changes in a range of git revisions.
+
+Every input file is injected into every output file, so a change to any
+input affects all the outputs. Otherwise, only the outputs that changed
+themselves need to be updated again.
+"""
+
+import os
+import subprocess
+
+from .fileio import STDIO
+
+
+def changed_files(rev_range, cwd="."):
+    """
+    Return the paths of the files changed in a range of git revisions.
+
+    Args:
+        rev_range: Revisions that are passed to "git diff --name-only"
+            (e.g., "HEAD~1..HEAD", "origin/master...", or "HEAD" for the
+            uncommitted changes).
+        cwd: A directory inside the git repository.
+
+    Returns:
+        A set with the real path of each changed file (including deleted files).
+
+    Raises:
+        subprocess.CalledProcessError: If git fails (e.g., for a bad revision).
+        OSError: If git can't be run.
+    """
+
+    # The changed files are listed relative to the top of the repository.
+    top_dir = subprocess.check_output(
+        ["git", "rev-parse", "--show-toplevel"], cwd=cwd
+    ).decode("utf-8").strip()
+    output = subprocess.check_output(
+        ["git", "diff", "--name-only", "-z", rev_range, "--"], cwd=top_dir
+    ).decode("utf-8")
+    return set(
+        os.path.realpath(os.path.join(top_dir, name))
+        for name in output.split("\0")
+        if name
+    )
+
+
+def affected_targets(targets, inputs, changed):
+    """
+    Return the output files that need to be updated for a set of changed files.
+
+    Args:
+        targets: Paths of the output files.
+        inputs: Paths of the files whose data goes into every output file.
+            The standard input ("-") is always taken to be changed.
+        changed: Set of the real paths of the changed files, like the one
+            from changed_files().
+
+    Returns:
+        All the targets if any of the inputs changed. Otherwise, just the
+        targets that changed (along with the standard output), in the same
+        order they were given.
+    """
+
+    def is_changed(file):
+        return file == STDIO or os.path.realpath(file) in changed
+
+    if any(is_changed(file) for file in inputs):
+        return list(targets)
+    return [file for file in targets if is_changed(file)]
@@ -1,23 +1,531 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import collections
 import json
 import logging
 import os
-import shutil
+import subprocess
 import sys
+import time
 
-import pcbnew
 import yaml
 
+from .backend import pcbnew
+from .audit import audit_boards, audit_report
+from .centroid import (
+    board_centroids,
+    inject_centroids,
+    read_centroids,
+    roles,
+    write_centroids,
+)
+from .changes import affected_targets, changed_files
+from .database import export_boards
+from .fab import plot_fab_files
+from .fragments import fragment_cache, resolve_file_refs
+from .journal import Journal
+from .memory import (
+    MemoryCeiling,
+    format_size,
+    parse_size,
+    peak_rss,
+    reset_peak_rss,
+    sample_rss,
+)
+from .fileio import (
+    STDIO,
+    FileLocks,
+    backup_file_name,
+    copy_file,
+    data_hash,
+    file_checksum,
+    file_format,
+    local_board,
+    open_file,
+    read_data,
+    stdin_format,
+)
 from .kinjector import *
 from .pckg_info import version
+from .variants import default_output, generate_variants, sweep_variants
+
+
+def sniff_format(file):
+    """Return "json", "yaml" or "kicad_pcb" for an existing file based on its contents."""
+
+    with open_file(file, "r") as fp:
+        text = fp.read()
+    try:
+        json.loads(text)
+        return "json"
+    except Exception:
+        pass
+    try:
+        if isinstance(yaml.safe_load(text), (Mapping, list)):
+            return "yaml"
+    except Exception:
+        pass
+    return "kicad_pcb"
+
+
+class DataDumper(yaml.SafeDumper):
+    """YAML dumper that stores compact Record objects as regular dicts."""
+
+
+DataDumper.add_multi_representer(
+    Record, lambda dumper, record: dumper.represent_dict(dict(record))
+)
+
+
+def write_json(data, fp):
+    """Write data to an open file as JSON."""
+
+    # Records are converted into dicts one at a time as they're written.
+    json.dump(data, fp, indent=4, default=dict)
+
+
+def write_yaml(data, fp):
+    """Write data to an open file as YAML."""
+
+    yaml.dump(data, fp, Dumper=DataDumper, default_flow_style=False)
+
+
+def centroid_options(args):
+    """Return the keyword arguments for reading/writing centroid CSV files."""
+
+    return {
+        "columns": args.csv_columns,
+        "units": args.csv_units,
+        "origin": tuple(args.csv_origin),
+    }
+
+
+def read_centroid_dict(file, args):
+    """Return a data dict with the part positions in a centroid CSV file."""
+
+    with open_file(file, "r") as fp:
+        modules = dict(read_centroids(fp, **centroid_options(args)))
+    return {Board.dict_key: {ModulesByRef.dict_key: modules}}
+
+
+def positions_dict(parts):
+    """Return a data dict with the (reference, position dict) pairs from board_centroids()."""
+
+    modules = {ref: {ModulePosition.dict_key: pos} for ref, pos in parts}
+    return {Board.dict_key: {ModulesByRef.dict_key: modules}}
+
+
+def target_format(file, args):
+    """Return the format of an output file from its extension or, failing that, its contents."""
+
+    format = file_format(file, args.format)
+    if format is None and os.path.isfile(file):
+        format = sniff_format(file)
+    return format
+
+
+def plot_fab(file, brd, jobs, logger, brd_file=None):
+    """
+    Generate the Gerber and drill files for a saved KiCad board file.
+
+    The files are stored relative to file, but the board is loaded from
+    brd_file (if given) for when file is compressed.
+    """
+
+    plot_options = brd.GetPlotOptions()
+
+    # The output directory in the plot settings is relative to the board file.
+    out_dir = os.path.join(
+        os.path.dirname(os.path.abspath(file)), str(plot_options.GetOutputDirectory())
+    )
+    layers = list(plot_options.GetLayerSelection().Seq())
+
+    manifest = plot_fab_files(brd_file or file, layers, out_dir, jobs)
+    for output in manifest["outputs"]:
+        logger.info("{file} ({layer}): {sha256}".format(**output))
+
+
+class OverlapError(Exception):
+    """Parts moved by injection overlap other parts, so the board wasn't saved."""
+
+
+def check_overlaps(file, brd, mode, logger):
+    """Report the moved parts that overlap other parts, raising OverlapError if mode is "error"."""
+
+    overlaps = find_overlaps(brd, moved_modules(brd))
+    log = logger.critical if mode == "error" else logger.warning
+    for ref1, ref2 in overlaps:
+        log("{}: {} overlaps {}.".format(file, ref1, ref2))
+    if overlaps and mode == "error":
+        raise OverlapError(
+            "Found {} overlap(s) in {}. The file was not saved.".format(
+                len(overlaps), file
+            )
+        )
+
+
+def backup_file(file):
+    """Copy a file to the first unused backup file name."""
+
+    index = 1  # Start with this backup file suffix.
+    while True:
+        backup_file = backup_file_name(file, index)
+        if not os.path.isfile(backup_file):
+            # Found an unused backup file name, so make backup.
+            copy_file(file, backup_file)
+            break  # Backup done, so break out of loop.
+        index += 1  # Else keep looking for an unused backup file name.
+
+
+def write_target(
+    file, format, output_data, injection_dict, args, logger, boards=(), centroids=()
+):
+    """
+    Store the output data in a JSON/YAML file or inject it into a KiCad board file.
+
+    An SQLite database gets the separate data for each board instead, and a
+    centroid CSV file gets the part positions. The positions in the centroid
+    files are streamed into KiCad board files after the injection dict.
+    """
+
+    # Back up the file before it's changed. Databases are only added to,
+    # so they aren't copied each time.
+    if (
+        file != STDIO
+        and os.path.isfile(file)
+        and not args.nobackup
+        and format != "sqlite"
+    ):
+        backup_file(file)
+
+    if format == "json":
+        with open_file(file, "w") as fp:
+            write_json(output_data, fp)
+    elif format == "yaml":
+        with open_file(file, "w") as fp:
+            write_yaml(output_data, fp)
+    elif format == "sqlite":
+        num_added, num_found = export_boards(file, boards)
+        logger.info(
+            "Added {} board(s) to {} ({} were already there).".format(
+                num_added, file, num_found
+            )
+        )
+    elif format == "csv":
+        modules = plain_data(injection_dict.get(Board.dict_key, {})).get(
+            ModulesByRef.dict_key, {}
+        )
+        parts = (
+            (ref, modules[ref][ModulePosition.dict_key])
+            for ref in sorted(modules)
+            if ModulePosition.dict_key in modules[ref]
+        )
+        with open_file(file, "w") as fp:
+            num_parts = write_centroids(fp, parts, **centroid_options(args))
+        logger.info("Wrote {} part position(s) to {}.".format(num_parts, file))
+    elif format == "kicad_pcb":
+        if file == STDIO or not os.path.isfile(file):
+            logger.critical(
+                "I can't make a KiCad board file from scratch: {}".format(file)
+            )
+            raise IOError("No such file: {}".format(file))
+        try:
+            inject_board(file, injection_dict, args, logger, centroids)
+        except OverlapError:
+            raise  # Already reported.
+        except Exception as e:
+            logger.critical("Hey! I can't handle this output file: {}".format(file))
+            raise e
+    else:
+        logger.critical(
+            "OK, I don't know what you want with a file like this: {}".format(file)
+        )
+        raise IOError("Unknown type of file: {}".format(file))
+
+
+# Data for the targets updated by a board worker process (see init_board_worker()).
+worker_target_data = None
+
+
+def init_board_worker(injection_dict, args, centroids):
+    """Keep the data for updating board files in a board worker process."""
+
+    global worker_target_data
+    worker_target_data = (injection_dict, args, centroids)
+
+    # Workers that weren't forked have to set up their own logging.
+    logger = logging.getLogger("kinjector")
+    if not logger.handlers:
+        setup_logger(args.debug, sys.stderr if STDIO in args.to else None)
+
+
+def write_worker_target(file):
+    """Inject the data into a board file from a board worker process."""
+
+    injection_dict, args, centroids = worker_target_data
+    write_target(
+        file,
+        "kicad_pcb",
+        None,
+        injection_dict,
+        args,
+        logging.getLogger("kinjector"),
+        centroids=centroids,
+    )
+
+
+def update_target(
+    file, format, output_data, injection_dict, args, logger, boards, centroids, ceiling
+):
+    """
+    Write a target file and log the high-water mark of the memory used for it.
+
+    With a memory ceiling, KiCad boards are updated by its worker process.
+    """
+
+    if ceiling is not None and format == "kicad_pcb":
+        peak = ceiling.run(write_worker_target, file)
+    else:
+        reset_peak_rss()
+        write_target(
+            file, format, output_data, injection_dict, args, logger, boards, centroids
+        )
+        peak = peak_rss()
+    if peak is not None:
+        logger.info("Memory high-water mark for {}: {}.".format(file, format_size(peak)))
+
+
+def inject_board(file, injection_dict, args, logger, centroids=()):
+    """
+    Inject data into a KiCad board file (which may be compressed) and save it.
+
+    The part positions in the centroid CSV files are injected after the data
+    in the injection dict.
+    """
+
+    with local_board(file, save=True) as brd_file:
+        brd = pcbnew.LoadBoard(brd_file)
+        sample_rss()
+        try:
+            # Inject the new values into the board.
+            Board().inject(injection_dict, brd)
+            sample_rss()
+            # Stream the part positions into the board one row at a time.
+            for centroid_file in centroids:
+                with open_file(centroid_file, "r") as fp:
+                    num_found = inject_centroids(fp, brd, **centroid_options(args))
+                logger.info(
+                    "Moved {} part(s) from {}.".format(num_found, centroid_file)
+                )
+            # Check the moved parts before anything is saved.
+            if args.overlaps != "ignore":
+                check_overlaps(file, brd, args.overlaps, logger)
+            # Refill the affected zones all at once.
+            if not args.norefill:
+                num_zones = refill_zones(brd)
+                logger.info("Refilled {} zones.".format(num_zones))
+                sample_rss()
+            # Overwrite the KiCad board file.
+            brd.Save(brd_file)
+            sample_rss()
+            # Generate the fabrication files from the updated board.
+            if args.plot:
+                plot_fab(file, brd, args.jobs, logger, brd_file)
+        finally:
+            # Don't keep the board around until the next one is loaded.
+            release_board(brd)
+            del brd
+
+
+def setup_logger(debug, stream=None):
+    """
+    Return the kinjector logger set up for the given debug level.
+
+    Messages go to the standard output unless another stream is given.
+    """
+
+    logger = logging.getLogger("kinjector")
+    if debug is not None:
+        log_level = logging.DEBUG + 1 - debug
+        handler = logging.StreamHandler(stream or sys.stdout)
+        handler.setLevel(log_level)
+        logger.addHandler(handler)
+        logger.setLevel(log_level)
+    return logger
+
+
+def add_debug_argument(parser):
+    """Add the option for setting the debug level to a command-line parser."""
+
+    parser.add_argument(
+        "--debug",
+        "-d",
+        nargs="?",
+        type=int,
+        default=0,
+        metavar="LEVEL",
+        help="Print debugging info. (Larger LEVEL means more info.)",
+    )
+
+
+def variants_main(argv):
+    """Command-line interface for making variants of a board."""
+
+    parser = argparse.ArgumentParser(
+        prog="kinjector variants",
+        description="""Make variants of a KiCad board by injecting every
+            combination of the parameter values in a JSON/YAML sweep file.""",
+    )
+
+    parser.add_argument("board", metavar="base.kicad_pcb", help="The base board.")
+
+    parser.add_argument(
+        "sweep",
+        metavar="sweep.[json|yaml]",
+        help="""File with the parameter values for the variants.""",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Number of variants to make at the same time. (Default is one per CPU.)",
+    )
+
+    parser.add_argument(
+        "--overwrite",
+        "-w",
+        action="store_true",
+        help="Allow existing variant files to be replaced.",
+    )
+
+    parser.add_argument(
+        "--norefill",
+        "-nr",
+        action="store_true",
+        help="""Do *not* refill the zones of the variants. (Default is to refill them.)""",
+    )
+
+    add_debug_argument(parser)
+
+    args = parser.parse_args(argv)
+    logger = setup_logger(args.debug)
+
+    with open_file(args.sweep, "r") as fp:
+        sweep = read_data(fp, file_format(args.sweep))
+    sweep = resolve_file_refs(sweep, args.sweep)
+
+    if not args.overwrite:
+        base_name = os.path.splitext(args.board)[0]
+        output = sweep.get("output", default_output)
+        for index, _ in enumerate(sweep_variants(sweep)):
+            out_file = output.format(base=base_name, index=index)
+            if os.path.isfile(out_file):
+                logger.critical(
+                    "Variant file {} already exists! Use the --overwrite option to replace it.".format(
+                        out_file
+                    )
+                )
+                sys.exit(1)
+
+    try:
+        variants = generate_variants(
+            args.board, sweep, jobs=args.jobs, refill=not args.norefill
+        )
+    except ValueError as e:
+        for error in str(e).split("\n"):
+            logger.critical(error)
+        sys.exit(1)
+
+    for out_file, params in variants:
+        logger.info(
+            "{}: {}".format(
+                out_file,
+                ", ".join("{} = {}".format(k, v) for k, v in sorted(params.items())),
+            )
+        )
+
+
+def audit_main(argv):
+    """Command-line interface for auditing boards against reference data."""
+
+    parser = argparse.ArgumentParser(
+        prog="kinjector audit",
+        description="""Compare KiCad boards against the values in a JSON/YAML
+            reference file and report the values that are different.""",
+    )
+
+    parser.add_argument(
+        "reference",
+        metavar="reference.[json|yaml]",
+        help="""File with the board data that every board should have.""",
+    )
+
+    parser.add_argument(
+        "boards", nargs="+", metavar="board.kicad_pcb", help="The boards to audit."
+    )
+
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Number of boards to audit at the same time. (Default is one per CPU.)",
+    )
+
+    parser.add_argument(
+        "--save-index",
+        action="store_true",
+        help="""Store the section index of each board in a .idx file next to it
+            so the part positions are found faster next time.""",
+    )
+
+    add_debug_argument(parser)
+
+    args = parser.parse_args(argv)
+    logger = setup_logger(args.debug)
+
+    try:
+        with open_file(args.reference, "r") as fp:
+            reference = read_data(fp, file_format(args.reference))
+        reference = resolve_file_refs(reference, args.reference)
+    except (IOError, OSError, ValueError) as e:
+        logger.critical(e)
+        sys.exit(1)
+    if not isinstance(reference, dict) or not reference.get(Board.dict_key):
+        logger.critical("{}: No {!r} data to audit.".format(args.reference, Board.dict_key))
+        sys.exit(1)
+    errors = Board().validate(reference)
+    if errors:
+        for error in errors:
+            logger.critical("{}: {}".format(args.reference, error))
+        sys.exit(1)
+
+    results = audit_boards(
+        reference, args.boards, jobs=args.jobs, save_index=args.save_index
+    )
+    for line in audit_report(results):
+        print(line)
+
+    # Fail if any board is different from the reference (e.g., in a CI job).
+    if any(deviations or error for _, deviations, error in results):
+        sys.exit(1)
 
 
 def main():
     """Command-line interface."""
 
+    # Hand off to the interface for other commands.
+    if sys.argv[1:2] == ["variants"]:
+        variants_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["audit"]:
+        audit_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
         description="""Inject/eject JSON/YAML data to/from a KiCad project file."""
     )
@@ -31,8 +539,10 @@ def main():
         "-f",
         nargs="+",
         type=str,
-        metavar="file.[json|yaml|kicad_pcb]",
-        help="""Extract values from one or more JSON/YAML/KiCad files.""",
+        metavar="file.[json|yaml|kicad_pcb|csv]",
+        help="""Extract values from one or more JSON/YAML/KiCad files
+            or part positions from centroid CSV files.
+            Use - to read from the standard input.""",
     )
 
     parser.add_argument(
@@ -40,8 +550,87 @@ def main():
         "-t",
         nargs="+",
         type=str,
-        metavar="file.[json|yaml|kicad_pcb]",
-        help="""Insert values into one or more JSON/YAML/KiCad files.""",
+        metavar="file.[json|yaml|kicad_pcb|sqlite|csv]",
+        help="""Insert values into one or more JSON/YAML/KiCad files,
+            store them in SQLite databases or write the part positions
+            to centroid CSV files. Use - to write to the standard output.""",
+    )
+
+    parser.add_argument(
+        "--format",
+        "-fmt",
+        choices=["json", "yaml"],
+        default=None,
+        help="""Format of the data written to the standard output.
+            (The format of the standard input is found from its contents.)""",
+    )
+
+    parser.add_argument(
+        "--baseline",
+        "-b",
+        type=str,
+        metavar="file.[json|yaml]",
+        help="""Store only the changes from the data in this JSON/YAML file
+            as a list of JSON Patch (RFC 6902) operations.""",
+    )
+
+    parser.add_argument(
+        "--include",
+        "-i",
+        nargs="+",
+        default=[],
+        choices=list(Board.optional_sections),
+        metavar="SECTION",
+        help="""Also extract these optional sections from KiCad files: {}.""".format(
+            ", ".join(Board.optional_sections)
+        ),
+    )
+
+    parser.add_argument(
+        "--fields",
+        "-F",
+        nargs="+",
+        default=None,
+        metavar="PATTERN",
+        help="""Only extract these fields from KiCad files
+            (e.g., modules.*.value plot.layers).""",
+    )
+
+    parser.add_argument(
+        "--region",
+        "-r",
+        nargs=4,
+        type=int,
+        default=None,
+        metavar=("X1", "Y1", "X2", "Y2"),
+        help="""Only extract data for the parts inside this rectangle
+            (in nanometers) from KiCad files.""",
+    )
+
+    parser.add_argument(
+        "--csv-units",
+        choices=["mm", "mil", "nm"],
+        default="mm",
+        help="""Units of the part positions in centroid CSV files. (Default is mm.)""",
+    )
+
+    parser.add_argument(
+        "--csv-origin",
+        nargs=2,
+        type=int,
+        default=[0, 0],
+        metavar=("X", "Y"),
+        help="""Position on the board (in nanometers) of the origin of the
+            part positions in centroid CSV files. (Default is 0 0.)""",
+    )
+
+    parser.add_argument(
+        "--csv-columns",
+        nargs="+",
+        default=[],
+        metavar="ROLE=NAME",
+        help="""Names of the columns in centroid CSV files for these roles:
+            {}. (e.g., ref=Designator x=Mid-X)""".format(", ".join(roles)),
     )
 
     parser.add_argument(
@@ -60,35 +649,140 @@ def main():
     )
 
     parser.add_argument(
-        "--debug",
-        "-d",
-        nargs="?",
+        "--norefill",
+        "-nr",
+        action="store_true",
+        help="""Do *not* refill the zones affected by the injected values
+            before saving a KiCad file. (Default is to refill them.)""",
+    )
+
+    parser.add_argument(
+        "--overlaps",
+        "-o",
+        choices=["ignore", "warn", "error"],
+        default="ignore",
+        help="""Check the parts moved by the injected values for overlaps with
+            their neighbors before saving a KiCad file. With "error", the file
+            isn't saved if any overlaps are found. (Default is "ignore".)""",
+    )
+
+    parser.add_argument(
+        "--plot",
+        "-p",
+        action="store_true",
+        help="""After injecting values into a KiCad file, generate Gerber files
+            for the layers selected in its plot settings along with the drill files.""",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        "-j",
         type=int,
-        default=0,
-        metavar="LEVEL",
-        help="Print debugging info. (Larger LEVEL means more info.)",
+        default=None,
+        metavar="N",
+        help="Number of processes for generating Gerber and drill files. (Default is one per CPU.)",
+    )
+
+    parser.add_argument(
+        "--journal",
+        type=str,
+        default=None,
+        metavar="file.jsonl",
+        help="""Record the progress of updating each file in this journal.""",
     )
 
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="""Skip the files that the journal shows were already updated
+            with the same values and haven't changed since.""",
+    )
+
+    parser.add_argument(
+        "--lock-timeout",
+        type=float,
+        default=60.0,
+        metavar="SECONDS",
+        help="""Time to wait for another kinjector run to release a file
+            before giving up. (Default is 60 seconds.)""",
+    )
+
+    parser.add_argument(
+        "--max-memory",
+        type=str,
+        default=None,
+        metavar="SIZE",
+        help="""Keep the memory used by this run under SIZE (e.g., 2G or 1500M)
+            by updating the KiCad files in a worker process that's replaced
+            before it could go over the limit.""",
+    )
+
+    parser.add_argument(
+        "--changed",
+        type=str,
+        default=None,
+        metavar="REV_RANGE",
+        help="""Only update the output files affected by the files changed in
+            this range of git revisions (e.g., HEAD~1..HEAD): all of them if an
+            input file changed, otherwise just the output files that changed.""",
+    )
+
+    add_debug_argument(parser)
+
     args = parser.parse_args()
+    start_time = time.time()
 
-    logger = logging.getLogger("kinjector")
-    if args.debug is not None:
-        log_level = logging.DEBUG + 1 - args.debug
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setLevel(log_level)
-        logger.addHandler(handler)
-        logger.setLevel(log_level)
+    # Keep messages out of data written to the standard output.
+    logger = setup_logger(
+        args.debug, sys.stderr if args.to and STDIO in args.to else None
+    )
 
     if args.from_ is None:
         logger.critical("Hey! Give me some files to extract from!")
         sys.exit(2)
 
     if args.to is None:
-        print("Hey! I need some files where I can insert values!")
+        logger.critical("Hey! I need some files where I can insert values!")
+        sys.exit(1)
+
+    if args.resume and not args.journal:
+        logger.critical("Use the --journal option to say where to resume from.")
+        sys.exit(1)
+
+    # Once the standard input is read, there's nothing left for a second read.
+    if args.from_.count(STDIO) + (args.baseline == STDIO) > 1:
+        logger.critical("Hey! The standard input (-) can only be read once.")
+        sys.exit(1)
+
+    # Get the column name for each role in the centroid CSV files.
+    csv_columns = {}
+    for column in args.csv_columns:
+        role, _, name = column.partition("=")
+        if role not in roles or not name:
+            logger.critical(
+                "Hey! {} should be ROLE=NAME with one of these roles: {}.".format(
+                    column, ", ".join(roles)
+                )
+            )
+            sys.exit(1)
+        csv_columns[role] = name
+    args.csv_columns = csv_columns
+
+    if args.max_memory is not None:
+        try:
+            args.max_memory = parse_size(args.max_memory)
+        except ValueError as e:
+            logger.critical("Hey! {}".format(e))
+            sys.exit(1)
+
+    if STDIO in args.to and args.format is None:
+        logger.critical(
+            "Use the --format option to say whether to write JSON or YAML to the standard output."
+        )
         sys.exit(1)
 
     for file in args.to:
-        if os.path.isfile(file):
+        if file != STDIO and os.path.isfile(file):
             if not args.overwrite and args.nobackup:
                 logger.critical(
                     """File {} already exists! Use the --overwrite option to
@@ -97,94 +791,284 @@ def main():
                     )
                 )
                 sys.exit(1)
-            if not args.nobackup:
-                # Create a backup file.
-                index = 1  # Start with this backup file suffix.
-                while True:
-                    backup_file = file + ".{}.bak".format(index, file)
-                    if not os.path.isfile(backup_file):
-                        # Found an unused backup file name, so make backup.
-                        shutil.copy(file, backup_file)
-                        break  # Backup done, so break out of loop.
-                    index += 1  # Else keep looking for an unused backup file name.
-
-    # Combine the input files into a single injection dict.
-    injection_dict = {}
+
+    # Load the baseline data that changes will be computed against.
+    baseline_dict = None
+    if args.baseline:
+        with open_file(args.baseline, "r") as fp:
+            baseline_dict = read_data(fp, file_format(args.baseline))
+        baseline_dict = resolve_file_refs(baseline_dict, args.baseline)
+
+    # Read the JSON/YAML input files before any board gets loaded so the
+    # fragments they use are known when looking for the changed files.
+    # The boards and centroid files are read afterwards.
+    formats = []
+    file_dicts = []
     for file in args.from_:
-        with open(file, "r") as fp:
-            try:
-                # Do this if it's a JSON file.
-                file_dict = json.load(fp)
-            except Exception:
+        format = stdin_format() if file == STDIO else file_format(file)
+        file_dict = None
+        if format not in ("csv", "kicad_pcb"):
+            with open_file(file, "r") as fp:
                 try:
-                    # Do this if it's a YAML file.
-                    fp.seek(0)
-                    file_dict = yaml.load(fp, Loader=yaml.Loader)
-                    if not isinstance(file_dict, collections.Mapping):
-                        raise Exception
+                    # Do this if it's a JSON or YAML file.
+                    file_dict = read_data(fp, format)
                 except Exception:
-                    try:
-                        # Do this if it's a KiCad board file.
-                        brd = pcbnew.LoadBoard(file)
-                        file_dict = Board().eject(brd)
-                    except Exception as e:
-                        # OK, it's none of those things.
-                        print("Hey! I can't handle this input file:", file)
-                        raise e
-
-            # Merge dict from current file into the total injection dict.
-            merge_dicts(injection_dict, file_dict)
-
-    # Insert the injection dict into each of the output files.
-    for file in args.to:
+                    pass  # Maybe it's a KiCad board file.
+            if file_dict is not None:
+                # Replace references with the shared fragments they refer to.
+                try:
+                    file_dict = resolve_file_refs(file_dict, file)
+                except (ValueError, IOError, OSError) as e:
+                    logger.critical("{}: {}".format(file, e))
+                    sys.exit(1)
+        formats.append(format)
+        file_dicts.append(file_dict)
+
+    # Skip the output files that aren't affected by the changes in the git revisions.
+    # If none of them are, the run is over without loading a single board.
+    if args.changed is not None:
         try:
-            with open(file, "r") as fp:
+            changed = changed_files(args.changed)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.critical(
+                "Hey! I can't get the files changed in {}: {}".format(args.changed, e)
+            )
+            sys.exit(1)
+        # The fragments referenced by the input files are inputs, too.
+        inputs = args.from_ + ([args.baseline] if args.baseline else [])
+        inputs.extend(fragment_cache)
+        targets = affected_targets(args.to, inputs, changed)
+        logger.info(
+            "{} of {} output file(s) affected by the changes in {}.".format(
+                len(targets), len(args.to), args.changed
+            )
+        )
+        if not targets:
+            return
+        args.to = targets
 
-                # The file exists and could be opened, now find out what type it is.
-                try:
-                    file_dict = json.load(fp)  # Causes exception if not JSON.
-                    # Overwrite the JSON file.
-                    with open(file, "w") as fp:
-                        json.dump(injection_dict, fp, indent=4)
-                except Exception:
-                    try:
-                        fp.seek(0)  # Reset to file start and test for YAML.
-
-                        # Raise an exception if the file doesn't contain YAML.
-                        file_dict = yaml.safe_load(fp)
-                        if not isinstance(file_dict, collections.Mapping):
-                            raise Exception
-
-                        # Overwrite the YAML file.
-                        with open(file, "w") as fp:
-                            yaml.safe_dump(injection_dict, fp, default_flow_style=False)
-                    except Exception:
-                        try:
-                            fp.close()
-                            # Raise exception if not KiCad board file.
-                            brd = pcbnew.LoadBoard(file)
-                            # Inject the new values into the board.
-                            Board().inject(injection_dict, brd)
-                            # Overwrite the KiCad board file.
-                            brd.Save(file)
-                        except Exception as e:
-                            print("Hey! I can't handle this output file:", file)
-                            raise e
-        except IOError as e:
-            # No existing file, so create a file with the injection dict contents.
-            file_ext = str.lower(os.path.splitext(file)[1])
-            if file_ext == ".json":
-                with open(file, "w") as fp:
-                    json.dump(injection_dict, fp, indent=4)
-            elif file_ext == ".yaml":
-                with open(file, "w") as fp:
-                    yaml.safe_dump(injection_dict, fp, default_flow_style=False)
-            elif file_ext == ".kicad_pcb":
-                print("I can't make a KiCad board file from scratch:", file)
+    # Combine the input files into a single injection dict. If there's a
+    # baseline, the changes from the baseline to the combined data are stored
+    # as a JSON Patch instead. A lone input board or patch goes straight to
+    # the JSON Patch so the data for all the parts never has to be held at once.
+    injection_dict = {}
+    patch = None
+    single_diff = baseline_dict is not None and len(args.from_) == 1
+
+    # Databases store the data from each input separately.
+    db_targets = any(file_format(file) == "sqlite" for file in args.to)
+    boards = []
+
+    # The part positions from centroid files are streamed into the boards
+    # if they're the only outputs. Otherwise, they're merged like other data.
+    stream_centroids = baseline_dict is None and all(
+        target_format(file, args) == "kicad_pcb" for file in args.to
+    )
+    centroids = []
+
+    # Only the part positions are needed from the boards if every output is
+    # a centroid file, so the rest of each board isn't ejected.
+    board_positions = (
+        baseline_dict is None
+        and args.region is None
+        and args.fields is None
+        and all(target_format(file, args) == "csv" for file in args.to)
+    )
+
+    region = None if args.region is None else {"rect": args.region}
+    ejector = Board(
+        compact=True, include=args.include, fields=args.fields, region=region
+    )
+    for i, file in enumerate(args.from_):
+        # Drop the reference to the data once it's merged.
+        file_dict, file_dicts[i] = file_dicts[i], None
+        if formats[i] == "csv":
+            if stream_centroids:
+                # Check the whole file now so no board gets changed by a bad row.
+                with open_file(file, "r") as fp:
+                    for _ in read_centroids(fp, **centroid_options(args)):
+                        pass
+                centroids.append(file)
+                continue
+            file_dict = read_centroid_dict(file, args)
+        if file_dict is None:
+            try:
+                # Do this if it's a KiCad board file.
+                with local_board(file) as brd_file:
+                    brd = pcbnew.LoadBoard(brd_file)
+            except Exception as e:
+                # OK, it's none of those things.
+                logger.critical(
+                    "Hey! I can't handle this input file: {}".format(file)
+                )
                 raise e
+            try:
+                if single_diff:
+                    # Get the changes directly from the board.
+                    patch = list(ejector.diff(brd, baseline_dict))
+                    if db_targets:
+                        boards.append((file, plain_data(ejector.eject(brd))))
+                    continue
+                if board_positions:
+                    file_dict = positions_dict(board_centroids(brd))
+                else:
+                    file_dict = ejector.eject(brd)
+                if db_targets:
+                    # Copy the data since merging can change it.
+                    boards.append((file, plain_data(file_dict)))
+            finally:
+                release_board(brd)
+                del brd
+
+        if isinstance(file_dict, list):
+            # The file holds a JSON Patch.
+            if single_diff:
+                patch = file_dict
+                continue
+            file_dict = patch_to_dict(file_dict)
+
+        # Merge dict from current file into the total injection dict.
+        merge_dicts(injection_dict, file_dict)
+
+    # Diff the combined data once so each input isn't mistaken for removing
+    # the values that are only in the other inputs.
+    if baseline_dict is not None and patch is None:
+        patch = list(diff_dicts(baseline_dict, injection_dict))
+
+    # Data files get the injection dict, or just the changes if there's a baseline.
+    if baseline_dict is not None:
+        injection_dict = patch_to_dict(patch)
+        output_data = patch
+    else:
+        output_data = injection_dict
+
+    # Check the injection dict for errors before any board gets loaded and
+    # modified. Report all the errors at once so they can be fixed together.
+    errors = Board().validate(injection_dict)
+    if errors:
+        for error in errors:
+            logger.critical(error)
+        logger.critical(
+            "Found {} error(s) in the input files. Nothing was changed.".format(
+                len(errors)
+            )
+        )
+        sys.exit(1)
+
+    # Insert the injection dict into each of the output files. The boards
+    # with overlapping parts aren't saved, but the other targets still are.
+    journal = Journal(args.journal) if args.journal else None
+    num_skipped = 0
+    overlap_errors = []
+
+    # Lock the output files so other runs can't change them (or their backups)
+    # until this run is done with them. Only the files that will be updated
+    # are locked.
+    locks = FileLocks(args.to)
+    try:
+        locks.acquire(args.lock_timeout)
+    except IOError as e:
+        logger.critical(str(e))
+        sys.exit(1)
+
+    ceiling = None
+    try:
+        # With a memory ceiling, the boards are updated by a worker process that
+        # can be replaced to give back the memory that pcbnew doesn't.
+        if args.max_memory is not None:
+            ceiling = MemoryCeiling(
+                args.max_memory,
+                logger,
+                flush=fragment_cache.clear,
+                initializer=init_board_worker,
+                initargs=(injection_dict, args, centroids),
+            )
+
+        for file in args.to:
+            # Use the extension to find the type of file, or look at what's in it.
+            format = target_format(file, args)
+
+            if journal is None or file == STDIO:
+                try:
+                    update_target(
+                        file,
+                        format,
+                        output_data,
+                        injection_dict,
+                        args,
+                        logger,
+                        boards,
+                        centroids,
+                        ceiling,
+                    )
+                except OverlapError as e:
+                    overlap_errors.append(e)
+                continue
+
+            # Hash everything that affects what's put into the file.
+            if format == "kicad_pcb":
+                input_hash = data_hash(
+                    [
+                        injection_dict,
+                        args.norefill,
+                        args.overlaps,
+                        args.plot,
+                        [file_checksum(f) for f in centroids],
+                        centroid_options(args),
+                    ]
+                )
+            elif format == "csv":
+                input_hash = data_hash([injection_dict, centroid_options(args)])
+            elif format == "sqlite":
+                input_hash = data_hash(boards)
             else:
-                print("OK, I don't know what you want with a file like this:", file)
-                raise e
+                input_hash = data_hash([output_data, format])
+
+            if args.resume and journal.is_done(file, input_hash):
+                logger.info("Skipping {}: it's already up to date.".format(file))
+                num_skipped += 1
+                continue
+
+            journal.record(file, input_hash, "started")
+            try:
+                update_target(
+                    file,
+                    format,
+                    output_data,
+                    injection_dict,
+                    args,
+                    logger,
+                    boards,
+                    centroids,
+                    ceiling,
+                )
+            except OverlapError as e:
+                journal.record(file, input_hash, "failed")
+                overlap_errors.append(e)
+                continue
+            except BaseException:
+                journal.record(file, input_hash, "failed")
+                raise
+            journal.record(file, input_hash, "done")
+    finally:
+        if ceiling is not None:
+            ceiling.close()
+        locks.release()
+
+    logger.info(
+        "Updated {} file(s) and skipped {} in {:.2f} s ({:.2f} s waiting for file locks).".format(
+            len(args.to) - num_skipped - len(overlap_errors),
+            num_skipped,
+            time.time() - start_time,
+            locks.wait_time,
+        )
+    )
+
+    # Report the boards that weren't saved once all the others are done.
+    if overlap_errors:
+        for error in overlap_errors:
+            logger.critical(str(error))
+        sys.exit(1)
 
 
 ###############################################################################
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+"""
+Store board data in an SQLite database so it can be queried across many boards.
+
+Each board is stored once for its contents: exporting a board whose data is
+already in the database only updates its name, so exports can be repeated
+as boards are added or changed. The data for a board is spread over these
+indexed tables:
+
+* boards: name, content hash and export time of each board.
+* design_rules: each design rule of each board.
+* net_classes: the parameters of each net class of each board.
+* net_assignments: the net class assigned to each net of each board.
+* via_dimensions: the via diameters and drills in the board setup.
+* plot_settings: each plot setting of each board.
+* modules: the position, side and (if ejected) value and footprint of each part.
+"""
+
+import json
+import sqlite3
+import time
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping  # Python 2.
+
+from .fileio import data_hash
+
+schema = """
+CREATE TABLE IF NOT EXISTS boards (
+    id INTEGER PRIMARY KEY,
+    content_hash TEXT NOT NULL UNIQUE,
+    name TEXT,
+    exported REAL
+);
+CREATE INDEX IF NOT EXISTS boards_name ON boards (name);
+
+CREATE TABLE IF NOT EXISTS design_rules (
+    board_id INTEGER NOT NULL REFERENCES boards (id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value,
+    PRIMARY KEY (board_id, key)
+);
+CREATE INDEX IF NOT EXISTS design_rules_key ON design_rules (key, value);
+
+CREATE TABLE IF NOT EXISTS net_classes (
+    board_id INTEGER NOT NULL REFERENCES boards (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    description TEXT,
+    clearance INTEGER,
+    track_width INTEGER,
+    via_diameter INTEGER,
+    via_drill INTEGER,
+    uvia_diameter INTEGER,
+    uvia_drill INTEGER,
+    diff_pair_width INTEGER,
+    diff_pair_gap INTEGER,
+    PRIMARY KEY (board_id, name)
+);
+CREATE INDEX IF NOT EXISTS net_classes_via_drill ON net_classes (via_drill);
+
+CREATE TABLE IF NOT EXISTS net_assignments (
+    board_id INTEGER NOT NULL REFERENCES boards (id) ON DELETE CASCADE,
+    net TEXT NOT NULL,
+    net_class TEXT,
+    PRIMARY KEY (board_id, net)
+);
+CREATE INDEX IF NOT EXISTS net_assignments_net_class ON net_assignments (net_class);
+
+CREATE TABLE IF NOT EXISTS via_dimensions (
+    board_id INTEGER NOT NULL REFERENCES boards (id) ON DELETE CASCADE,
+    diameter INTEGER,
+    drill INTEGER
+);
+CREATE INDEX IF NOT EXISTS via_dimensions_drill ON via_dimensions (drill);
+
+CREATE TABLE IF NOT EXISTS plot_settings (
+    board_id INTEGER NOT NULL REFERENCES boards (id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value,
+    PRIMARY KEY (board_id, key)
+);
+
+CREATE TABLE IF NOT EXISTS modules (
+    board_id INTEGER NOT NULL REFERENCES boards (id) ON DELETE CASCADE,
+    ref TEXT NOT NULL,
+    x INTEGER,
+    y INTEGER,
+    angle REAL,
+    side TEXT,
+    value TEXT,
+    footprint TEXT,
+    PRIMARY KEY (board_id, ref)
+);
+CREATE INDEX IF NOT EXISTS modules_ref ON modules (ref);
+CREATE INDEX IF NOT EXISTS modules_footprint ON modules (footprint);
+"""
+
+# Columns of the net_classes table for each net class parameter.
+net_class_columns = [
+    ("description", "description"),
+    ("clearance", "clearance"),
+    ("track width", "track_width"),
+    ("via diameter", "via_diameter"),
+    ("via drill", "via_drill"),
+    ("uvia diameter", "uvia_diameter"),
+    ("uvia drill", "uvia_drill"),
+    ("diff pair width", "diff_pair_width"),
+    ("diff pair gap", "diff_pair_gap"),
+]
+
+
+def db_value(value):
+    """Return a value that SQLite can store, using JSON for lists and dicts."""
+
+    if isinstance(value, (list, tuple, Mapping)):
+        return json.dumps(value, sort_keys=True, default=dict)
+    return value
+
+
+def board_rows(board_id, data_dict):
+    """Return a dict with the rows of each table (except boards) for the data of a board."""
+
+    # The data may hold compact records, which are read like dicts.
+    brd_data = data_dict.get("board", {})
+    setup = brd_data.get("board setup", {})
+    net_classes = setup.get("net classes", {})
+    tvd = setup.get("tracks, vias, diff pairs", {})
+
+    rows = {}
+    rows["design_rules"] = [
+        (board_id, key, db_value(value))
+        for key, value in setup.get("design rules", {}).items()
+    ]
+    rows["net_classes"] = [
+        (board_id, name) + tuple(params.get(key) for key, _ in net_class_columns)
+        for name, params in net_classes.get("definitions", {}).items()
+    ]
+    rows["net_assignments"] = [
+        (board_id, net, net_class)
+        for net, net_class in net_classes.get("assignments", {}).items()
+    ]
+    rows["via_dimensions"] = [
+        (board_id, dims.get("diameter"), dims.get("drill"))
+        for dims in tvd.get("via dimensions list", [])
+    ]
+    rows["plot_settings"] = [
+        (board_id, key, db_value(value))
+        for key, value in brd_data.get("plot", {}).items()
+    ]
+    rows["modules"] = []
+    for ref, module in brd_data.get("modules", {}).items():
+        pos = module.get("position", {})
+        rows["modules"].append(
+            (
+                board_id,
+                ref,
+                pos.get("x"),
+                pos.get("y"),
+                pos.get("angle"),
+                pos.get("side"),
+                module.get("value"),
+                module.get("footprint"),
+            )
+        )
+    return rows
+
+
+def export_boards(db_file, boards):
+    """
+    Store the data of several boards in an SQLite database.
+
+    Args:
+        db_file: Path to the database file. It's created if it doesn't exist.
+        boards: List of (name, data dict) pairs, one for each board. The data
+            dicts are like the ones ejected by Board().eject().
+
+    Returns:
+        The number of boards that were added and the number that were
+        already in the database.
+    """
+
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.executescript(schema)
+        num_added = num_found = 0
+
+        # Store all the boards in one transaction.
+        with conn:
+            for name, data_dict in boards:
+                content_hash = data_hash(data_dict)
+                cursor = conn.execute(
+                    "SELECT id FROM boards WHERE content_hash = ?", (content_hash,)
+                )
+                row = cursor.fetchone()
+                if row is not None:
+                    # Only the name and time change for a board that's already stored.
+                    conn.execute(
+                        "UPDATE boards SET name = ?, exported = ? WHERE id = ?",
+                        (name, time.time(), row[0]),
+                    )
+                    num_found += 1
+                    continue
+
+                cursor = conn.execute(
+                    "INSERT INTO boards (content_hash, name, exported) VALUES (?, ?, ?)",
+                    (content_hash, name, time.time()),
+                )
+                for table, rows in board_rows(cursor.lastrowid, data_dict).items():
+                    if rows:
+                        conn.executemany(
+                            "INSERT INTO {} VALUES ({})".format(
+                                table, ", ".join("?" * len(rows[0]))
+                            ),
+                            rows,
+                        )
+                num_added += 1
+    finally:
+        conn.close()
+
+    return num_added, num_found
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""
+Generate the Gerber and drill files for fabricating a KiCad board.
+
+The layers are divided among several worker processes that each load
+their own copy of the board, so the files are plotted in parallel.
+"""
+
+import json
+import multiprocessing
+import os
+
+from .backend import pcbnew
+from .fileio import file_checksum
+
+# The board loaded by each worker process.
+worker_brd = None
+
+
+def load_worker_board(board_file):
+    """Load the board that a worker process will plot."""
+
+    global worker_brd
+    worker_brd = pcbnew.LoadBoard(board_file)
+
+
+def plot_gerbers(layers, out_dir):
+    """Plot a Gerber file for each layer and return a list of the files."""
+
+    pctl = pcbnew.PLOT_CONTROLLER(worker_brd)
+    pctl.GetPlotOptions().SetOutputDirectory(out_dir)
+
+    outputs = []
+    for layer in layers:
+        layer_name = str(worker_brd.GetLayerName(layer))
+        pctl.SetLayer(layer)
+        pctl.OpenPlotfile(
+            layer_name.replace(".", "_"), pcbnew.PLOT_FORMAT_GERBER, layer_name
+        )
+        pctl.PlotLayer()
+        outputs.append({"file": str(pctl.GetPlotFileName()), "layer": layer_name})
+        pctl.ClosePlot()
+    return outputs
+
+
+def plot_drills(out_dir):
+    """Write the drill files and return a list of the files."""
+
+    plot_options = worker_brd.GetPlotOptions()
+    if plot_options.GetUseAuxOrigin():
+        offset = worker_brd.GetAuxOrigin()
+    else:
+        offset = pcbnew.wxPoint(0, 0)
+
+    writer = pcbnew.EXCELLON_WRITER(worker_brd)
+    writer.SetOptions(plot_options.GetMirror(), False, offset, False)
+    writer.SetFormat(True)  # Metric units.
+    writer.CreateDrillandMapFilesSet(out_dir, True, False)
+
+    brd_name = os.path.splitext(os.path.basename(worker_brd.GetFileName()))[0]
+    outputs = []
+    for suffix in ("-PTH.drl", "-NPTH.drl"):
+        drill_file = os.path.join(out_dir, brd_name + suffix)
+        if os.path.isfile(drill_file):
+            outputs.append({"file": drill_file, "layer": "drill"})
+    return outputs
+
+
+def run_task(task):
+    """Run a plotting task in a worker process and add checksums to its outputs."""
+
+    if task[0] == "gerbers":
+        outputs = plot_gerbers(task[1], task[2])
+    else:
+        outputs = plot_drills(task[1])
+
+    for output in outputs:
+        output["sha256"] = file_checksum(output["file"])
+    return outputs
+
+
+def plot_fab_files(board_file, layers, out_dir, jobs=None):
+    """
+    Generate Gerber and drill files for a KiCad board file in parallel.
+
+    Args:
+        board_file: Path to the KiCad board file.
+        layers: List of the layer numbers to plot as Gerber files.
+        out_dir: Directory where the files are stored.
+        jobs: Number of worker processes. Defaults to the number of CPUs.
+
+    Returns:
+        A manifest dict listing each output file with its layer and checksum.
+        The manifest is also stored as JSON in the output directory.
+    """
+
+    out_dir = os.path.abspath(out_dir)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    jobs = max(1, min(jobs or multiprocessing.cpu_count(), len(layers) + 1))
+
+    # Deal the layers out to the workers, and give the drill files their own task.
+    tasks = [("gerbers", layers[i::jobs], out_dir) for i in range(jobs)]
+    tasks = [task for task in tasks if task[1]]
+    tasks.append(("drills", out_dir))
+
+    pool = multiprocessing.Pool(
+        jobs, initializer=load_worker_board, initargs=(board_file,)
+    )
+    try:
+        results = pool.map(run_task, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    outputs = [output for result in results for output in result]
+    for output in outputs:
+        output["file"] = os.path.relpath(output["file"], out_dir)
+    outputs.sort(key=lambda output: output["file"])
+
+    manifest = {"board": os.path.abspath(board_file), "outputs": outputs}
+    brd_name = os.path.splitext(os.path.basename(board_file))[0]
+    manifest_file = os.path.join(out_dir, brd_name + "-manifest.json")
+    with open(manifest_file, "w") as fp:
+        json.dump(manifest, fp, indent=4)
+
+    return manifest
@@ -0,0 +1,1216 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pure-Python stand-in for the parts of the pcbnew module that KinJector uses.
+
+It loads KiCad 5 board files into objects with the same methods as the
+pcbnew BOARD, MODULE, NETCLASSPTR, PCB_PLOT_PARAMS and other classes, so
+the injectors can be tested without KiCad. The parsed S-expressions of the
+board file are kept, so anything the stand-in doesn't know about is saved
+back unchanged along with the values that were set.
+
+Only board settings, net classes, nets, plot settings, parts (with their
+pads and courtyards), tracks, vias and zone settings are handled. Nothing
+is drawn, plotted or filled, but the zones that would be filled are recorded
+in BOARD.filled_zones so tests can check them.
+
+Select it by setting the KINJECTOR_BACKEND environment variable to "fake"
+(see kinjector.backend).
+"""
+
+import math
+
+from .sexpr import (
+    Quoted,
+    find_child,
+    find_children,
+    format_sexpr,
+    parse_sexpr,
+    set_child,
+    set_children,
+    to_mm,
+    to_nm,
+)
+
+# Layer IDs.
+F_Cu = 0
+B_Cu = 31
+PCB_LAYER_ID_COUNT = 50
+
+# Types of the items on a board.
+PCB_MODULE_T = 3
+PCB_TRACE_T = 9
+PCB_VIA_T = 10
+PCB_ZONE_AREA_T = 15
+
+# Names of the layers of a KiCad 5 board indexed by layer ID.
+default_layer_names = (
+    ["F.Cu"]
+    + ["In{}.Cu".format(i) for i in range(1, 31)]
+    + [
+        "B.Cu",
+        "B.Adhes",
+        "F.Adhes",
+        "B.Paste",
+        "F.Paste",
+        "B.SilkS",
+        "F.SilkS",
+        "B.Mask",
+        "F.Mask",
+        "Dwgs.User",
+        "Cmts.User",
+        "Eco1.User",
+        "Eco2.User",
+        "Edge.Cuts",
+        "Margin",
+        "B.CrtYd",
+        "F.CrtYd",
+        "B.Fab",
+        "F.Fab",
+    ]
+)
+
+###############################################################################
+# Values.
+###############################################################################
+
+
+def to_float(value):
+    return float(value)
+
+
+def from_float(value):
+    return "{:.6f}".format(value)
+
+
+yes_no = {"yes": True, "no": False, "true": True, "false": False}
+
+
+###############################################################################
+# Basic types.
+###############################################################################
+
+
+class wxPoint(object):
+    """Point in nanometers."""
+
+    def __init__(self, x=0, y=0):
+        self.x = int(x)
+        self.y = int(y)
+
+    def __getitem__(self, i):
+        return (self.x, self.y)[i]
+
+    def __len__(self):
+        return 2
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "wxPoint({}, {})".format(self.x, self.y)
+
+
+class EDA_RECT(object):
+    """Rectangle given by its corners."""
+
+    def __init__(self, left=0, top=0, right=0, bottom=0):
+        self.left, self.top, self.right, self.bottom = left, top, right, bottom
+
+    def GetLeft(self):
+        return self.left
+
+    def GetTop(self):
+        return self.top
+
+    def GetRight(self):
+        return self.right
+
+    def GetBottom(self):
+        return self.bottom
+
+    def GetX(self):
+        return self.left
+
+    def GetY(self):
+        return self.top
+
+    def GetWidth(self):
+        return self.right - self.left
+
+    def GetHeight(self):
+        return self.bottom - self.top
+
+
+BOX2I = EDA_RECT
+
+
+def bounding_rect(points):
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return EDA_RECT(min(xs), min(ys), max(xs), max(ys))
+
+
+class SHAPE_POLY_SET(object):
+    """Set of polygon outlines given as lists of (x, y) points."""
+
+    def __init__(self, outlines=()):
+        self.outlines = [list(outline) for outline in outlines]
+
+    def OutlineCount(self):
+        return len(self.outlines)
+
+    def BBox(self):
+        return bounding_rect([p for outline in self.outlines for p in outline])
+
+
+class LSET(object):
+    """Set of layer IDs."""
+
+    def __init__(self, layers=()):
+        self.layers = set(layers)
+
+    def AddLayer(self, layer):
+        self.layers.add(int(layer))
+        return self
+
+    def RemoveLayer(self, layer):
+        self.layers.discard(int(layer))
+        return self
+
+    def Contains(self, layer):
+        return layer in self.layers
+
+    def Seq(self):
+        return sorted(self.layers)
+
+    def FmtHex(self):
+        mask = sum(1 << layer for layer in self.layers)
+        return "0x{:05x}_{:08x}".format(mask >> 32, mask & 0xFFFFFFFF)
+
+    @classmethod
+    def ParseHex(cls, text):
+        mask = int(text.lower().replace("0x", "").replace("_", ""), 16)
+        return cls(layer for layer in range(64) if mask & (1 << layer))
+
+
+class LIB_ID(object):
+    """Footprint library nickname and footprint name."""
+
+    def __init__(self, text=""):
+        nickname, _, item_name = text.rpartition(":")
+        self.nickname, self.item_name = nickname, item_name
+
+    def GetLibNickname(self):
+        return self.nickname
+
+    def GetLibItemName(self):
+        return self.item_name
+
+    def Format(self):
+        return self.nickname + ":" + self.item_name if self.nickname else self.item_name
+
+
+class VIA_DIMENSION(object):
+    def __init__(self, diameter=0, drill=0):
+        self.m_Diameter = diameter
+        self.m_Drill = drill
+
+
+class DIFF_PAIR_DIMENSION(object):
+    def __init__(self, width=0, gap=0, via_gap=0):
+        self.m_Width = width
+        self.m_Gap = gap
+        self.m_ViaGap = via_gap
+
+
+def intVector(values=()):
+    return list(values)
+
+
+def VIA_DIMENSION_Vector(values=()):
+    return list(values)
+
+
+def Refresh():
+    """Nothing is displayed, so there's nothing to refresh."""
+
+
+def add_get_set(cls, name, attr):
+    """Add Get<name>() and Set<name>() methods for an attribute to a class."""
+
+    setattr(cls, "Get" + name, lambda self: getattr(self, attr))
+    setattr(cls, "Set" + name, lambda self, value: setattr(self, attr, value))
+
+
+###############################################################################
+# Net classes and nets.
+###############################################################################
+
+
+class NETCLASSPTR(object):
+    """Net class with its clearance, track and via sizes and the names of its nets."""
+
+    # Parameter attribute, method name, token in the board file and default value (nm).
+    params = [
+        ("clearance", "Clearance", "clearance", 200000),
+        ("track_width", "TrackWidth", "trace_width", 250000),
+        ("via_diameter", "ViaDiameter", "via_dia", 800000),
+        ("via_drill", "ViaDrill", "via_drill", 400000),
+        ("uvia_diameter", "uViaDiameter", "uvia_dia", 300000),
+        ("uvia_drill", "uViaDrill", "uvia_drill", 100000),
+        ("diff_pair_width", "DiffPairWidth", "diff_pair_width", 200000),
+        ("diff_pair_gap", "DiffPairGap", "diff_pair_gap", 250000),
+    ]
+
+    def __init__(self, name, description=""):
+        self.name = str(name)
+        self.description = description
+        for attr, _, _, default in self.params:
+            setattr(self, attr, default)
+        self.net_names = set()
+
+    def GetName(self):
+        return self.name
+
+    def NetNames(self):
+        return self.net_names
+
+    def GetCount(self):
+        return len(self.net_names)
+
+
+add_get_set(NETCLASSPTR, "Description", "description")
+for attr, name, _, _ in NETCLASSPTR.params:
+    add_get_set(NETCLASSPTR, name, attr)
+
+NETCLASS = NETCLASSPTR
+
+
+class NETCLASSES(object):
+    """The Default net class and the other net classes indexed by name."""
+
+    def __init__(self):
+        self.default = NETCLASSPTR("Default")
+        self.net_classes = {}
+
+    def GetDefault(self):
+        return self.default
+
+    def NetClasses(self):
+        return self.net_classes
+
+    def Add(self, net_class):
+        if net_class.GetName() in self.net_classes or net_class.GetName() == "Default":
+            return False
+        self.net_classes[net_class.GetName()] = net_class
+        return True
+
+    def Remove(self, name):
+        self.net_classes.pop(str(name), None)
+
+    def Find(self, name):
+        if name == "Default":
+            return self.default
+        return self.net_classes.get(name)
+
+    def GetCount(self):
+        return len(self.net_classes)
+
+
+class NetMap(dict):
+    """Dict of nets that raises IndexError for a missing net like the pcbnew one does."""
+
+    def __missing__(self, key):
+        raise IndexError(key)
+
+
+class NETINFO_ITEM(object):
+    """Net with a name, a number and a net class."""
+
+    def __init__(self, board, name, code):
+        self.board = board
+        self.name = str(name)
+        self.code = code
+        self.class_name = "Default"
+
+    def GetNetname(self):
+        return self.name
+
+    def GetNet(self):
+        return self.code
+
+    GetNetCode = GetNet
+
+    def GetClassName(self):
+        return self.class_name
+
+    def SetClass(self, net_class):
+        self.class_name = net_class.GetName()
+
+    def GetNetClass(self):
+        return self.board.GetNetClasses().Find(self.class_name)
+
+
+class NETINFO_LIST(object):
+    def __init__(self):
+        self.nets = []
+
+    def NetsByName(self):
+        return NetMap((net.GetNetname(), net) for net in self.nets)
+
+    def NetsByNetcode(self):
+        return NetMap((net.GetNet(), net) for net in self.nets)
+
+    def GetNetCount(self):
+        return len(self.nets)
+
+
+###############################################################################
+# Board settings.
+###############################################################################
+
+
+class BOARD_DESIGN_SETTINGS(object):
+    """Design rules, layers and track/via sizes of a board."""
+
+    # Attribute, token in the setup of the board file, type and default value.
+    setup_params = [
+        ("m_TrackMinWidth", "trace_min", "size", 200000),
+        ("m_ViasMinSize", "via_min_size", "size", 400000),
+        ("m_ViasMinDrill", "via_min_drill", "size", 300000),
+        ("m_MicroViasMinSize", "uvia_min_size", "size", 200000),
+        ("m_MicroViasMinDrill", "uvia_min_drill", "size", 100000),
+        ("m_MicroViasAllowed", "uvias_allowed", "bool", False),
+        ("m_BlindBuriedViaAllowed", "blind_buried_vias_allowed", "bool", False),
+        ("m_HoleToHoleMin", "hole_to_hole_min", "size", 250000),
+        ("m_RequireCourtyards", "require_courtyards", "bool", False),
+        ("m_ProhibitOverlappingCourtyards", "prohibit_courtyard_overlap", "bool", False),
+        ("m_SolderMaskMargin", "pad_to_mask_clearance", "size", 0),
+        ("m_SolderMaskMinWidth", "solder_mask_min_width", "size", 0),
+        ("m_SolderPasteMargin", "pad_to_paste_clearance", "size", 0),
+        ("m_SolderPasteMarginRatio", "pad_to_paste_clearance_ratio", "float", 0.0),
+    ]
+
+    def __init__(self):
+        for attr, _, _, default in self.setup_params:
+            setattr(self, attr, default)
+        self.m_TrackWidthList = [0]
+        self.m_ViasDimensionsList = [VIA_DIMENSION()]
+        self.m_DiffPairDimensionsList = []
+        self.board_thickness = 1600000
+        self.enabled_layers = LSET(range(PCB_LAYER_ID_COUNT))
+        self.visible_layers = LSET(range(PCB_LAYER_ID_COUNT))
+
+    def GetBoardThickness(self):
+        return self.board_thickness
+
+    def SetBoardThickness(self, thickness):
+        self.board_thickness = thickness
+
+    def GetCopperLayerCount(self):
+        return len([l for l in self.enabled_layers.Seq() if l <= B_Cu])
+
+    def SetCopperLayerCount(self, count):
+        copper = [F_Cu, B_Cu] + list(range(1, count - 1))
+        layers = [l for l in self.enabled_layers.Seq() if l > B_Cu]
+        self.enabled_layers = LSET(layers + copper[:count])
+
+    def GetEnabledLayers(self):
+        return LSET(self.enabled_layers.Seq())
+
+    def SetEnabledLayers(self, lset):
+        self.enabled_layers = LSET(lset.Seq())
+
+    def GetVisibleLayers(self):
+        return LSET(self.visible_layers.Seq())
+
+    def SetVisibleLayers(self, lset):
+        self.visible_layers = LSET(lset.Seq())
+
+    def SetMinHoleSeparation(self, distance):
+        self.m_HoleToHoleMin = distance
+
+
+class PCB_PLOT_PARAMS(object):
+    """Plot settings of a board."""
+
+    # Method name, token in the plot settings of the board file, type and default value.
+    plot_params = [
+        ("UseGerberProtelExtensions", "usegerberextensions", "bool", False),
+        ("UseGerberX2format", "usegerberattributes", "bool", False),
+        ("IncludeGerberNetlistInfo", "usegerberadvancedattributes", "bool", False),
+        ("CreateGerberJobFile", "creategerberjobfile", "bool", False),
+        ("GerberPrecision", "gerberprecision", "int", 6),
+        ("ExcludeEdgeLayer", "excludeedgelayer", "bool", True),
+        ("LineWidth", "linewidth", "size", 100000),
+        ("PlotFrameRef", "plotframeref", "bool", False),
+        ("PlotViaOnMaskLayer", "viasonmask", "bool", False),
+        ("PlotMode", "mode", "int", 1),
+        ("UseAuxOrigin", "useauxorigin", "bool", False),
+        ("HPGLPenNum", "hpglpennumber", "int", 1),
+        ("HPGLPenSpeed", "hpglpenspeed", "int", 20),
+        ("HPGLPenDiameter", "hpglpendiameter", "float", 15.0),
+        ("Negative", "psnegative", "bool", False),
+        ("A4Output", "psa4output", "bool", False),
+        ("PlotReference", "plotreference", "bool", True),
+        ("PlotValue", "plotvalue", "bool", True),
+        ("PlotInvisibleText", "plotinvisibletext", "bool", False),
+        ("PlotPadsOnSilkLayer", "padsonsilk", "bool", False),
+        ("SubtractMaskFromSilk", "subtractmaskfromsilk", "bool", False),
+        ("Format", "outputformat", "int", 1),
+        ("Mirror", "mirror", "bool", False),
+        ("DrillMarksType", "drillshape", "int", 1),
+        ("ScaleSelection", "scaleselection", "int", 1),
+        ("OutputDirectory", "outputdirectory", "str", ""),
+        ("AutoScale", "autoscale", "bool", False),
+        ("DXFPlotPolygonMode", "dxfpolygonmode", "bool", True),
+        ("FineScaleAdjustX", "finescaleadjustx", "float", 1.0),
+        ("FineScaleAdjustY", "finescaleadjusty", "float", 1.0),
+        ("Scale", "scale", "float", 1.0),
+        ("SkipPlotNPTH_Pads", "skipnpthpads", "bool", False),
+        ("TextMode", "textmode", "int", 0),
+        ("WidthAdjust", "widthadjust", "int", 0),
+    ]
+
+    def __init__(self):
+        for name, _, _, default in self.plot_params:
+            setattr(self, "m_" + name, default)
+        self.layer_selection = LSET()
+
+    def GetLayerSelection(self):
+        return LSET(self.layer_selection.Seq())
+
+    def SetLayerSelection(self, lset):
+        self.layer_selection = LSET(lset.Seq())
+
+
+for name, _, _, _ in PCB_PLOT_PARAMS.plot_params:
+    add_get_set(PCB_PLOT_PARAMS, name, "m_" + name)
+
+
+# Readers and writers of values in the board file for each type of value.
+value_readers = {
+    "size": to_nm,
+    "bool": lambda v: yes_no[v],
+    "int": int,
+    "float": to_float,
+    "str": str,
+}
+value_writers = {
+    "size": to_mm,
+    "int": str,
+    "float": from_float,
+    "str": Quoted,
+}
+
+###############################################################################
+# Parts.
+###############################################################################
+
+
+def rotate(x, y, angle):
+    """Rotate a point by an angle in degrees the way KiCad does (Y points down)."""
+
+    if not angle:
+        return x, y
+    radians = math.radians(angle)
+    cos, sin = math.cos(radians), math.sin(radians)
+    return x * cos + y * sin, -x * sin + y * cos
+
+
+def node_point(node, key):
+    """Return the (x, y) in nm of a child node like (at 1.5 2.5), or None."""
+
+    child = find_child(node, key)
+    if child is None:
+        return None
+    return to_nm(child[1]), to_nm(child[2])
+
+
+def flip_layer_name(name):
+    if name.startswith("F."):
+        return "B." + name[2:]
+    if name.startswith("B."):
+        return "F." + name[2:]
+    if name.startswith("*."):
+        return name
+    return name
+
+
+class D_PAD(object):
+    """Pad of a part."""
+
+    def __init__(self, module, node):
+        self.module = module
+        self.node = node
+
+    def GetName(self):
+        return str(self.node[1])
+
+    def GetLocalPosition(self):
+        at = find_child(self.node, "at")
+        return to_nm(at[1]), to_nm(at[2])
+
+    def GetPosition(self):
+        return self.module.to_board(*self.GetLocalPosition())
+
+    def GetCorners(self):
+        """Return the corners of the rectangle around the pad on the board."""
+
+        at = find_child(self.node, "at")
+        angle = float(at[3]) if len(at) > 3 else self.module.orientation
+        size = find_child(self.node, "size")
+        half_w, half_h = to_nm(size[1]) / 2.0, to_nm(size[2]) / 2.0
+        center = self.GetPosition()
+        corners = []
+        for dx, dy in ((-half_w, -half_h), (half_w, -half_h), (half_w, half_h), (-half_w, half_h)):
+            dx, dy = rotate(dx, dy, angle)
+            corners.append((int(round(center.x + dx)), int(round(center.y + dy))))
+        return corners
+
+
+class MODULE(object):
+    """Part placed on a board, kept as the S-expression node from the board file."""
+
+    # Keys of the child nodes whose coordinates are mirrored when a part is flipped.
+    point_keys = ("at", "start", "end", "center", "xy")
+
+    def __init__(self, board, node):
+        self.board = board
+        self.node = node
+        at = find_child(node, "at")
+        self.position = wxPoint(to_nm(at[1]), to_nm(at[2]))
+        self.orientation = float(at[3]) if len(at) > 3 else 0.0
+        self.layer = board.GetLayerID(find_child(node, "layer")[1])
+        self.locked = "locked" in node[2:] and not isinstance(node[node.index("locked")], list)
+
+    def fp_text(self, kind):
+        for child in find_children(self.node, "fp_text"):
+            if child[1] == kind:
+                return child
+        return None
+
+    def to_board(self, x, y):
+        """Return the position on the board of a point given relative to the part."""
+
+        x, y = rotate(x, y, self.orientation)
+        return wxPoint(int(round(self.position.x + x)), int(round(self.position.y + y)))
+
+    def GetReference(self):
+        return str(self.fp_text("reference")[2])
+
+    def SetReference(self, ref):
+        self.fp_text("reference")[2] = str(ref)
+
+    def GetValue(self):
+        return str(self.fp_text("value")[2])
+
+    def SetValue(self, value):
+        self.fp_text("value")[2] = str(value)
+
+    def GetPath(self):
+        path = find_child(self.node, "path")
+        return str(path[1]) if path else ""
+
+    def SetPath(self, path):
+        set_child(self.node, "path", str(path))
+
+    def GetFPID(self):
+        return LIB_ID(self.node[1])
+
+    def GetPosition(self):
+        return wxPoint(self.position.x, self.position.y)
+
+    def SetPosition(self, pos):
+        self.position = wxPoint(pos.x, pos.y)
+
+    def GetOrientationDegrees(self):
+        return self.orientation
+
+    def SetOrientationDegrees(self, angle):
+        # Like KiCad, keep the angle within (-180, 180].
+        angle = float(angle)
+        while angle <= -180.0:
+            angle += 360.0
+        while angle > 180.0:
+            angle -= 360.0
+        self.rotate_pads(angle - self.orientation)
+        self.orientation = angle
+
+    def rotate_pads(self, delta):
+        # The pad angles in the board file include the angle of the part.
+        for pad in self.Pads():
+            at = find_child(pad.node, "at")
+            if len(at) > 3:
+                at[3] = from_angle(float(at[3]) + delta)
+            elif delta:
+                at.append(from_angle(self.orientation + delta))
+
+    def GetLayer(self):
+        return self.layer
+
+    def IsFlipped(self):
+        return self.layer == B_Cu
+
+    def IsLocked(self):
+        return self.locked
+
+    def SetLocked(self, locked):
+        self.locked = bool(locked)
+
+    def Flip(self, center):
+        """Move the part to the other side of the board, mirroring it across the Y of center."""
+
+        self.position = wxPoint(self.position.x, 2 * center.y - self.position.y)
+        self.layer = B_Cu if self.layer == F_Cu else F_Cu
+
+        # Mirror everything in the part and move it to the layers on the other side.
+        def flip(node):
+            for child in node:
+                if not isinstance(child, list) or not child:
+                    continue
+                if child[0] == "model":
+                    continue  # 3D models have their own coordinates.
+                if child[0] in self.point_keys and len(child) >= 3:
+                    child[2] = to_mm(-to_nm(child[2]))
+                    if child[0] == "at" and len(child) > 3 and node[0] == "pad":
+                        child[3] = from_angle(-float(child[3]))
+                elif child[0] == "layer":
+                    child[1] = flip_layer_name(child[1])
+                elif child[0] == "layers":
+                    child[1:] = [flip_layer_name(name) for name in child[1:]]
+                else:
+                    flip(child)
+
+        for child in self.node:
+            if isinstance(child, list) and child and child[0] not in ("at", "layer", "model"):
+                flip([self.node[0], child])
+
+        # KiCad keeps the angle of a flipped part in [0, 360).
+        self.orientation = -self.orientation % 360.0
+
+    def Pads(self):
+        return [D_PAD(self, node) for node in find_children(self.node, "pad")]
+
+    def GraphicalItems(self):
+        return find_children(self.node, "fp_line")
+
+    def GetBoundingBox(self):
+        """Return the rectangle around the pads and lines of the part."""
+
+        points = [(self.position.x, self.position.y)]
+        for pad in self.Pads():
+            points.extend(pad.GetCorners())
+        for line in self.GraphicalItems():
+            width = find_child(line, "width")
+            half_width = to_nm(width[1]) // 2 if width else 0
+            for key in ("start", "end"):
+                pos = self.to_board(*node_point(line, key))
+                points.append((pos.x - half_width, pos.y - half_width))
+                points.append((pos.x + half_width, pos.y + half_width))
+        return bounding_rect(points)
+
+    def BuildPolyCourtyard(self):
+        """Find the courtyards on each side of the part from its courtyard lines."""
+
+        self.courtyards = {}
+        for side in ("F", "B"):
+            points = []
+            for line in self.GraphicalItems():
+                if find_child(line, "layer")[1] == side + ".CrtYd":
+                    for key in ("start", "end"):
+                        pos = self.to_board(*node_point(line, key))
+                        points.append((pos.x, pos.y))
+            self.courtyards[side] = SHAPE_POLY_SET([points] if points else [])
+
+    def GetPolyCourtyardFront(self):
+        return self.courtyards["F"]
+
+    def GetPolyCourtyardBack(self):
+        return self.courtyards["B"]
+
+    def Type(self):
+        return PCB_MODULE_T
+
+    def save_node(self):
+        """Store the state of the part in its S-expression node."""
+
+        at = [to_mm(self.position.x), to_mm(self.position.y)]
+        if self.orientation:
+            at.append(from_angle(self.orientation))
+        set_child(self.node, "at", *at)
+        set_child(self.node, "layer", self.board.GetLayerName(self.layer))
+        if "locked" in self.node[2:]:
+            self.node.remove("locked")
+        if self.locked:
+            self.node.insert(2, "locked")
+
+
+def from_angle(angle):
+    return "{:g}".format(round(angle, 6))
+
+
+###############################################################################
+# Tracks and zones.
+###############################################################################
+
+
+class BOARD_ITEM(object):
+    """Item of a board kept as the S-expression node from the board file."""
+
+    def __init__(self, board, node):
+        self.board = board
+        self.node = node
+
+    def Cast(self):
+        return self
+
+    def GetNetname(self):
+        net = find_child(self.node, "net")
+        return self.board.FindNet(int(net[1])).GetNetname() if net else ""
+
+    def GetNetCode(self):
+        net = find_child(self.node, "net")
+        return int(net[1]) if net else 0
+
+    def SetNet(self, net):
+        set_child(self.node, "net", str(net.GetNet()))
+
+    def GetLayer(self):
+        return self.board.GetLayerID(find_child(self.node, "layer")[1])
+
+
+class TRACK(BOARD_ITEM):
+    """Track segment."""
+
+    def Type(self):
+        return PCB_TRACE_T
+
+    def GetStart(self):
+        return wxPoint(*node_point(self.node, "start"))
+
+    def GetEnd(self):
+        return wxPoint(*node_point(self.node, "end"))
+
+    def GetWidth(self):
+        return to_nm(find_child(self.node, "width")[1])
+
+    def SetWidth(self, width):
+        set_child(self.node, "width", to_mm(width))
+
+
+class VIA(TRACK):
+    """Via between copper layers."""
+
+    def Type(self):
+        return PCB_VIA_T
+
+    def GetPosition(self):
+        return wxPoint(*node_point(self.node, "at"))
+
+    GetStart = GetEnd = GetPosition
+
+    def GetWidth(self):
+        return to_nm(find_child(self.node, "size")[1])
+
+    def SetWidth(self, width):
+        set_child(self.node, "size", to_mm(width))
+
+    def GetDrillValue(self):
+        drill = find_child(self.node, "drill")
+        if drill is not None:
+            return to_nm(drill[1])
+        # A via without its own drill uses the one from its net class.
+        net_class = self.board.FindNet(self.GetNetCode()).GetNetClass()
+        return (net_class or self.board.GetNetClasses().GetDefault()).GetViaDrill()
+
+    def SetDrill(self, drill):
+        set_child(self.node, "drill", to_mm(drill))
+
+    def layer_ids(self):
+        return sorted(self.board.GetLayerID(n) for n in find_child(self.node, "layers")[1:])
+
+    def GetLayer(self):
+        return self.TopLayer()
+
+    def TopLayer(self):
+        return self.layer_ids()[0]
+
+    def BottomLayer(self):
+        return self.layer_ids()[-1]
+
+
+class ZONE_CONTAINER(BOARD_ITEM):
+    """Copper zone. Only its settings can be changed."""
+
+    # Pad connections for the keyword after connect_pads (None means thermal reliefs).
+    pad_connections = {"no": 0, None: 1, "yes": 2, "thru_hole_only": 3}
+
+    def Type(self):
+        return PCB_ZONE_AREA_T
+
+    def GetNetname(self):
+        net_name = find_child(self.node, "net_name")
+        return str(net_name[1]) if net_name else ""
+
+    def connect_pads(self):
+        node = find_child(self.node, "connect_pads")
+        if node is None:
+            node = ["connect_pads", ["clearance", "0"]]
+            self.node.append(node)
+        return node
+
+    def fill(self):
+        node = find_child(self.node, "fill")
+        if node is None:
+            node = ["fill"]
+            self.node.append(node)
+        return node
+
+    def GetZoneClearance(self):
+        return to_nm(find_child(self.connect_pads(), "clearance")[1])
+
+    def SetZoneClearance(self, clearance):
+        set_child(self.connect_pads(), "clearance", to_mm(clearance))
+
+    def GetPadConnection(self):
+        node = self.connect_pads()
+        keyword = node[1] if len(node) > 1 and not isinstance(node[1], list) else None
+        return self.pad_connections[keyword]
+
+    def SetPadConnection(self, connection):
+        keywords = {v: k for k, v in self.pad_connections.items()}
+        node = self.connect_pads()
+        if len(node) > 1 and not isinstance(node[1], list):
+            del node[1]
+        if keywords[connection] is not None:
+            node.insert(1, keywords[connection])
+
+    def GetMinThickness(self):
+        node = find_child(self.node, "min_thickness")
+        return to_nm(node[1]) if node else 254000
+
+    def SetMinThickness(self, thickness):
+        set_child(self.node, "min_thickness", to_mm(thickness))
+
+    def GetThermalReliefGap(self):
+        node = find_child(self.fill(), "thermal_gap")
+        return to_nm(node[1]) if node else 508000
+
+    def SetThermalReliefGap(self, gap):
+        set_child(self.fill(), "thermal_gap", to_mm(gap))
+
+    def GetThermalReliefCopperBridge(self):
+        node = find_child(self.fill(), "thermal_bridge_width")
+        return to_nm(node[1]) if node else 508000
+
+    def SetThermalReliefCopperBridge(self, width):
+        set_child(self.fill(), "thermal_bridge_width", to_mm(width))
+
+    def GetPriority(self):
+        node = find_child(self.node, "priority")
+        return int(node[1]) if node else 0
+
+    def SetPriority(self, priority):
+        set_child(self.node, "priority", str(priority))
+
+    def GetFillMode(self):
+        node = find_child(self.fill(), "mode")
+        return 1 if node and node[1] == "segment" else 0
+
+    def SetFillMode(self, mode):
+        fill = self.fill()
+        if mode == 1:
+            set_child(fill, "mode", "segment")
+        else:
+            set_children(fill, "mode", [])
+
+
+class ZONE_FILLER(object):
+    """Zones aren't filled by the stand-in, so this just records them on the board."""
+
+    def __init__(self, board):
+        self.board = board
+
+    def Fill(self, zones, check=False):
+        self.board.filled_zones.append(list(zones))
+        return True
+
+
+###############################################################################
+# Boards.
+###############################################################################
+
+
+class BOARD(object):
+    """Board loaded from a KiCad 5 board file."""
+
+    def __init__(self, node=None, file_name=""):
+        if node is None:
+            node = ["kicad_pcb", ["version", "20171130"], ["host", "kinjector", "fake"]]
+        if not node or node[0] != "kicad_pcb":
+            raise IOError("Not a KiCad board file: {}".format(file_name))
+        self.node = node
+        self.file_name = file_name
+
+        # Zones given to each ZONE_FILLER.Fill() call.
+        self.filled_zones = []
+
+        # Layers.
+        self.layer_names = list(default_layer_names)
+        self.layer_types = {}
+        design_settings = self.design_settings = BOARD_DESIGN_SETTINGS()
+        layers_node = find_child(node, "layers")
+        if layers_node is not None:
+            enabled, visible = [], []
+            for layer in layers_node[1:]:
+                layer_id = int(layer[0])
+                self.layer_names[layer_id] = str(layer[1])
+                self.layer_types[layer_id] = layer[2]
+                enabled.append(layer_id)
+                if "hide" not in layer[3:]:
+                    visible.append(layer_id)
+            design_settings.SetEnabledLayers(LSET(enabled))
+            design_settings.SetVisibleLayers(LSET(visible))
+        general = find_child(node, "general")
+        if general is not None and find_child(general, "thickness") is not None:
+            design_settings.SetBoardThickness(to_nm(find_child(general, "thickness")[1]))
+
+        # Design settings and plot settings.
+        self.plot_params = PCB_PLOT_PARAMS()
+        setup = find_child(node, "setup") or []
+        for attr, token, kind, _ in design_settings.setup_params:
+            child = find_child(setup, token)
+            if child is not None:
+                setattr(design_settings, attr, value_readers[kind](child[1]))
+        design_settings.m_TrackWidthList = [0] + [
+            to_nm(child[1]) for child in find_children(setup, "user_trace_width")
+        ]
+        design_settings.m_ViasDimensionsList = [VIA_DIMENSION()] + [
+            VIA_DIMENSION(to_nm(child[1]), to_nm(child[2]))
+            for child in find_children(setup, "user_via")
+        ]
+        plot_node = find_child(setup, "pcbplotparams") or []
+        for name, token, kind, _ in self.plot_params.plot_params:
+            child = find_child(plot_node, token)
+            if child is not None:
+                setattr(self.plot_params, "m_" + name, value_readers[kind](child[1]))
+        selection = find_child(plot_node, "layerselection")
+        if selection is not None:
+            self.plot_params.SetLayerSelection(LSET.ParseHex(selection[1]))
+
+        # Nets and net classes.
+        self.net_info = NETINFO_LIST()
+        for child in find_children(node, "net"):
+            self.net_info.nets.append(NETINFO_ITEM(self, child[2], int(child[1])))
+        nets = self.net_info.NetsByName()
+        self.net_classes = NETCLASSES()
+        for child in find_children(node, "net_class"):
+            if child[1] == "Default":
+                net_class = self.net_classes.GetDefault()
+            else:
+                net_class = NETCLASSPTR(child[1])
+                self.net_classes.Add(net_class)
+            net_class.SetDescription(
+                str(child[2]) if len(child) > 2 and not isinstance(child[2], list) else ""
+            )
+            for attr, _, token, _ in net_class.params:
+                param = find_child(child, token)
+                if param is not None:
+                    setattr(net_class, attr, to_nm(param[1]))
+            for add_net in find_children(child, "add_net"):
+                net_class.NetNames().add(str(add_net[1]))
+                if add_net[1] in nets:
+                    nets[add_net[1]].SetClass(net_class)
+
+        # Parts, tracks and zones.
+        self.modules = [MODULE(self, child) for child in find_children(node, "module")]
+        self.tracks = []
+        for child in node:
+            if isinstance(child, list) and child and child[0] in ("segment", "via"):
+                self.tracks.append((TRACK if child[0] == "segment" else VIA)(self, child))
+        self.zones = [ZONE_CONTAINER(self, child) for child in find_children(node, "zone")]
+
+    def GetFileName(self):
+        return self.file_name
+
+    def SetFileName(self, file_name):
+        self.file_name = file_name
+
+    def GetLayerName(self, layer):
+        return self.layer_names[layer]
+
+    def GetLayerID(self, name):
+        try:
+            return self.layer_names.index(name)
+        except ValueError:
+            return -1  # UNDEFINED_LAYER
+
+    def GetDesignSettings(self):
+        return self.design_settings
+
+    def SetDesignSettings(self, design_settings):
+        self.design_settings = design_settings
+
+    def GetEnabledLayers(self):
+        return self.design_settings.GetEnabledLayers()
+
+    def SetEnabledLayers(self, lset):
+        self.design_settings.SetEnabledLayers(lset)
+
+    def GetVisibleLayers(self):
+        return self.design_settings.GetVisibleLayers()
+
+    def SetVisibleLayers(self, lset):
+        self.design_settings.SetVisibleLayers(lset)
+
+    def GetCopperLayerCount(self):
+        return self.design_settings.GetCopperLayerCount()
+
+    def GetPlotOptions(self):
+        return self.plot_params
+
+    def SetPlotOptions(self, plot_params):
+        self.plot_params = plot_params
+
+    def GetNetClasses(self):
+        return self.net_classes
+
+    def GetAllNetClasses(self):
+        net_classes = dict(self.net_classes.NetClasses())
+        net_classes["Default"] = self.net_classes.GetDefault()
+        return net_classes
+
+    def GetNetInfo(self):
+        return self.net_info
+
+    def GetNetCount(self):
+        return self.net_info.GetNetCount()
+
+    def FindNet(self, name_or_code):
+        for net in self.net_info.nets:
+            if name_or_code in (net.GetNetname(), net.GetNet()):
+                return net
+        return None
+
+    def GetModules(self):
+        return list(self.modules)
+
+    def FindModuleByReference(self, ref):
+        for module in self.modules:
+            if module.GetReference() == ref:
+                return module
+        return None
+
+    def GetTracks(self):
+        return list(self.tracks)
+
+    def Zones(self):
+        return list(self.zones)
+
+    def GetAuxOrigin(self):
+        setup = find_child(self.node, "setup") or []
+        origin = node_point(setup, "aux_axis_origin")
+        return wxPoint(*origin) if origin else wxPoint(0, 0)
+
+    def save_node(self):
+        """Store the state of the board in its S-expression nodes."""
+
+        node = self.node
+        design_settings = self.design_settings
+
+        general = find_child(node, "general") or set_child(node, "general")
+        set_child(general, "thickness", to_mm(design_settings.GetBoardThickness()))
+
+        visible = set(design_settings.GetVisibleLayers().Seq())
+        layers = []
+        for layer in design_settings.GetEnabledLayers().Seq():
+            layer_type = self.layer_types.get(layer, "signal" if layer <= B_Cu else "user")
+            entry = [str(layer), self.layer_names[layer], layer_type]
+            if layer not in visible:
+                entry.append("hide")
+            layers.append(entry)
+        set_child(node, "layers", *layers)
+
+        setup = find_child(node, "setup") or set_child(node, "setup")
+        for attr, token, kind, _ in design_settings.setup_params:
+            value = getattr(design_settings, attr)
+            if kind == "bool":
+                set_child(setup, token, "yes" if value else "no")
+            else:
+                set_child(setup, token, value_writers[kind](value))
+        set_children(
+            setup,
+            "user_trace_width",
+            [[to_mm(width)] for width in design_settings.m_TrackWidthList[1:]],
+        )
+        set_children(
+            setup,
+            "user_via",
+            [
+                [to_mm(via.m_Diameter), to_mm(via.m_Drill)]
+                for via in design_settings.m_ViasDimensionsList[1:]
+            ],
+        )
+        plot_node = find_child(setup, "pcbplotparams") or set_child(setup, "pcbplotparams")
+        set_child(plot_node, "layerselection", self.plot_params.GetLayerSelection().FmtHex())
+        for name, token, kind, _ in self.plot_params.plot_params:
+            value = getattr(self.plot_params, "m_" + name)
+            if kind == "bool":
+                set_child(plot_node, token, "true" if value else "false")
+            else:
+                set_child(plot_node, token, value_writers[kind](value))
+
+        # The nets in each net class come from the classes assigned to the nets.
+        net_names = {}
+        for net in self.net_info.nets:
+            net_names.setdefault(net.GetClassName(), []).append(net.GetNetname())
+        net_class_nodes = []
+        all_classes = self.GetAllNetClasses()
+        for name in ["Default"] + sorted(n for n in all_classes if n != "Default"):
+            net_class = all_classes[name]
+            class_node = ["net_class", name, Quoted(net_class.GetDescription())]
+            for attr, _, token, _ in net_class.params:
+                class_node.append([token, to_mm(getattr(net_class, attr))])
+            for net_name in sorted(net_names.get(name, [])):
+                if net_name:
+                    class_node.append(["add_net", Quoted(net_name)])
+            net_class_nodes.append(class_node)
+        indices = [i for i, item in enumerate(node) if isinstance(item, list) and item and item[0] == "net_class"]
+        if indices:
+            index = indices[0]
+        else:
+            nets = [i for i, item in enumerate(node) if isinstance(item, list) and item and item[0] == "net"]
+            index = nets[-1] + 1 if nets else len(node)
+        for i in reversed(indices):
+            del node[i]
+        node[index:index] = net_class_nodes
+
+        for module in self.modules:
+            module.save_node()
+
+    def Save(self, file_name):
+        """Write the board to a file."""
+
+        self.save_node()
+        with open(file_name, "w") as fp:
+            fp.write(format_sexpr(self.node) + "\n")
+        return True
+
+
+def LoadBoard(file_name):
+    """Return the BOARD object for a KiCad board file."""
+
+    with open(file_name, "r") as fp:
+        text = fp.read()
+    try:
+        node = parse_sexpr(text)
+    except IOError as e:
+        raise IOError("{}: {}".format(file_name, e))
+    if not isinstance(node, list):
+        raise IOError("Not a KiCad board file: {}".format(file_name))
+    return BOARD(node, file_name)
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+
+"""
+Open data and board files that may be compressed.
+
+The compression of a file is chosen by its extension (e.g., "data.json.gz"),
+and the data is streamed through the compressor as it's read or written.
+KiCad can only load and save plain board files, so compressed boards are
+decompressed to a temporary file while they're being used.
+
+A file name of "-" means the standard input (for reading) or the standard
+output (for writing) so data can be piped between programs.
+
+Files that several programs may change at once are protected by advisory
+locks on ".lock" files next to them. Files and data are hashed so it can be
+told whether they've changed since they were last used.
+
+JSON and YAML data files are read here too, keeping the !include tags of
+YAML files for kinjector.fragments to resolve.
+"""
+
+import bz2
+import contextlib
+import errno
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping  # Python 2.
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # No advisory locks on Windows.
+
+try:
+    import lzma
+except ImportError:
+    lzma = None  # Python 2 has no lzma module.
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # Optional dependency.
+
+PY2 = sys.version_info[0] == 2
+
+# Functions that open a compressed file for each compression extension.
+compressors = {
+    ".gz": gzip.open,
+    ".bz2": bz2.BZ2File if PY2 else bz2.open,
+}
+if lzma is not None:
+    compressors[".xz"] = lzma.open
+if zstandard is not None:
+    compressors[".zst"] = zstandard.open
+
+# File name for the standard input/output.
+STDIO = "-"
+
+# Buffered reader for the standard input. There's only one so data that's
+# been peeked at isn't lost.
+stdin_buffer = None
+
+# File formats for each extension of an uncompressed file.
+formats = {
+    ".json": "json",
+    ".yaml": "yaml",
+    ".yml": "yaml",
+    ".kicad_pcb": "kicad_pcb",
+    ".sqlite": "sqlite",
+    ".sqlite3": "sqlite",
+    ".db": "sqlite",
+    ".csv": "csv",
+}
+
+
+def split_compression(file):
+    """
+    Split the compression extension from a file name.
+
+    Returns:
+        The file name without the compression extension, and the extension
+        (or None if the file isn't compressed).
+    """
+
+    base, ext = os.path.splitext(file)
+    if ext.lower() in compressors:
+        return base, ext.lower()
+    return file, None
+
+
+def get_stdin_buffer():
+    """Return the buffered reader for the standard input."""
+
+    global stdin_buffer
+    if stdin_buffer is None:
+        # Read a duplicate of the standard input so closing it doesn't close the original.
+        stdin_buffer = io.open(os.dup(sys.stdin.fileno()), "rb")
+    return stdin_buffer
+
+
+class StdinReader(io.TextIOWrapper):
+    """
+    Text reader for the standard input.
+
+    All the readers share the same buffered reader, so closing a reader
+    detaches it from the buffer instead of closing the buffer.
+    """
+
+    def __init__(self, buffer):
+        super(StdinReader, self).__init__(buffer)
+        self.detached = False
+
+    def close(self):
+        if not self.detached:
+            self.detached = True
+            self.detach()
+
+
+def stdin_format():
+    """
+    Return "kicad_pcb" if the standard input holds a KiCad board, or None if it doesn't.
+
+    Only the start of the input is looked at, and none of it is consumed.
+    """
+
+    if get_stdin_buffer().peek(64).lstrip().startswith(b"("):
+        return "kicad_pcb"
+    return None
+
+
+def file_format(file, stdio_format=None):
+    """
+    Return "json", "yaml", "kicad_pcb", "sqlite" or "csv" for a file based on its extension, or None if unknown.
+
+    The standard input/output has no extension, so stdio_format is returned for it.
+    """
+
+    if file == STDIO:
+        return stdio_format
+    ext = os.path.splitext(split_compression(file)[0])[1]
+    return formats.get(ext.lower())
+
+
+def open_file(file, mode="r"):
+    """
+    Open a file that may be compressed.
+
+    Args:
+        file: Path to the file. A compression extension (e.g., ".gz") makes
+            the data go through the matching compressor.
+        mode: "r" to read text from the file, or "w" to write it.
+
+    Returns:
+        A file object for reading or writing text.
+    """
+
+    if file == STDIO:
+        if mode == "r":
+            return StdinReader(get_stdin_buffer())
+        # Use a duplicate of the standard output so closing the file object
+        # doesn't close it.
+        sys.stdout.flush()  # Anything already written has to come first.
+        return os.fdopen(os.dup(sys.stdout.fileno()), mode)
+
+    ext = split_compression(file)[1]
+    if ext is None:
+        return open(file, mode)
+    if PY2:
+        # Python 2 strings are bytes, so binary mode works for text.
+        return compressors[ext](file, mode + "b")
+    return compressors[ext](file, mode + "t")
+
+
+def copy_file(src, dst):
+    """Copy a file, compressing or decompressing it if the extensions are different."""
+
+    if split_compression(src)[1] == split_compression(dst)[1]:
+        shutil.copy(src, dst)
+        return
+
+    with open_file(src, "r") as src_fp:
+        with open_file(dst, "w") as dst_fp:
+            shutil.copyfileobj(src_fp, dst_fp)
+
+
+class Include(object):
+    """Reference to a fragment that's made by an !include tag in a YAML file."""
+
+    def __init__(self, ref):
+        self.ref = ref
+
+
+class IncludeLoader(yaml.Loader):
+    """YAML loader that keeps each !include tag as an Include reference."""
+
+
+IncludeLoader.add_constructor(
+    "!include", lambda loader, node: Include(loader.construct_scalar(node))
+)
+
+
+def read_data(fp, format=None):
+    """
+    Return the data stored in an open JSON or YAML file.
+
+    The !include tags in YAML data are kept as Include references that
+    are resolved by kinjector.fragments.resolve_file_refs().
+
+    Args:
+        fp: File object opened for reading.
+        format: "json" or "yaml" if the format of the file is known.
+            Otherwise, the file is checked for JSON and then YAML.
+
+    Returns:
+        A dict of data, or a list of JSON Patch operations.
+
+    Raises:
+        An exception if the file doesn't contain JSON or YAML data.
+    """
+
+    if format == "json":
+        return json.load(fp)
+
+    if format == "yaml":
+        data = yaml.load(fp, Loader=IncludeLoader)
+    else:
+        # Read the file once so compressed files don't have to be rewound.
+        text = fp.read()
+        try:
+            # Do this if it's a JSON file.
+            return json.loads(text)
+        except Exception:
+            # Do this if it's a YAML file.
+            data = yaml.load(text, Loader=IncludeLoader)
+
+    # A KiCad board file also loads as YAML, so check for a dict or list.
+    if not isinstance(data, (Mapping, list)):
+        raise ValueError("Not a JSON or YAML data file.")
+    return data
+
+
+def file_checksum(file):
+    """Return the SHA-256 checksum of a file."""
+
+    sha256 = hashlib.sha256()
+    with open(file, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 16), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def data_hash(data):
+    """Return the SHA-256 hash of the JSON form of some data."""
+
+    text = json.dumps(data, sort_keys=True, default=dict)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def backup_file_name(file, index):
+    """
+    Return the name of a backup for a file.
+
+    The backup keeps the compression extension of the file (e.g.,
+    "test.kicad_pcb.gz" is backed up as "test.kicad_pcb.1.bak.gz") so it
+    can still be opened the same way.
+    """
+
+    base, ext = split_compression(file)
+    return base + ".{}.bak".format(index) + (ext or "")
+
+
+@contextlib.contextmanager
+def local_board(file, save=False):
+    """
+    Provide the path of an uncompressed copy of a board file that KiCad can load.
+
+    Args:
+        file: Path to a board file that may be compressed, or "-" to copy
+            the board from the standard input.
+        save: If true, the uncompressed copy is compressed back into the
+            board file when the context exits without an error.
+
+    Yields:
+        The path of the uncompressed board. This is just the board file
+        if it isn't compressed.
+    """
+
+    if file == STDIO:
+        if save:
+            raise ValueError("A board from the standard input can't be saved.")
+        base, ext = "stdin.kicad_pcb", None
+    else:
+        base, ext = split_compression(file)
+        if ext is None:
+            yield file
+            return
+
+    # Keep the name of the board file so KiCad names things after it.
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        tmp_file = os.path.join(tmp_dir, os.path.basename(base))
+        if file == STDIO:
+            with open(tmp_file, "wb") as dst_fp:
+                shutil.copyfileobj(get_stdin_buffer(), dst_fp)
+        elif os.path.isfile(file):
+            copy_file(file, tmp_file)
+        yield tmp_file
+        if save:
+            copy_file(tmp_file, file)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def same_file(fd, path):
+    """Return True if the open file descriptor is for the file at the path."""
+
+    try:
+        path_stat = os.stat(path)
+    except OSError:
+        return False
+    fd_stat = os.fstat(fd)
+    return (fd_stat.st_dev, fd_stat.st_ino) == (path_stat.st_dev, path_stat.st_ino)
+
+
+class FileLocks(object):
+    """
+    Advisory locks on a set of files.
+
+    Each file is locked using a "<file>.lock" file next to it so programs
+    that respect the lock won't change the file at the same time. The lock
+    files are removed when the locks are released. The files are always
+    locked in sorted order so two programs locking overlapping sets of files
+    can't deadlock. Nothing is locked if the fcntl module isn't available.
+    """
+
+    # Seconds between attempts to get a lock that's held by another program.
+    poll_interval = 0.05
+
+    def __init__(self, files):
+        self.files = sorted(set(os.path.realpath(f) for f in files if f != STDIO))
+        self.lock_fds = []
+        self.wait_time = 0.0  # Total seconds spent waiting for the locks.
+
+    def acquire(self, timeout=None):
+        """
+        Lock all the files.
+
+        Args:
+            timeout: Seconds to wait for each lock before giving up.
+                If None, wait as long as it takes.
+
+        Raises:
+            IOError: If a lock couldn't be acquired in time. Any locks that
+                were already acquired are released.
+        """
+
+        if fcntl is None:
+            return
+
+        for file in self.files:
+            lock_file = file + ".lock"
+            start = time.time()
+            while True:
+                lock_fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o666)
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError) as e:
+                    os.close(lock_fd)
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        self.release()
+                        raise
+                else:
+                    # The lock file is removed when it's released, so the lock
+                    # only counts if it's still on the file at that path.
+                    if same_file(lock_fd, lock_file):
+                        break
+                    os.close(lock_fd)
+                    continue
+                if timeout is not None and time.time() - start >= timeout:
+                    self.wait_time += time.time() - start
+                    self.release()
+                    raise IOError(
+                        "Timed out after {:.1f} s waiting for the lock on {}.".format(
+                            timeout, file
+                        )
+                    )
+                time.sleep(self.poll_interval)
+            self.wait_time += time.time() - start
+            self.lock_fds.append((lock_file, lock_fd))
+
+    def release(self):
+        """Unlock all the locked files and remove their lock files."""
+
+        while self.lock_fds:
+            lock_file, lock_fd = self.lock_fds.pop()
+            # Remove the lock file while it's still locked so no other program
+            # can lock it in between.
+            try:
+                os.remove(lock_file)
+            except OSError:
+                pass
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
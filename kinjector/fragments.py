@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""
+Resolve references to shared fragments of data in JSON/YAML files.
+
+A value in a data file can be replaced by the data in another file using
+either a YAML tag or a JSON Reference:
+
+    plot: !include profiles/gerbers.yaml
+    board setup: {"$ref": "fab/capabilities.json#/board setup"}
+
+The path is relative to the file holding the reference, and an optional
+"#/key/key" pointer selects part of the fragment. Any other keys next to a
+"$ref" are merged on top of the fragment's data. Fragments can include other
+fragments, but not themselves.
+
+Each fragment file is parsed only once per process (or again if it's
+modified), so a batch of files that share fragments doesn't keep
+reparsing them.
+"""
+
+import copy
+import json
+import os
+
+import yaml
+
+from .fileio import STDIO, Include, IncludeLoader, open_file, split_compression
+from .kinjector import Mapping, merge_dicts, string_types
+
+
+# Parsed data for each fragment file, along with the modification time of
+# the file when it was parsed.
+fragment_cache = {}
+
+
+def load_fragment(path):
+    """
+    Return the data in a fragment file, parsing it only if it isn't already cached.
+
+    The cached data is never returned directly, so it can't be changed by
+    merging it with other data.
+    """
+
+    mtime = os.path.getmtime(path)
+    try:
+        cached_mtime, data = fragment_cache[path]
+        if cached_mtime == mtime:
+            return copy.deepcopy(data)
+    except KeyError:
+        pass
+
+    with open_file(path, "r") as fp:
+        if os.path.splitext(split_compression(path)[0])[1].lower() == ".json":
+            data = json.load(fp)
+        else:
+            data = yaml.load(fp, Loader=IncludeLoader)
+    fragment_cache[path] = (mtime, data)
+    return copy.deepcopy(data)
+
+
+def select_pointer(data, pointer, ref):
+    """Return the part of some data selected by a JSON Pointer (e.g., "/board/plot")."""
+
+    for key in pointer.split("/")[1:]:
+        key = key.replace("~1", "/").replace("~0", "~")
+        try:
+            if isinstance(data, list):
+                data = data[int(key)]
+            else:
+                data = data[key]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise ValueError("Nothing at {!r} in reference {!r}.".format(pointer, ref))
+    return data
+
+
+def resolve_refs(data, base_dir=".", stack=()):
+    """
+    Replace every !include and "$ref" reference in some data with the fragment it refers to.
+
+    Args:
+        data: Data read from a JSON/YAML file (e.g., by IncludeLoader).
+        base_dir: Directory that the paths of the references are relative to.
+        stack: Real paths of the files being resolved, starting with the
+            file that holds data (used for finding cycles).
+
+    Returns:
+        The data with its references resolved. Dicts and lists in data are
+        updated in place.
+
+    Raises:
+        ValueError: If a fragment includes itself, directly or through
+            other fragments, or a pointer doesn't select anything.
+        IOError, OSError: If a fragment file can't be read.
+    """
+
+    if isinstance(data, Include):
+        return load_ref(data.ref, base_dir, stack)
+
+    if isinstance(data, Mapping):
+        ref = data.get("$ref")
+        if isinstance(ref, string_types):
+            fragment = load_ref(ref, base_dir, stack)
+            siblings = {k: v for k, v in data.items() if k != "$ref"}
+            if not siblings:
+                return fragment
+            if not isinstance(fragment, Mapping):
+                raise ValueError(
+                    "Reference {!r} isn't a dict, so nothing can be merged with it.".format(
+                        ref
+                    )
+                )
+            merge_dicts(fragment, resolve_refs(siblings, base_dir, stack))
+            return fragment
+        for k, v in data.items():
+            data[k] = resolve_refs(v, base_dir, stack)
+        return data
+
+    if isinstance(data, list):
+        for i, v in enumerate(data):
+            data[i] = resolve_refs(v, base_dir, stack)
+    return data
+
+
+def load_ref(ref, base_dir, stack):
+    """Return the resolved data for a reference like "file.yaml#/key/key"."""
+
+    file, _, pointer = ref.partition("#")
+    if not file:
+        raise ValueError("No file in reference {!r}.".format(ref))
+    path = os.path.realpath(os.path.join(base_dir, file))
+    if path in stack:
+        cycle = stack[stack.index(path) :] + (path,)
+        raise ValueError("Circular reference: {}".format(" -> ".join(cycle)))
+    data = resolve_refs(load_fragment(path), os.path.dirname(path), stack + (path,))
+    return select_pointer(data, pointer, ref)
+
+
+def resolve_file_refs(data, file):
+    """Resolve the references in the data read from a file (or "-" for the standard input)."""
+
+    if file == STDIO:
+        return resolve_refs(data)
+    path = os.path.realpath(file)
+    return resolve_refs(data, os.path.dirname(path), (path,))
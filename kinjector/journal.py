@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+Keep a journal of the files updated by a run so an interrupted run can be resumed.
+
+The journal is a file of JSON lines that's only ever appended to. Each line
+records a target file, a hash of the data put into it, the status of the
+update and, once it's done, a hash of the updated file. A resumed run skips
+the targets whose last update is done with the same data and whose files
+haven't changed since.
+"""
+
+import json
+import os
+import time
+
+from .fileio import file_checksum
+
+
+class Journal(object):
+    """Append-only journal of the updates to target files."""
+
+    def __init__(self, file):
+        """Open a journal file, reading the entries already in it."""
+
+        self.file = file
+
+        # The last entry for each target.
+        self.last_entries = {}
+        if os.path.isfile(file):
+            with open(file, "r") as fp:
+                for line in fp:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partial line left by a run that died while writing it.
+                    self.last_entries[entry["target"]] = entry
+
+    @staticmethod
+    def target_key(target):
+        return os.path.realpath(target)
+
+    def is_done(self, target, input_hash):
+        """
+        Return True if a target was updated with the same data and hasn't changed since.
+
+        Args:
+            target: Path to the target file.
+            input_hash: Hash of the data that will be put into the target.
+        """
+
+        entry = self.last_entries.get(self.target_key(target))
+        if entry is None or entry["status"] != "done":
+            return False
+        if entry["input"] != input_hash or not os.path.isfile(target):
+            return False
+        return entry["output"] == file_checksum(target)
+
+    def record(self, target, input_hash, status):
+        """
+        Append an entry for a target to the journal.
+
+        Args:
+            target: Path to the target file.
+            input_hash: Hash of the data put into the target.
+            status: "started", "done" or "failed". The hash of the target
+                file is recorded when it's "done".
+        """
+
+        entry = {
+            "target": self.target_key(target),
+            "input": input_hash,
+            "status": status,
+            "output": file_checksum(target) if status == "done" else None,
+            "time": time.time(),
+        }
+        self.last_entries[entry["target"]] = entry
+
+        # Make sure the entry is on disk before going on to the next target.
+        with open(self.file, "a") as fp:
+            fp.write(json.dumps(entry, sort_keys=True) + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
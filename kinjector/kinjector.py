@@ -25,22 +25,41 @@ and for ejecting values from a board file into a dict.
 """
 
 import collections
-import sys
-
-sys.path.append('/usr/lib/python3/dist-packages')
-from pcbnew import DIFF_PAIR_DIMENSION, LSET
-from pcbnew import NETCLASSPTR as NCP
-from pcbnew import PCB_PLOT_PARAMS as PPP
-from pcbnew import (
+import difflib
+import fnmatch
+import logging
+import math
+import numbers
+
+from .backend import DIFF_PAIR_DIMENSION, LSET
+from .backend import NETCLASSPTR as NCP
+from .backend import PCB_PLOT_PARAMS as PPP
+from .backend import ZONE_CONTAINER as ZC
+from .backend import (
+    PCB_LAYER_ID_COUNT,
+    PCB_VIA_T,
     VIA_DIMENSION,
     B_Cu,
     F_Cu,
     Refresh,
     VIA_DIMENSION_Vector,
     intVector,
+    ZONE_FILLER,
     wxPoint,
 )
 
+logger = logging.getLogger(__name__)
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping  # Python 2.
+
+try:
+    string_types = (str, unicode)  # Python 2.
+except NameError:
+    string_types = (str,)  # Python 3.
+
 
 def merge_dicts(dct, merge_dct):
     """ 
@@ -57,26 +76,920 @@ def merge_dicts(dct, merge_dct):
     for k, v in merge_dct.items():
         if (
             k in dct
-            and isinstance(dct[k], dict)
-            and isinstance(merge_dct[k], collections.Mapping)
+            and isinstance(dct[k], Mapping)
+            and isinstance(merge_dct[k], Mapping)
         ):
+            if not isinstance(dct[k], dict):
+                # Convert a read-only Record into a dict that can be updated.
+                dct[k] = dict(dct[k])
             merge_dicts(dct[k], merge_dct[k])
         else:
             dct[k] = merge_dct[k]
 
 
+def plain_data(data):
+    """Return a copy of data where every Record or other Mapping is replaced by a dict."""
+
+    if isinstance(data, Mapping):
+        return {k: plain_data(v) for k, v in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [plain_data(v) for v in data]
+    return data
+
+
+def parse_fields(patterns):
+    """
+    Convert a list of field patterns into a tree of the fields they select.
+
+    Args:
+        patterns: List of strings like "modules.*.position.x" where each
+            "."-separated part is a key (or a glob pattern for keys).
+
+    Returns:
+        A nested dict of keys. A key whose value is None selects everything
+        below it. For example, ["plot", "modules.*.value"] becomes
+        {"plot": None, "modules": {"*": {"value": None}}}.
+    """
+
+    tree = {}
+    for pattern in patterns:
+        node = tree
+        keys = pattern.split(".")
+        for key in keys[:-1]:
+            if key in node and node[key] is None:
+                break  # Everything below this key is already selected.
+            node = node.setdefault(key, {})
+        else:
+            node[keys[-1]] = None
+    return tree
+
+
+def merge_field_trees(trees):
+    """Return a field tree that selects everything selected by a list of field trees."""
+
+    if any(tree is None for tree in trees):
+        return None
+    merged = {}
+    for tree in trees:
+        for key, subtree in tree.items():
+            merged[key] = merge_field_trees([merged[key], subtree]) if key in merged else subtree
+    return merged
+
+
+def match_fields(key, tree):
+    """Return the field tree below a key, or an empty dict if the tree doesn't select the key."""
+
+    subtrees = [
+        subtree
+        for pattern, subtree in tree.items()
+        if pattern == key or fnmatch.fnmatchcase(str(key), pattern)
+    ]
+    if not subtrees:
+        return {}
+    return merge_field_trees(subtrees)
+
+
+def select_fields(data, tree):
+    """Return the parts of a data dict that are selected by a field tree."""
+
+    if tree is None or not isinstance(data, Mapping):
+        return data
+    selected = {}
+    for key, value in data.items():
+        subtree = match_fields(key, tree)
+        if subtree != {}:
+            selected[key] = select_fields(value, subtree)
+    return selected
+
+
+class Record(Mapping):
+    """
+    Compact, read-only dict of values stored in slots instead of a hash table.
+
+    Each name in __slots__ is a key of the record. A slot that hasn't been
+    assigned a value isn't a key. Use dict(record) or plain_data(record) to
+    get a regular dict.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for key, value in values.items():
+            setattr(self, key, value)
+
+    def __getitem__(self, key):
+        if key in self.__slots__:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.__slots__:
+            if hasattr(self, key):
+                yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return "{}({})".format(
+            type(self).__name__,
+            ", ".join("{}={!r}".format(key, self[key]) for key in self),
+        )
+
+
+def json_pointer(path):
+    """Return a JSON Pointer (RFC 6901) string for a path of keys into a dict."""
+    return "".join(
+        "/" + str(k).replace("~", "~0").replace("/", "~1") for k in path
+    )
+
+
+def json_pointer_keys(pointer):
+    """Return the list of keys in a JSON Pointer (RFC 6901) string."""
+
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise ValueError("Illegal JSON Pointer: {!r}".format(pointer))
+    return [
+        k.replace("~1", "/").replace("~0", "~") for k in pointer[1:].split("/")
+    ]
+
+
+def diff_dicts(old_dct, new_dct, path=()):
+    """
+    Generate JSON Patch (RFC 6902) operations that change one dict into another.
+
+    Args:
+        old_dct: The dict that would be changed by the patch.
+        new_dct: The dict that results from applying the patch.
+        path: Tuple of keys leading from the top of the data dict to these dicts.
+
+    Yields:
+        Dicts for the add, replace and remove operations of the patch.
+        Lists are treated as single values and are replaced as a whole.
+    """
+
+    for k, v in new_dct.items():
+        if k not in old_dct:
+            yield {"op": "add", "path": json_pointer(path + (k,)), "value": v}
+        elif isinstance(v, Mapping) and isinstance(old_dct[k], Mapping):
+            for op in diff_dicts(old_dct[k], v, path + (k,)):
+                yield op
+        elif v != old_dct[k]:
+            yield {"op": "replace", "path": json_pointer(path + (k,)), "value": v}
+
+    for k in old_dct:
+        if k not in new_dct:
+            yield {"op": "remove", "path": json_pointer(path + (k,))}
+
+
+def patch_to_dict(patch):
+    """
+    Convert a JSON Patch (RFC 6902) into a dict that can be injected into a board.
+
+    Args:
+        patch: List of JSON Patch operations.
+
+    Returns:
+        A dict holding only the values set by the add and replace operations.
+        Remove operations are skipped because values can't be removed from a board.
+    """
+
+    dct = {}
+    for op in patch:
+        if op["op"] == "remove":
+            continue
+        if op["op"] not in ("add", "replace"):
+            raise ValueError(
+                "Can't inject a JSON Patch {!r} operation.".format(op["op"])
+            )
+        keys = json_pointer_keys(op["path"])
+        if not keys:
+            merge_dicts(dct, op["value"])
+            continue
+        sub_dct = dct
+        for k in keys[:-1]:
+            sub_dct = sub_dct.setdefault(k, {})
+        sub_dct[keys[-1]] = op["value"]
+    return dct
+
+
+def is_int(value):
+    """Return True if value is an integer (but not a boolean)."""
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool)
+
+
+def is_number(value):
+    """Return True if value is an integer or float (but not a boolean)."""
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def is_layer(value):
+    """Return True if value is a valid KiCad layer number."""
+    return is_int(value) and 0 <= value < PCB_LAYER_ID_COUNT
+
+
+def is_point(value):
+    """Return True if value is an [X, Y] pair of integers."""
+    return isinstance(value, list) and len(value) == 2 and all(is_int(v) for v in value)
+
+
+# Named tuple for storing a test for a data value and a description of what it accepts.
+ValueType = collections.namedtuple("ValueType", ["test", "desc"])
+
+# Types of values that can be stored in the data dict.
+value_types = {
+    "any": ValueType(lambda v: True, "anything"),
+    "bool": ValueType(lambda v: isinstance(v, bool), "true or false"),
+    "int": ValueType(is_int, "an integer"),
+    "size": ValueType(lambda v: is_int(v) and v >= 0, "a non-negative integer"),
+    "number": ValueType(is_number, "a number"),
+    "string": ValueType(lambda v: isinstance(v, string_types), "a string"),
+    "layer count": ValueType(
+        lambda v: is_int(v) and 1 <= v <= 32, "an integer from 1 to 32"
+    ),
+    "layers": ValueType(
+        lambda v: isinstance(v, list) and all(is_layer(l) for l in v),
+        "a list of layer numbers from 0 to {}".format(PCB_LAYER_ID_COUNT - 1),
+    ),
+    "drill marks": ValueType(
+        lambda v: is_int(v) and 0 <= v <= 2, "an integer from 0 to 2"
+    ),
+    "side": ValueType(
+        lambda v: isinstance(v, string_types) and v.lower() in ("top", "bottom"),
+        '"top" or "bottom"',
+    ),
+    "rect": ValueType(
+        lambda v: isinstance(v, list) and len(v) == 4 and all(is_int(c) for c in v),
+        "a list of four integers [X1, Y1, X2, Y2]",
+    ),
+    "polygon": ValueType(
+        lambda v: isinstance(v, list) and len(v) >= 3 and all(is_point(p) for p in v),
+        "a list of three or more [X, Y] points",
+    ),
+    "region match": ValueType(
+        lambda v: v in ("position", "overlap"), '"position" or "overlap"'
+    ),
+}
+
+
+# Keys of the dicts that select a region of a board.
+region_key_type_map = {
+    "rect": "rect",
+    "polygon": "polygon",
+    "side": "side",
+    "match": "region match",
+}
+
+
+def path_str(path):
+    """Return a printable string for a path of keys into the data dict."""
+    return " > ".join(str(k) for k in path)
+
+
+def check_value(value, value_type, path):
+    """Return a list with an error message if the value is not of the given type."""
+
+    if value_types[value_type].test(value):
+        return []
+    return [
+        "{}: expected {}, got {!r}.".format(
+            path_str(path), value_types[value_type].desc, value
+        )
+    ]
+
+
+def check_mapping(data, path):
+    """Return a list with an error message if the data is not a dict."""
+
+    if isinstance(data, Mapping):
+        return []
+    return ["{}: expected a mapping of keys to values, got {!r}.".format(path_str(path), data)]
+
+
+def check_keys(data, key_type_map, path, ignore_case=False):
+    """
+    Check the keys and values of a dict against the types they're allowed to have.
+
+    Args:
+        data: The dict whose keys and values are checked.
+        key_type_map: Dict of allowed keys and the names of their value types.
+        path: Tuple of keys leading from the top of the data dict to data.
+        ignore_case: If true, keys are checked without regard to case.
+
+    Returns:
+        A list of error messages (empty if no errors were found).
+    """
+
+    errors = check_mapping(data, path)
+    if errors:
+        return errors
+
+    for key, value in data.items():
+        lookup_key = key.lower() if ignore_case and isinstance(key, string_types) else key
+        try:
+            value_type = key_type_map[lookup_key]
+        except (KeyError, TypeError):
+            errors.append(unknown_key_error(key, key_type_map, path))
+        else:
+            errors.extend(check_value(value, value_type, path + (key,)))
+    return errors
+
+
+def check_sections(data_dict, dict_key, sections, path):
+    """
+    Check a section of the data dict made up of subsections.
+
+    Args:
+        data_dict: The dict containing the section to check.
+        dict_key: The key of the section in data_dict.
+        sections: List of KinJector objects that handle the subsections.
+        path: Tuple of keys leading from the top of the data dict to data_dict.
+
+    Returns:
+        A list of error messages (empty if no errors were found).
+    """
+
+    data = data_dict.get(dict_key, {})
+    path = path + (dict_key,)
+
+    errors = check_mapping(data, path)
+    if errors:
+        return errors
+
+    section_keys = [section.dict_key for section in sections]
+    for key in data:
+        if key not in section_keys:
+            errors.append(unknown_key_error(key, section_keys, path))
+    for section in sections:
+        errors.extend(section.validate(data, path))
+    return errors
+
+
+def check_dimensions_list(data_dict, dict_key, dimension_keys, path):
+    """
+    Check a section of the data dict holding a list of dimension dicts.
+
+    Args:
+        data_dict: The dict containing the section to check.
+        dict_key: The key of the section in data_dict.
+        dimension_keys: List of keys required in each dimension dict.
+        path: Tuple of keys leading from the top of the data dict to data_dict.
+
+    Returns:
+        A list of error messages (empty if no errors were found).
+    """
+
+    path = path + (dict_key,)
+    errors = []
+    try:
+        data_dims = data_dict[dict_key]
+    except KeyError:
+        return errors
+
+    if not isinstance(data_dims, list):
+        return ["{}: expected a list of dimensions.".format(path_str(path))]
+
+    key_type_map = {key: "size" for key in dimension_keys}
+    for i, dims in enumerate(data_dims):
+        dims_errors = check_keys(dims, key_type_map, path + (i,))
+        if not dims_errors:
+            for key in dimension_keys:
+                if key not in dims:
+                    dims_errors.append(
+                        "{}: missing key {!r}.".format(path_str(path + (i,)), key)
+                    )
+        errors.extend(dims_errors)
+    return errors
+
+
+def check_region(region, path):
+    """Return a list of errors found in a region dict (see ModuleGrid.query())."""
+
+    errors = check_keys(region, region_key_type_map, path)
+    if errors:
+        return errors
+    if ("rect" in region) == ("polygon" in region):
+        errors.append('{}: expected either a "rect" or a "polygon".'.format(path_str(path)))
+    return errors
+
+
+def unknown_key_error(key, allowed_keys, path):
+    """Return an error message for an unknown key and suggest similar keys."""
+
+    msg = "{}: unknown key {!r}.".format(path_str(path), key)
+    similar_keys = difflib.get_close_matches(
+        str(key), [str(k) for k in allowed_keys], n=1
+    )
+    if similar_keys:
+        msg += " Did you mean {!r}?".format(similar_keys[0])
+    return msg
+
+
+def board_cache(brd):
+    """
+    Return the dict where data derived from a KiCad BOARD object is kept.
+
+    The dict is attached to the BOARD object so anything stored in it
+    (like a ModuleIndex) is built once and shared by every KinJector
+    that works on the board. Clear the dict if the board is changed
+    by something other than KinJector objects.
+    """
+
+    try:
+        return brd.kinjector_cache
+    except AttributeError:
+        brd.kinjector_cache = {}
+        return brd.kinjector_cache
+
+
+def release_board(brd):
+    """
+    Free a KiCad BOARD object and the data KinJector keeps for it.
+
+    The C++ board is destroyed right away instead of whenever (or if ever)
+    its Python wrapper is collected. Only do this with a board that was
+    loaded by your own code (not the board open in the KiCad editor), and
+    don't use the BOARD object or anything taken from it afterwards.
+    """
+
+    try:
+        brd.kinjector_cache.clear()
+        del brd.kinjector_cache
+    except AttributeError:
+        pass
+
+    # A SWIG wrapper can delete its C++ object. Disown the object first so
+    # the wrapper doesn't try to delete it again when it's collected.
+    destroy = getattr(type(brd), "__swig_destroy__", None)
+    if destroy is not None and getattr(brd, "this", None) is not None:
+        brd.thisown = False
+        destroy(brd)
+
+
+class ModuleIndex(object):
+    """Index the parts of a KiCad BOARD object by reference and path."""
+
+    def __init__(self, brd):
+        """Build the index with a single pass through the parts of a KiCad BOARD object."""
+
+        self.by_ref = {}
+        self.by_path = {}
+        for module in brd.GetModules():
+            self.by_ref[self.get_ref(module)] = module
+            path = self.get_path(module)
+            if path:
+                # Parts that were never annotated have no path to find them by.
+                self.by_path[path] = module
+
+    @classmethod
+    def of(cls, brd):
+        """Return the index for a KiCad BOARD object, building it if it doesn't exist."""
+
+        cache = board_cache(brd)
+        try:
+            return cache["module index"]
+        except KeyError:
+            cache["module index"] = cls(brd)
+            return cache["module index"]
+
+    @staticmethod
+    def get_ref(module):
+        """Return the reference (e.g., "R1") of a part."""
+        return str(module.GetReference())
+
+    @staticmethod
+    def get_path(module):
+        """Return the path of a part which doesn't change when the board is reannotated."""
+        return str(module.GetPath())
+
+    @staticmethod
+    def get_name(module):
+        """Return the name of the footprint of a part."""
+        return str(module.GetFPID().GetLibItemName())
+
+
+def point_in_polygon(x, y, polygon):
+    """Return True if point (x, y) is inside a polygon given as a list of [X, Y] points."""
+
+    inside = False
+    x1, y1 = polygon[-1]
+    for x2, y2 in polygon:
+        if (y1 > y) != (y2 > y):
+            if x < x1 + (y - y1) * (x2 - x1) / float(y2 - y1):
+                inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def segments_cross(p1, p2, q1, q2):
+    """Return True if line segment p1-p2 touches or crosses line segment q1-q2."""
+
+    def orient(a, b, c):
+        cross = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+        return (cross > 0) - (cross < 0)
+
+    def on_segment(a, b, c):
+        return min(a[0], b[0]) <= c[0] <= max(a[0], b[0]) and min(
+            a[1], b[1]
+        ) <= c[1] <= max(a[1], b[1])
+
+    d1, d2 = orient(q1, q2, p1), orient(q1, q2, p2)
+    d3, d4 = orient(p1, p2, q1), orient(p1, p2, q2)
+    if d1 != d2 and d3 != d4:
+        return True
+    return (
+        (d1 == 0 and on_segment(q1, q2, p1))
+        or (d2 == 0 and on_segment(q1, q2, p2))
+        or (d3 == 0 and on_segment(p1, p2, q1))
+        or (d4 == 0 and on_segment(p1, p2, q2))
+    )
+
+
+def region_bounds(region):
+    """Return the (left, top, right, bottom) bounding box of a region dict."""
+
+    if "rect" in region:
+        x1, y1, x2, y2 = region["rect"]
+        return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+    xs = [x for x, _ in region["polygon"]]
+    ys = [y for _, y in region["polygon"]]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def region_contains(region, x, y):
+    """Return True if point (x, y) is inside a region dict."""
+
+    left, top, right, bottom = region_bounds(region)
+    if not (left <= x <= right and top <= y <= bottom):
+        return False
+    if "rect" in region:
+        return True
+    return point_in_polygon(x, y, region["polygon"])
+
+
+def region_overlaps(region, box):
+    """Return True if a (left, top, right, bottom) box overlaps a region dict."""
+
+    left, top, right, bottom = region_bounds(region)
+    if box[0] > right or box[2] < left or box[1] > bottom or box[3] < top:
+        return False
+    if "rect" in region:
+        return True
+
+    # The box overlaps the polygon if a corner of one is inside the other
+    # or if any of their edges cross.
+    polygon = region["polygon"]
+    corners = [(box[0], box[1]), (box[2], box[1]), (box[2], box[3]), (box[0], box[3])]
+    if any(point_in_polygon(x, y, polygon) for x, y in corners):
+        return True
+    if any(box[0] <= x <= box[2] and box[1] <= y <= box[3] for x, y in polygon):
+        return True
+    box_edges = list(zip(corners, corners[1:] + corners[:1]))
+    poly_edges = list(zip(polygon, polygon[1:] + polygon[:1]))
+    return any(
+        segments_cross(p1, p2, q1, q2) for p1, p2 in box_edges for q1, q2 in poly_edges
+    )
+
+
+class ModuleGrid(object):
+    """
+    Spatial index of the parts of a KiCad BOARD object.
+
+    The bounding box of each part is stored in the cells of a uniform grid
+    that it covers, so finding the parts in a region only looks at the
+    parts in the cells the region covers instead of every part on the board.
+    """
+
+    def __init__(self, brd):
+        """Build the grid from the bounding boxes of the parts of a KiCad BOARD object."""
+
+        self.modules = ModuleIndex.of(brd).by_ref
+        self.boxes = {ref: self.get_box(module) for ref, module in self.modules.items()}
+
+        # Size the cells so there's about one part per cell.
+        self.cell_size = 1
+        self.extent = None
+        if self.boxes:
+            self.extent = (
+                min(box[0] for box in self.boxes.values()),
+                min(box[1] for box in self.boxes.values()),
+                max(box[2] for box in self.boxes.values()),
+                max(box[3] for box in self.boxes.values()),
+            )
+            left, top, right, bottom = self.extent
+            area = float(right - left + 1) * (bottom - top + 1)
+            self.cell_size = max(int(math.sqrt(area / len(self.boxes))), 1)
+
+        self.cells = collections.defaultdict(set)
+        for ref in self.boxes:
+            self.insert(ref)
+
+    @classmethod
+    def of(cls, brd):
+        """Return the grid for a KiCad BOARD object, building it if it doesn't exist."""
+
+        cache = board_cache(brd)
+        try:
+            return cache["module grid"]
+        except KeyError:
+            cache["module grid"] = cls(brd)
+            return cache["module grid"]
+
+    @staticmethod
+    def get_box(module):
+        """Return the (left, top, right, bottom) bounding box of a part."""
+
+        bbox = module.GetBoundingBox()
+        return bbox.GetLeft(), bbox.GetTop(), bbox.GetRight(), bbox.GetBottom()
+
+    def box_cells(self, box):
+        """Return the (column, row) of every grid cell covered by a box."""
+
+        size = self.cell_size
+        return [
+            (col, row)
+            for col in range(box[0] // size, box[2] // size + 1)
+            for row in range(box[1] // size, box[3] // size + 1)
+        ]
+
+    def insert(self, ref):
+        box = self.boxes[ref]
+        for cell in self.box_cells(box):
+            self.cells[cell].add(ref)
+
+        # Keep track of the area covered by all the parts.
+        if self.extent is None:
+            self.extent = box
+        else:
+            self.extent = (
+                min(self.extent[0], box[0]),
+                min(self.extent[1], box[1]),
+                max(self.extent[2], box[2]),
+                max(self.extent[3], box[3]),
+            )
+
+    def remove(self, ref):
+        for cell in self.box_cells(self.boxes[ref]):
+            self.cells[cell].discard(ref)
+
+    def update(self, module):
+        """Move a part to the grid cells for its current bounding box."""
+
+        ref = ModuleIndex.get_ref(module)
+        if ref in self.boxes:
+            self.remove(ref)
+        self.modules[ref] = module
+        self.boxes[ref] = self.get_box(module)
+        self.insert(ref)
+
+    def query(self, region):
+        """
+        Find the parts in a region.
+
+        Args:
+            region: Dict with either a "rect" ([X1, Y1, X2, Y2]) or a "polygon"
+                (list of [X, Y] points), and optionally a "side" ("top" or
+                "bottom") and a "match" mode. With "position" (the default),
+                a part is in the region if its position is inside the region.
+                With "overlap", a part is in the region if its bounding box
+                overlaps the region.
+
+        Returns:
+            A list of (reference, MODULE object) pairs sorted by reference.
+        """
+
+        # Only look in the cells covered by both the region and the parts.
+        if self.extent is None:
+            return []
+        bounds = region_bounds(region)
+        bounds = (
+            max(bounds[0], self.extent[0]),
+            max(bounds[1], self.extent[1]),
+            min(bounds[2], self.extent[2]),
+            min(bounds[3], self.extent[3]),
+        )
+        if bounds[0] > bounds[2] or bounds[1] > bounds[3]:
+            return []
+        candidates = set()
+        for cell in self.box_cells(bounds):
+            candidates.update(self.cells.get(cell, ()))
+
+        side = region.get("side")
+        match = region.get("match", "position")
+        found = []
+        for ref in sorted(candidates):
+            module = self.modules[ref]
+            if match == "overlap":
+                if not region_overlaps(region, self.boxes[ref]):
+                    continue
+            else:
+                pos = module.GetPosition()
+                if not region_contains(region, pos.x, pos.y):
+                    continue
+            if side and ModulePosition.top_btm[module.GetLayer()] != side.lower():
+                continue
+            found.append((ref, module))
+        return found
+
+
+def get_courtyard_box(module):
+    """
+    Return the (left, top, right, bottom) bounding box of the courtyard of a part.
+
+    Returns None if the part has no courtyard on its side of the board (or
+    the version of KiCad can't build courtyards).
+    """
+
+    try:
+        module.BuildPolyCourtyard()
+        if module.GetLayer() == F_Cu:
+            courtyard = module.GetPolyCourtyardFront()
+        else:
+            courtyard = module.GetPolyCourtyardBack()
+    except AttributeError:
+        return None
+    if courtyard.OutlineCount() == 0:
+        return None
+    bbox = courtyard.BBox()
+    return bbox.GetLeft(), bbox.GetTop(), bbox.GetRight(), bbox.GetBottom()
+
+
+def boxes_overlap(box1, box2):
+    """Return True if two (left, top, right, bottom) boxes overlap (touching doesn't count)."""
+
+    return (
+        box1[0] < box2[2]
+        and box2[0] < box1[2]
+        and box1[1] < box2[3]
+        and box2[1] < box1[3]
+    )
+
+
+def find_overlaps(brd, refs=None, use_courtyards=True):
+    """
+    Find the parts of a KiCad BOARD object that overlap other parts on the same side.
+
+    Each part is only compared to the parts that share grid cells with it in
+    the ModuleGrid of the board, so checking every part takes close to linear time.
+
+    Args:
+        brd: The KiCad BOARD object.
+        refs: References of the parts to check against their neighbors
+            (e.g., the parts that were just moved). If None, all the parts
+            are checked.
+        use_courtyards: If true, the bounding boxes of the part courtyards are
+            compared. Parts without a courtyard use their bounding boxes.
+            If false, only the bounding boxes are compared.
+
+    Returns:
+        A sorted list of (reference, reference) pairs of overlapping parts.
+    """
+
+    grid = ModuleGrid.of(brd)
+    if refs is None:
+        refs = grid.boxes
+
+    # Get the box and side of each part only when it's needed, and only once.
+    boxes = {}
+
+    def get_box(ref):
+        try:
+            return boxes[ref]
+        except KeyError:
+            module = grid.modules[ref]
+            box = get_courtyard_box(module) if use_courtyards else None
+            side = ModulePosition.top_btm[module.GetLayer()]
+            boxes[ref] = (box or grid.boxes[ref], side)
+            return boxes[ref]
+
+    overlaps = set()
+    for ref in refs:
+        if ref not in grid.boxes:
+            continue
+        box, side = get_box(ref)
+        neighbors = set()
+        for cell in grid.box_cells(grid.boxes[ref]):
+            neighbors.update(grid.cells.get(cell, ()))
+        neighbors.discard(ref)
+        for neighbor in neighbors:
+            pair = tuple(sorted((ref, neighbor)))
+            if pair in overlaps:
+                continue
+            neighbor_box, neighbor_side = get_box(neighbor)
+            if side == neighbor_side and boxes_overlap(box, neighbor_box):
+                overlaps.add(pair)
+    return sorted(overlaps)
+
+
+def mark_modules_moved(brd, modules):
+    """Record parts of a KiCad BOARD object that were moved so they can be checked for overlaps."""
+
+    moved = board_cache(brd).setdefault("moved modules", set())
+    moved.update(ModuleIndex.get_ref(module) for module in modules)
+
+
+def moved_modules(brd):
+    """Return the references of the parts that were moved by injection since the board was loaded."""
+
+    return sorted(board_cache(brd).get("moved modules", ()))
+
+
+def mark_zones_stale(brd, zone_indices=None):
+    """
+    Record the zones of a KiCad BOARD object that need to be refilled.
+
+    Args:
+        brd: The KiCad BOARD object.
+        zone_indices: Indices of the zones in brd.Zones() that need to be
+            refilled. If None, all the zones need to be refilled.
+    """
+
+    stale_zones = board_cache(brd).setdefault("stale zones", set())
+    if zone_indices is None:
+        zone_indices = range(len(brd.Zones()))
+    stale_zones.update(zone_indices)
+
+
+def refill_zones(brd):
+    """
+    Refill all the stale zones of a KiCad BOARD object in a single batch.
+
+    Zones are marked as stale by the KinJector objects as they change the
+    board, so this should be called once after all the data is injected.
+
+    Args:
+        brd: The KiCad BOARD object.
+
+    Returns:
+        The number of zones that were refilled.
+    """
+
+    stale_zones = board_cache(brd).pop("stale zones", set())
+    zones = [zone for i, zone in enumerate(brd.Zones()) if i in stale_zones]
+    if zones:
+        ZONE_FILLER(brd).Fill(zones)
+    return len(zones)
+
+
 class KinJector(object):
     """Base KinJector object."""
 
     # Named tuple for storing getter/setter functions.
     GetSet = collections.namedtuple("GetSet", ["get", "set"])
 
+    # Associate each key in the data dict section with the type of value it holds.
+    key_type_map = {}
+
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the section of data_dict for this object."""
+
+        return check_keys(
+            data_dict.get(self.dict_key, {}),
+            self.key_type_map,
+            path + (self.dict_key,),
+        )
+
+    def snapshot(self, data_dict, brd):
+        """
+        Return the state of the board that injecting data_dict would change.
+
+        The snapshot is passed to restore() to undo a failed injection.
+        By default, it's everything ejected for this object.
+        """
+
+        return self.eject(brd)
+
+    def restore(self, snapshot, brd):
+        """Return a KiCad BOARD object to the state recorded by snapshot()."""
+
+        self.inject(snapshot, brd)
+
+    def diff(self, brd, baseline_dict, path=()):
+        """Generate JSON Patch operations that change baseline_dict to match a KiCad BOARD object."""
+
+        baseline_section = {}
+        if self.dict_key in baseline_dict:
+            baseline_section[self.dict_key] = baseline_dict[self.dict_key]
+        return diff_dicts(baseline_section, self.eject(brd), path)
+
 
 class Layers(KinJector):
     """Inject/eject enabled/visible layers to/from a KiCad board object."""
 
     dict_key = "layers"
 
+    key_type_map = {
+        "board thickness": "size",
+        "# copper layers": "layer count",
+        "enabled": "layers",
+        "visible": "layers",
+    }
+
     def inject(self, data_dict, brd):
         """Inject enabled/visible layers from data_dict into a KiCad BOARD object."""
 
@@ -143,6 +1056,19 @@ class DesignRules(KinJector):
 
     dict_key = "design rules"
 
+    key_type_map = {
+        "blind/buried via allowed": "bool",
+        "uvia allowed": "bool",
+        "require courtyards": "bool",
+        "prohibit courtyard overlap": "bool",
+        "min track width": "size",
+        "min via diameter": "size",
+        "min via drill size": "size",
+        "min uvia diameter": "size",
+        "min uvia drill size": "size",
+        "hole to hole spacing": "size",
+    }
+
     def inject(self, data_dict, brd):
         """Inject design rule settings from data_dict into a KiCad BOARD object."""
 
@@ -152,6 +1078,10 @@ class DesignRules(KinJector):
         # Get the design rules from the board.
         brd_drs = brd.GetDesignSettings()
 
+        # Changing the design rules changes how every zone gets filled.
+        if data_drs:
+            mark_zones_stale(brd)
+
         # Update the design rules with values from the data dict.
         # If a particular design rule parameter doesn't exist, just pass it by.
 
@@ -253,6 +1183,18 @@ class NetClassDefs(KinJector):
         "uvia drill": KinJector.GetSet(NCP.GetuViaDrill, NCP.SetuViaDrill),
     }
 
+    key_type_map = {
+        "clearance": "size",
+        "description": "string",
+        "diff pair gap": "size",
+        "diff pair width": "size",
+        "track width": "size",
+        "via diameter": "size",
+        "via drill": "size",
+        "uvia diameter": "size",
+        "uvia drill": "size",
+    }
+
     def inject(self, data_dict, brd):
         """Inject net class definitions from data dict into a KiCad BOARD object."""
 
@@ -283,6 +1225,10 @@ class NetClassDefs(KinJector):
             for key, value in data_netclass_params.items():
                 self.key_method_map[key.lower()].set(brd_netclass_params, value)
 
+        # Changing the clearances of nets changes how every zone gets filled.
+        if data_netclass_defs:
+            mark_zones_stale(brd)
+
         # Update the Default net class.
         try:
             data_dflt_params = data_netclass_defs["Default"]
@@ -295,6 +1241,27 @@ class NetClassDefs(KinJector):
             for key, value in data_dflt_params.items():
                 self.key_method_map[key.lower()].set(brd_dflt_params, value)
 
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the net class definitions of data_dict."""
+
+        data_netclass_defs = data_dict.get(self.dict_key, {})
+        path = path + (self.dict_key,)
+
+        errors = check_mapping(data_netclass_defs, path)
+        if errors:
+            return errors
+
+        for data_netclass_name, data_netclass_params in data_netclass_defs.items():
+            errors.extend(
+                check_keys(
+                    data_netclass_params,
+                    self.key_type_map,
+                    path + (data_netclass_name,),
+                    ignore_case=True,
+                )
+            )
+        return errors
+
     def eject(self, brd):
         """Return a dict of net class definitions from a KiCad BOARD object."""
 
@@ -308,6 +1275,20 @@ class NetClassDefs(KinJector):
 
         return {self.dict_key: netclass_dict}
 
+    def restore(self, snapshot, brd):
+        """Restore the net class definitions and remove any net classes created since the snapshot."""
+
+        self.inject(snapshot, brd)
+
+        snapshot_names = snapshot[self.dict_key]
+        new_names = [
+            str(name)
+            for name in brd.GetNetClasses().NetClasses().keys()
+            if str(name) not in snapshot_names
+        ]
+        for name in new_names:
+            brd.GetNetClasses().Remove(name)
+
 
 class NetClassAssigns(KinJector):
     """Inject/eject net class assignments to/from a KiCad BOARD object."""
@@ -320,6 +1301,10 @@ class NetClassAssigns(KinJector):
         # Get the netclass assignment for each net from the data dict.
         data_netclass_assigns = data_dict.get(self.dict_key, {})
 
+        # Changing the classes of nets changes how every zone gets filled.
+        if data_netclass_assigns:
+            mark_zones_stale(brd)
+
         # Get all the nets in the board indexed by net names.
         brd_nets = brd.GetNetInfo().NetsByName()
 
@@ -353,6 +1338,22 @@ class NetClassAssigns(KinJector):
             new_net_class.NetNames().add(data_net_name)
             brd_net.SetClass(new_net_class)
 
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the net class assignments of data_dict."""
+
+        data_netclass_assigns = data_dict.get(self.dict_key, {})
+        path = path + (self.dict_key,)
+
+        errors = check_mapping(data_netclass_assigns, path)
+        if errors:
+            return errors
+
+        for data_net_name, data_net_class_name in data_netclass_assigns.items():
+            errors.extend(
+                check_value(data_net_class_name, "string", path + (data_net_name,))
+            )
+        return errors
+
     def eject(self, brd):
         """Return a dict of net class assignments from a KiCad BOARD object."""
 
@@ -382,6 +1383,13 @@ class NetClasses(KinJector):
         # Load the net/net class assignments into the board.
         NetClassAssigns().inject(data_drs, brd)
 
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the net class defs and assignments of data_dict."""
+
+        return check_sections(
+            data_dict, self.dict_key, [NetClassDefs(), NetClassAssigns()], path
+        )
+
     def eject(self, brd):
         """Return a dict of net class defs and assignments from a KiCad BOARD object."""
 
@@ -395,6 +1403,15 @@ class NetClasses(KinJector):
 
         return {self.dict_key: data_drs}
 
+    def restore(self, snapshot, brd):
+        """Restore the net class defs and assignments recorded by snapshot()."""
+
+        data_drs = snapshot[self.dict_key]
+
+        # Move the nets back to their old classes before any new classes are removed.
+        NetClassAssigns().restore(data_drs, brd)
+        NetClassDefs().restore(data_drs, brd)
+
 
 class TrackWidths(KinJector):
     """Inject/eject track widths to/from a KiCad board object."""
@@ -428,6 +1445,22 @@ class TrackWidths(KinJector):
         # set by the Default net class.
         return {self.dict_key: [w for w in brd_drs.m_TrackWidthList][1:]}
 
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the track widths of data_dict."""
+
+        path = path + (self.dict_key,)
+        errors = []
+        try:
+            data_widths = data_dict[self.dict_key]
+        except KeyError:
+            return errors
+
+        if not isinstance(data_widths, list):
+            return ["{}: expected a list of track widths.".format(path_str(path))]
+        for i, width in enumerate(data_widths):
+            errors.extend(check_value(width, "size", path + (i,)))
+        return errors
+
 
 class ViaDimensions(KinJector):
     """Inject/eject via dimensions to/from a KiCad board object."""
@@ -472,6 +1505,13 @@ class ViaDimensions(KinJector):
             ]
         }
 
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the via dimensions of data_dict."""
+
+        return check_dimensions_list(
+            data_dict, self.dict_key, ["diameter", "drill"], path
+        )
+
 
 class DiffPairDimensions(KinJector):
     """Inject/eject differential pair dimensions to/from a KiCad board object."""
@@ -519,6 +1559,13 @@ class DiffPairDimensions(KinJector):
             ]
         }
 
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the diff pair dimensions of data_dict."""
+
+        return check_dimensions_list(
+            data_dict, self.dict_key, ["width", "gap", "via gap"], path
+        )
+
 
 class TracksViasDPs(KinJector):
     """Inject/eject tracks, vias, and differential pairs to/from a KiCad BOARD object."""
@@ -540,6 +1587,16 @@ class TracksViasDPs(KinJector):
         # Load the diff pair dimensions back into the board.
         DiffPairDimensions().inject(data_drs, brd)
 
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the tracks, vias, and differential pairs of data_dict."""
+
+        return check_sections(
+            data_dict,
+            self.dict_key,
+            [TrackWidths(), ViaDimensions(), DiffPairDimensions()],
+            path,
+        )
+
     def eject(self, brd):
         """Return a dict of tracks, vias, and differential pairs from a KiCad BOARD object."""
 
@@ -562,6 +1619,13 @@ class SolderMaskPaste(KinJector):
 
     dict_key = "solder mask/paste"
 
+    key_type_map = {
+        "solder mask clearance": "int",
+        "solder mask min width": "size",
+        "solder paste clearance": "int",
+        "solder paste clearance ratio": "number",
+    }
+
     def inject(self, data_dict, brd):
         """Inject solder mask/paste settings from data_dict into a KiCad BOARD object."""
 
@@ -571,6 +1635,10 @@ class SolderMaskPaste(KinJector):
         # Get the design rules from the board.
         brd_drs = brd.GetDesignSettings()
 
+        # Changing the mask/paste clearances changes how every zone gets filled.
+        if data_drs:
+            mark_zones_stale(brd)
+
         # Update the design rules with values from the data dict.
         # If a particular design rule parameter doesn't exist, just pass it by.
 
@@ -640,6 +1708,22 @@ class BoardSetup(KinJector):
         # Load the solder paste/mask dimensions back into the board.
         SolderMaskPaste().inject(data_setup, brd)
 
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the board setup of data_dict."""
+
+        return check_sections(
+            data_dict,
+            self.dict_key,
+            [
+                Layers(),
+                DesignRules(),
+                NetClasses(),
+                TracksViasDPs(),
+                SolderMaskPaste(),
+            ],
+            path,
+        )
+
     def eject(self, brd):
         """Return a dict of board setup from a KiCad BOARD object."""
 
@@ -662,6 +1746,16 @@ class BoardSetup(KinJector):
 
         return {self.dict_key: data_setup}
 
+    def restore(self, snapshot, brd):
+        """Restore the board setup recorded by snapshot()."""
+
+        data_setup = snapshot[self.dict_key]
+        Layers().restore(data_setup, brd)
+        DesignRules().restore(data_setup, brd)
+        NetClasses().restore(data_setup, brd)
+        TracksViasDPs().restore(data_setup, brd)
+        SolderMaskPaste().restore(data_setup, brd)
+
 
 class Plot(KinJector):
     """Inject/eject plot settings to/from a KiCad BOARD object."""
@@ -750,6 +1844,45 @@ class Plot(KinJector):
         "layers": KinJector.GetSet(lambda x: None, lambda x, y: None),
     }
 
+    key_type_map = {
+        "force a4 output": "bool",
+        "autoscale": "bool",
+        "color": "any",
+        "plot in outline mode": "bool",
+        "drill marks": "drill marks",
+        "x scale factor": "number",
+        "y scale factor": "number",
+        "hpgl pen size": "number",
+        "hpgl pen num": "int",
+        "hpgl pen speed": "int",
+        "mirrored plot": "bool",
+        "negative plot": "bool",
+        "output directory": "string",
+        "plot mode": "int",
+        "scale": "number",
+        "skip npth pads": "bool",
+        "text mode": "int",
+        "generate gerber job file": "bool",
+        "exclude pcb edge": "bool",
+        "format": "int",
+        "coordinate format": "int",
+        "include netlist attributes": "bool",
+        "default line width": "size",
+        "plot border": "bool",
+        "plot invisible text": "bool",
+        "plot pads on silk": "bool",
+        "plot footprint refs": "bool",
+        "plot footprint values": "bool",
+        "do not tent vias": "bool",
+        "scaling": "int",
+        "subtract soldermask from silk": "bool",
+        "use aux axis as origin": "bool",
+        "use protel filename extensions": "bool",
+        "use x2 format": "bool",
+        "track width correction": "int",
+        "layers": "layers",
+    }
+
     def inject(self, data_dict, brd):
         """Inject plot settings from data_dict into a KiCad BOARD object."""
 
@@ -779,6 +1912,16 @@ class Plot(KinJector):
         # Load the modified plot settings into the board.
         brd.SetPlotOptions(brd_plot_settings)
 
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the plot settings of data_dict."""
+
+        return check_keys(
+            data_dict.get(self.dict_key, {}),
+            self.key_type_map,
+            path + (self.dict_key,),
+            ignore_case=True,
+        )
+
     def eject(self, brd):
         """Return a dict of plot settings from a KiCad BOARD object."""
 
@@ -795,6 +1938,12 @@ class Plot(KinJector):
         return {self.dict_key: plot_settings_dict}
 
 
+class PositionRecord(Record):
+    """Compact dict of the position data of a part."""
+
+    __slots__ = ("x", "y", "angle", "side")
+
+
 class ModulePosition(KinJector):
     """Inject/eject part (X,Y), rotation, front/back to/from a KiCad MODULE object."""
 
@@ -803,6 +1952,8 @@ class ModulePosition(KinJector):
     # Index top and bottom of boards by their layer number in PCBNEW.
     top_btm = {F_Cu: "top", B_Cu: "bottom"}
 
+    key_type_map = {"x": "int", "y": "int", "angle": "number", "side": "side"}
+
     def inject(self, data_dict, module):
         """Inject part position from data_dict into a KiCad MODULE object."""
 
@@ -811,54 +1962,169 @@ class ModulePosition(KinJector):
         except KeyError:
             return  # No position data to inject into MODULE object.
 
-        # Set the (X,Y) position.
-        try:
-            module.SetPosition(wxPoint(pos_data["x"], pos_data["y"]))
-        except IndexError:
-            pass  # No (X,Y) data, so skip it.
-
-        # Set the orientation (in degrees).
-        try:
-            module.SetOrientationDegrees(pos_data["angle"])
-        except IndexError:
-            pass  # No angle data, so skip it.
+        # Set the (X,Y) position. A missing X or Y keeps its current value.
+        if "x" in pos_data or "y" in pos_data:
+            pos = module.GetPosition()
+            module.SetPosition(
+                wxPoint(pos_data.get("x", pos.x), pos_data.get("y", pos.y))
+            )
 
         # Set whether the board is on the top or bottom side of the PCB.
+        # This is done before setting the angle because flipping a part
+        # also mirrors its orientation.
         module_side = self.top_btm[module.GetLayer()]
         try:
             if module_side != pos_data["side"].lower():
                 module.Flip(module.GetPosition())
-        except IndexError:
+        except KeyError:
             pass  # No top-side/bottom-side data, so skip it.
 
+        # Set the orientation (in degrees).
+        try:
+            module.SetOrientationDegrees(pos_data["angle"])
+        except KeyError:
+            pass  # No angle data, so skip it.
+
     def eject(self, module):
         """Return a dict with the part position from a KiCad MODULE object."""
 
-        pos = module.GetPosition()
-        return {
-            self.dict_key: {
-                "x": pos.x,
-                "y": pos.y,
-                "angle": module.GetOrientationDegrees(),
-                "side": self.top_btm[module.GetLayer()],
-            }
-        }
+        return {self.dict_key: dict(self.eject_record(module))}
+
+    def eject_record(self, module, fields=None):
+        """
+        Return a PositionRecord with the part position from a KiCad MODULE object.
+
+        Args:
+            module: The KiCad MODULE object.
+            fields: Field tree selecting the position values to eject
+                (e.g., {"x": None, "y": None}). If None, all of them are ejected.
+                Only the MODULE methods needed for the selected values are called.
+        """
+
+        if fields is None:
+            fields = PositionRecord.__slots__
+
+        record = PositionRecord()
+        if "x" in fields or "y" in fields:
+            pos = module.GetPosition()
+            if "x" in fields:
+                record.x = pos.x
+            if "y" in fields:
+                record.y = pos.y
+        if "angle" in fields:
+            record.angle = module.GetOrientationDegrees()
+        if "side" in fields:
+            record.side = self.top_btm[module.GetLayer()]
+        return record
+
+
+class ModuleRecord(Record):
+    """Compact dict of the data for a part."""
+
+    __slots__ = ("position", "value", "footprint", "locked", "pads")
+
+
+def get_pads(module):
+    """Return a list with the name and (X,Y) position of each pad of a part."""
+
+    pads = []
+    for pad in module.Pads():
+        pos = pad.GetPosition()
+        pads.append({"name": str(pad.GetName()), "x": pos.x, "y": pos.y})
+    return pads
 
 
 class Module(KinJector):
     """Inject/eject part data to/from a KiCad MODULE object."""
 
+    # Functions that get each field (other than position) from a KiCad MODULE object.
+    field_getters = {
+        "value": lambda module: str(module.GetValue()),
+        "footprint": ModuleIndex.get_name,
+        "locked": lambda module: module.IsLocked(),
+        "pads": get_pads,
+    }
+
+    # The footprint and pads are only for reference and aren't injected.
+    key_type_map = {
+        "value": "string",
+        "footprint": "string",
+        "locked": "bool",
+        "pads": "any",
+    }
+
+    # Fields that are ejected if no others are selected.
+    default_fields = {ModulePosition.dict_key: None}
+
+    def __init__(self, compact=False, fields=None):
+        """
+        Create an object for injecting/ejecting part data.
+
+        Args:
+            compact: If true, ejected part data is returned as a ModuleRecord
+                instead of a dict. This takes much less memory when there are
+                a lot of parts.
+            fields: Field tree (see parse_fields()) selecting the part data to
+                eject, e.g. {"position": {"x": None}, "value": None}. If None,
+                only the position is ejected.
+        """
+        self.compact = compact
+        self.fields = self.default_fields if fields is None else fields
+        for field, subfields in self.fields.items():
+            if field == ModulePosition.dict_key:
+                for subfield in subfields or []:
+                    if subfield not in PositionRecord.__slots__:
+                        raise ValueError(
+                            "Unknown part position field: {!r}".format(subfield)
+                        )
+            elif field not in self.field_getters:
+                raise ValueError("Unknown part field: {!r}".format(field))
+
     def inject(self, data_dict, module):
         """Inject part data from data_dict into a KiCad MODULE object."""
 
         ModulePosition().inject(data_dict, module)
 
+        try:
+            module.SetValue(data_dict["value"])
+        except KeyError:
+            pass  # No value, so skip it.
+
+        try:
+            module.SetLocked(data_dict["locked"])
+        except KeyError:
+            pass  # No lock state, so skip it.
+
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the part data of data_dict."""
+
+        errors = check_mapping(data_dict, path)
+        if errors:
+            return errors
+
+        allowed_keys = [ModulePosition.dict_key] + list(self.key_type_map)
+        for key, value in data_dict.items():
+            if key == ModulePosition.dict_key:
+                continue
+            if key in self.key_type_map:
+                errors.extend(check_value(value, self.key_type_map[key], path + (key,)))
+            else:
+                errors.append(unknown_key_error(key, allowed_keys, path))
+        errors.extend(ModulePosition().validate(data_dict, path))
+        return errors
+
     def eject(self, module):
-        """Return a dict of part data from a KiCad MODULE object."""
+        """Return a dict of the selected part data from a KiCad MODULE object."""
 
-        data_dict = {}
-        data_dict.update(ModulePosition().eject(module))
-        return data_dict
+        record = ModuleRecord()
+        for field, subfields in self.fields.items():
+            if field == ModulePosition.dict_key:
+                record.position = ModulePosition().eject_record(module, subfields)
+            else:
+                setattr(record, field, self.field_getters[field](module))
+        if self.compact:
+            return record
+        return plain_data(record)
 
 
 class ModulesByRef(KinJector):
@@ -866,9 +2132,33 @@ class ModulesByRef(KinJector):
 
     dict_key = "modules"
 
+    def __init__(self, compact=False, fields=None, region=None):
+        """
+        Create an object for injecting/ejecting data to/from parts.
+
+        Args:
+            compact: If true, the data for each ejected part is stored in a
+                ModuleRecord instead of a dict.
+            fields: Field tree (see parse_fields()) whose keys are glob patterns
+                for the part IDs and whose values select the data to eject
+                from the matching parts, e.g. {"*": {"value": None}}. Parts
+                that don't match are skipped. If None, the position of every
+                part is ejected.
+            region: Region dict (see ModuleGrid.query()) that limits ejection
+                to the parts inside it. If None, all the parts are ejected.
+        """
+        self.compact = compact
+        self.fields = fields
+        self.region = region
+
     @staticmethod
     def get_id(module):
-        return str(module.GetReference())
+        return ModuleIndex.get_ref(module)
+
+    @staticmethod
+    def get_index(brd):
+        """Return a dict of the parts in a KiCad BOARD object indexed by their IDs."""
+        return ModuleIndex.of(brd).by_ref
 
     def inject(self, data_dict, brd):
         """Inject data from data_dict into parts of a KiCad BOARD object."""
@@ -876,33 +2166,584 @@ class ModulesByRef(KinJector):
         # Get the module data from the data dict.
         data_modules = data_dict.get(self.dict_key, {})
 
+        # Moving parts changes how the zones around them get filled.
+        if data_modules:
+            mark_zones_stale(brd)
+
+        self.inject_parts(data_modules.items(), brd)
+
+    def inject_parts(self, parts, brd):
+        """
+        Inject data into parts of a KiCad BOARD object.
+
+        Args:
+            parts: Iterable of (part ID, part data dict) pairs. It can be a
+                generator so the data for all the parts never has to be held
+                at once. The zones aren't marked as stale here.
+            brd: The KiCad BOARD object.
+
+        Returns:
+            The number of parts that were found on the board.
+        """
+
         # Get all the parts in the board indexed by references.
-        brd_modules = {self.get_id(m): m for m in brd.GetModules()}
+        brd_modules = self.get_index(brd)
+        grid = board_cache(brd).get("module grid")
+        module = Module()
 
         # Assign the data in the data_dict to the parts on the board.
-        for data_module_ref, data_module_data in data_modules.items():
+        num_found = 0
+        for data_module_ref, data_module_data in parts:
 
             # Check to see if the part from the data dict exists on the board.
             try:
                 brd_module = brd_modules[data_module_ref]
             except KeyError:
                 continue  # Should we signal an error for a missing part?
+            num_found += 1
 
             # Inject the data into the part.
-            Module().inject(data_module_data, brd_module)
+            module.inject(data_module_data, brd_module)
+
+            # Keep the spatial index up to date with the moved part.
+            if ModulePosition.dict_key in data_module_data:
+                mark_modules_moved(brd, [brd_module])
+                if grid is not None:
+                    grid.update(brd_module)
+        return num_found
+
+    # Part data that's recorded in snapshots because it can be injected.
+    snapshot_fields = {ModulePosition.dict_key: None, "value": None, "locked": None}
+
+    def snapshot(self, data_dict, brd):
+        """Return the injectable data of only the parts in data_dict."""
+
+        brd_modules = self.get_index(brd)
+        module = Module(fields=self.snapshot_fields)
+        return {
+            self.dict_key: {
+                part_id: module.eject(brd_modules[part_id])
+                for part_id in data_dict.get(self.dict_key, {})
+                if part_id in brd_modules
+            }
+        }
+
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the part data of data_dict."""
+
+        data_modules = data_dict.get(self.dict_key, {})
+        path = path + (self.dict_key,)
+
+        errors = check_mapping(data_modules, path)
+        if errors:
+            return errors
+
+        for data_module_ref, data_module_data in data_modules.items():
+            errors.extend(Module().validate(data_module_data, path + (data_module_ref,)))
+        return errors
+
+    def select_parts(self, brd):
+        """Return a list of the ID and MODULE object of each part in the selected region."""
+
+        if self.region is None:
+            return list(self.get_index(brd).items())
+        return [
+            (self.get_id(part), part) for _, part in ModuleGrid.of(brd).query(self.region)
+        ]
+
+    def eject_parts(self, brd):
+        """Generate the ID and selected data of each selected part in a KiCad BOARD object."""
+
+        # Without a field selection, eject the default data from every part.
+        if self.fields is None:
+            module = Module(self.compact)
+            for part_id, part in self.select_parts(brd):
+                yield part_id, module.eject(part)
+            return
+
+        # Otherwise, find the fields selected for each part. Parts with the
+        # same fields share a Module object.
+        modules = {}
+        for part_id, part in self.select_parts(brd):
+            part_fields = match_fields(part_id, self.fields)
+            if part_fields == {}:
+                continue  # Part isn't selected.
+            key = repr(part_fields)
+            try:
+                module = modules[key]
+            except KeyError:
+                module = modules[key] = Module(self.compact, part_fields)
+            yield part_id, module.eject(part)
 
     def eject(self, brd):
         """Return part data from parts as a dict in a KiCad BOARD object."""
 
-        # Get all the parts in the board indexed by references.
-        brd_parts = {self.get_id(m): m for m in brd.GetModules()}
-
         # Get data from each part and store it in dict using part ref as key.
-        part_data_dict = {
-            part_ref: Module().eject(part) for (part_ref, part) in brd_parts.items()
+        return {self.dict_key: dict(self.eject_parts(brd))}
+
+    def diff(self, brd, baseline_dict, path=()):
+        """Generate JSON Patch operations that change baseline_dict to match a KiCad BOARD object."""
+
+        # Without a baseline for the parts, just add all of them.
+        try:
+            baseline_modules = baseline_dict[self.dict_key]
+        except KeyError:
+            yield {
+                "op": "add",
+                "path": json_pointer(path + (self.dict_key,)),
+                "value": self.eject(brd)[self.dict_key],
+            }
+            return
+
+        path = path + (self.dict_key,)
+
+        # Compare the parts one at a time so the ejected data for all the parts
+        # never has to be held at once.
+        for part_ref, part_data in self.eject_parts(brd):
+            try:
+                baseline_part_data = baseline_modules[part_ref]
+            except KeyError:
+                yield {
+                    "op": "add",
+                    "path": json_pointer(path + (part_ref,)),
+                    "value": part_data,
+                }
+            else:
+                for op in diff_dicts(baseline_part_data, part_data, path + (part_ref,)):
+                    yield op
+
+        # Remove any baseline parts that aren't on the board.
+        brd_parts = self.get_index(brd)
+        for part_ref in baseline_modules:
+            if part_ref not in brd_parts:
+                yield {"op": "remove", "path": json_pointer(path + (part_ref,))}
+
+
+class ModulesByPath(ModulesByRef):
+    """
+    Inject/eject data to/from parts in a KiCad BOARD object by part path.
+
+    A part keeps its path when the board is reannotated, so data ejected
+    this way can still be injected after the part references have changed.
+    """
+
+    dict_key = "modules by path"
+
+    @staticmethod
+    def get_id(module):
+        return ModuleIndex.get_path(module)
+
+    @staticmethod
+    def get_index(brd):
+        """Return a dict of the parts in a KiCad BOARD object indexed by their IDs."""
+        return ModuleIndex.of(brd).by_path
+
+
+class ModulesByRegion(KinJector):
+    """
+    Inject data into all the parts found in regions of a KiCad BOARD object.
+
+    The data is a list of region dicts (see ModuleGrid.query()) that each
+    have an optional "offset" ({"x": ..., "y": ...}) that moves the parts in
+    the region, and optional part "data" that's injected into each of them.
+    The parts are found using the spatial index of the board, so only the
+    parts near each region are checked.
+    """
+
+    dict_key = "module regions"
+
+    def inject(self, data_dict, brd):
+        """Inject data from data_dict into the parts in regions of a KiCad BOARD object."""
+
+        data_regions = data_dict.get(self.dict_key, [])
+
+        # Moving parts changes how the zones around them get filled.
+        if data_regions:
+            mark_zones_stale(brd)
+
+        grid = ModuleGrid.of(brd)
+        for data_region in data_regions:
+            region = {k: v for k, v in data_region.items() if k in region_key_type_map}
+            offset = data_region.get("offset", {})
+            module_data = data_region.get("data", {})
+
+            # Find all the parts before any of them are moved.
+            for _, module in grid.query(region):
+                if offset:
+                    pos = module.GetPosition()
+                    module.SetPosition(
+                        wxPoint(pos.x + offset.get("x", 0), pos.y + offset.get("y", 0))
+                    )
+                Module().inject(module_data, module)
+                if offset or ModulePosition.dict_key in module_data:
+                    grid.update(module)
+                    mark_modules_moved(brd, [module])
+
+    def snapshot(self, data_dict, brd):
+        """Return the injectable data of the parts in the regions of data_dict."""
+
+        # Any part changed by the regions is in at least one of them before
+        # any parts are moved.
+        grid = ModuleGrid.of(brd)
+        refs = set()
+        for data_region in data_dict.get(self.dict_key, []):
+            region = {k: v for k, v in data_region.items() if k in region_key_type_map}
+            refs.update(ref for ref, _ in grid.query(region))
+
+        modules = ModulesByRef()
+        return modules.snapshot({modules.dict_key: dict.fromkeys(refs)}, brd)
+
+    def restore(self, snapshot, brd):
+        """Return the parts in the regions to the state recorded by snapshot()."""
+
+        ModulesByRef().restore(snapshot, brd)
+
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the region data of data_dict."""
+
+        errors = []
+        try:
+            data_regions = data_dict[self.dict_key]
+        except KeyError:
+            return errors
+
+        path = path + (self.dict_key,)
+        if not isinstance(data_regions, list):
+            return ["{}: expected a list of regions.".format(path_str(path))]
+
+        for i, data_region in enumerate(data_regions):
+            region_path = path + (i,)
+            region_errors = check_mapping(data_region, region_path)
+            if region_errors:
+                errors.extend(region_errors)
+                continue
+            region = {}
+            for key, value in data_region.items():
+                if key == "offset":
+                    errors.extend(
+                        check_keys(value, {"x": "int", "y": "int"}, region_path + (key,))
+                    )
+                elif key == "data":
+                    errors.extend(Module().validate(value, region_path + (key,)))
+                else:
+                    region[key] = value
+            errors.extend(check_region(region, region_path))
+        return errors
+
+
+class Tracks(KinJector):
+    """Inject/eject the geometry of tracks and vias to/from a KiCad BOARD object."""
+
+    dict_key = "tracks"
+
+    # The data for the track segments and vias is stored in columns: one
+    # list for each column with an entry for each segment or via, in the
+    # order they're found in the board. Only the columns listed in
+    # settable_columns are injected; the others are just for reference.
+    segment_columns = ("start x", "start y", "end x", "end y", "width", "layer", "net")
+    via_columns = ("x", "y", "diameter", "drill", "top layer", "bottom layer", "net")
+    column_types = {
+        "start x": "int",
+        "start y": "int",
+        "end x": "int",
+        "end y": "int",
+        "x": "int",
+        "y": "int",
+        "width": "size",
+        "diameter": "size",
+        "drill": "size",
+        "layer": "int",
+        "top layer": "int",
+        "bottom layer": "int",
+        "net": "string",
+    }
+    settable_columns = {
+        "segments": ("width", "net"),
+        "vias": ("diameter", "drill", "net"),
+    }
+
+    @staticmethod
+    def split_tracks(brd):
+        """Return lists of the track segments and vias in a KiCad BOARD object."""
+
+        segments, vias = [], []
+        for track in brd.GetTracks():
+            if track.Type() == PCB_VIA_T:
+                vias.append(track.Cast())
+            else:
+                segments.append(track)
+        return segments, vias
+
+    def inject(self, data_dict, brd):
+        """Inject track/via widths and nets from data_dict into a KiCad BOARD object."""
+
+        try:
+            data_tracks = data_dict[self.dict_key]
+        except KeyError:
+            return  # No track data to inject into the board.
+
+        segments, vias = self.split_tracks(brd)
+        nets = {}  # Cache of the nets found on the board, indexed by name.
+
+        # Changing the tracks changes how the zones around them get filled.
+        if data_tracks:
+            mark_zones_stale(brd)
+
+        # Only change the tracks whose values are different from the data.
+
+        def set_width(track, width):
+            if track.GetWidth() != width:
+                track.SetWidth(width)
+
+        def set_drill(via, drill):
+            if via.GetDrillValue() != drill:
+                via.SetDrill(drill)
+
+        def set_net(track, net_name):
+            if track.GetNetname() != net_name:
+                try:
+                    net = nets[net_name]
+                except KeyError:
+                    net = brd.FindNet(net_name)
+                    if net is None:
+                        raise KeyError("Net {!r} is not on the board.".format(net_name))
+                    nets[net_name] = net
+                track.SetNet(net)
+
+        setters = {
+            "width": set_width,
+            "diameter": set_width,
+            "drill": set_drill,
+            "net": set_net,
         }
 
-        return {self.dict_key: part_data_dict}
+        for table, tracks in (("segments", segments), ("vias", vias)):
+            data_table = data_tracks.get(table, {})
+            for column in self.settable_columns[table]:
+                try:
+                    data_column = data_table[column]
+                except KeyError:
+                    continue  # No data for this column, so skip it.
+                if len(data_column) != len(tracks):
+                    raise ValueError(
+                        "The {} {} column has {} entries but the board has {} {}.".format(
+                            table, column, len(data_column), len(tracks), table
+                        )
+                    )
+                setter = setters[column]
+                for track, value in zip(tracks, data_column):
+                    setter(track, value)
+
+    def snapshot(self, data_dict, brd):
+        """Return only the columns of track data that data_dict would change."""
+
+        data_tracks = data_dict.get(self.dict_key, {})
+        brd_tracks = self.eject(brd)[self.dict_key]
+        return {
+            self.dict_key: {
+                table: {
+                    column: brd_tracks[table][column]
+                    for column in columns
+                    if column in data_tracks.get(table, {})
+                }
+                for table, columns in self.settable_columns.items()
+            }
+        }
+
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the track data of data_dict."""
+
+        data_tracks = data_dict.get(self.dict_key, {})
+        path = path + (self.dict_key,)
+
+        errors = check_mapping(data_tracks, path)
+        if errors:
+            return errors
+
+        tables = {"segments": self.segment_columns, "vias": self.via_columns}
+        for table, data_table in data_tracks.items():
+            try:
+                columns = tables[table]
+            except KeyError:
+                errors.append(unknown_key_error(table, tables, path))
+                continue
+            table_path = path + (table,)
+            errors.extend(check_mapping(data_table, table_path))
+            if not isinstance(data_table, Mapping):
+                continue
+            for column, data_column in data_table.items():
+                if column not in columns:
+                    errors.append(unknown_key_error(column, columns, table_path))
+                elif not isinstance(data_column, list):
+                    errors.append(
+                        "{}: expected a list.".format(path_str(table_path + (column,)))
+                    )
+                else:
+                    for i, value in enumerate(data_column):
+                        errors.extend(
+                            check_value(
+                                value,
+                                self.column_types[column],
+                                table_path + (column, i),
+                            )
+                        )
+            if len(set(len(c) for c in data_table.values() if isinstance(c, list))) > 1:
+                errors.append(
+                    "{}: columns have different lengths.".format(path_str(table_path))
+                )
+        return errors
+
+    def eject(self, brd):
+        """Return a dict of track and via geometry from a KiCad BOARD object."""
+
+        segments = {column: [] for column in self.segment_columns}
+        vias = {column: [] for column in self.via_columns}
+
+        # Bind the append method of each column once instead of looking it
+        # up for every track.
+        seg_start_x, seg_start_y, seg_end_x, seg_end_y, seg_width, seg_layer, seg_net = [
+            segments[column].append for column in self.segment_columns
+        ]
+        via_x, via_y, via_dia, via_drill, via_top, via_btm, via_net = [
+            vias[column].append for column in self.via_columns
+        ]
+
+        # Fill the columns with a single sweep through the tracks.
+        for track in brd.GetTracks():
+            if track.Type() == PCB_VIA_T:
+                via = track.Cast()
+                pos = via.GetPosition()
+                via_x(pos.x)
+                via_y(pos.y)
+                via_dia(via.GetWidth())
+                via_drill(via.GetDrillValue())
+                via_top(via.TopLayer())
+                via_btm(via.BottomLayer())
+                via_net(str(via.GetNetname()))
+            else:
+                start = track.GetStart()
+                end = track.GetEnd()
+                seg_start_x(start.x)
+                seg_start_y(start.y)
+                seg_end_x(end.x)
+                seg_end_y(end.y)
+                seg_width(track.GetWidth())
+                seg_layer(track.GetLayer())
+                seg_net(str(track.GetNetname()))
+
+        return {self.dict_key: {"segments": segments, "vias": vias}}
+
+
+class Zones(KinJector):
+    """Inject/eject the settings of copper zones to/from a KiCad BOARD object."""
+
+    dict_key = "zones"
+
+    # Associate each zone parameter key with methods for getting/setting
+    # it in the board's zone structure.
+    key_method_map = {
+        "clearance": KinJector.GetSet(ZC.GetZoneClearance, ZC.SetZoneClearance),
+        "min width": KinJector.GetSet(ZC.GetMinThickness, ZC.SetMinThickness),
+        "thermal relief gap": KinJector.GetSet(
+            ZC.GetThermalReliefGap, ZC.SetThermalReliefGap
+        ),
+        "thermal relief copper bridge": KinJector.GetSet(
+            ZC.GetThermalReliefCopperBridge, ZC.SetThermalReliefCopperBridge
+        ),
+        "pad connection": KinJector.GetSet(ZC.GetPadConnection, ZC.SetPadConnection),
+        "priority": KinJector.GetSet(ZC.GetPriority, ZC.SetPriority),
+        "fill mode": KinJector.GetSet(ZC.GetFillMode, ZC.SetFillMode),
+    }
+
+    # The net and layer of each zone are ejected so the zones can be
+    # identified, but they're only checked (not changed) when injected.
+    key_type_map = {
+        "net": "string",
+        "layer": "int",
+        "clearance": "size",
+        "min width": "size",
+        "thermal relief gap": "size",
+        "thermal relief copper bridge": "size",
+        "pad connection": "int",
+        "priority": "size",
+        "fill mode": "int",
+    }
+
+    @staticmethod
+    def get_ids(zone):
+        """Return a dict with the net and layer that identify a zone."""
+        return {"net": str(zone.GetNetname()), "layer": zone.GetLayer()}
+
+    def inject(self, data_dict, brd):
+        """Inject zone settings from data_dict into a KiCad BOARD object."""
+
+        try:
+            data_zones = data_dict[self.dict_key]
+        except KeyError:
+            return  # No zone settings to inject into the board.
+
+        # The zone settings in the data are in the same order as the zones in the board.
+        brd_zones = list(brd.Zones())
+        if len(data_zones) != len(brd_zones):
+            raise ValueError(
+                "There are settings for {} zones but the board has {} zones.".format(
+                    len(data_zones), len(brd_zones)
+                )
+            )
+
+        changed_zones = []
+        for i, (data_zone, brd_zone) in enumerate(zip(data_zones, brd_zones)):
+
+            # Make sure the settings are for the right zone.
+            for key, value in self.get_ids(brd_zone).items():
+                if key in data_zone and data_zone[key] != value:
+                    raise ValueError(
+                        "Zone {} has {} {!r} in the data but {!r} in the board.".format(
+                            i, key, data_zone[key], value
+                        )
+                    )
+
+            # Only change the settings that are different so unchanged zones
+            # won't be refilled.
+            for key, method in self.key_method_map.items():
+                try:
+                    value = data_zone[key]
+                except KeyError:
+                    continue  # No data for this setting, so skip it.
+                if method.get(brd_zone) != value:
+                    method.set(brd_zone, value)
+                    changed_zones.append(i)
+
+        mark_zones_stale(brd, changed_zones)
+
+    def validate(self, data_dict, path=()):
+        """Return a list of errors found in the zone settings of data_dict."""
+
+        try:
+            data_zones = data_dict[self.dict_key]
+        except KeyError:
+            return []
+
+        path = path + (self.dict_key,)
+        if not isinstance(data_zones, list):
+            return ["{}: expected a list of zone settings.".format(path_str(path))]
+
+        errors = []
+        for i, data_zone in enumerate(data_zones):
+            errors.extend(check_keys(data_zone, self.key_type_map, path + (i,)))
+        return errors
+
+    def eject(self, brd):
+        """Return a list of zone settings from a KiCad BOARD object."""
+
+        data_zones = []
+        for brd_zone in brd.Zones():
+            data_zone = self.get_ids(brd_zone)
+            for key, method in self.key_method_map.items():
+                data_zone[key] = method.get(brd_zone)
+            data_zones.append(data_zone)
+
+        return {self.dict_key: data_zones}
 
 
 class Board(KinJector):
@@ -910,26 +2751,198 @@ class Board(KinJector):
 
     dict_key = "board"
 
+    # Sections that are only ejected if they're selected because they
+    # can hold a lot of data. They're always injected if they're in the data.
+    optional_sections = collections.OrderedDict(
+        [(Tracks.dict_key, Tracks), (Zones.dict_key, Zones)]
+    )
+
+    # Keys of the board cache where the sections mark the parts and zones
+    # they change. They're restored along with the sections.
+    cache_marks = ("moved modules", "stale zones")
+
+    def __init__(self, compact=False, include=(), fields=None, region=None):
+        """
+        Create an object for injecting/ejecting board data.
+
+        Args:
+            compact: If true, ejected part data is stored in ModuleRecord
+                objects instead of dicts to save memory. Use plain_data() to
+                convert the ejected data into regular dicts.
+            include: Keys of the optional sections (e.g., "tracks") to eject
+                along with the rest of the board data.
+            fields: List of patterns (e.g., ["modules.*.value", "plot.layers"])
+                selecting the board data to eject. Only the sections named by
+                the patterns are ejected (including optional sections), and
+                only the part data that's selected is read from the parts.
+                If None, all the sections are ejected.
+            region: Region dict (see ModuleGrid.query()) that limits the
+                ejected part data to the parts inside it.
+        """
+        self.compact = compact
+        for key in include:
+            if key not in self.optional_sections:
+                raise ValueError("Unknown board section: {!r}".format(key))
+        self.include = include
+        self.fields = None if fields is None else parse_fields(fields)
+        self.region = region
+
+    def injectors(self):
+        """Return objects for injecting each section of board data."""
+
+        return [
+            BoardSetup(),  # Design rules.
+            Plot(),  # Plot settings.
+            ModulesByRef(),  # Module positions.
+            ModulesByPath(),  # Module positions indexed by path.
+            ModulesByRegion(),  # Data for all the modules in board regions.
+        ] + [section() for section in self.optional_sections.values()]
+
+    def ejectors(self):
+        """Return objects for ejecting each selected section of board data."""
+
+        if self.fields is None:
+            modules = ModulesByRef(self.compact, region=self.region)
+            return [BoardSetup(), Plot(), modules] + [
+                self.optional_sections[key]() for key in self.include
+            ]
+
+        # Only eject the sections named in the selected fields.
+        ejectors = []
+        sections = [BoardSetup, Plot, ModulesByRef] + list(
+            self.optional_sections.values()
+        )
+        for section in sections:
+            section_fields = match_fields(section.dict_key, self.fields)
+            if section_fields == {}:
+                continue
+            if section is ModulesByRef:
+                ejectors.append(
+                    ModulesByRef(self.compact, section_fields, self.region)
+                )
+            else:
+                ejectors.append(section())
+        return ejectors
+
+    def eject_section(self, section, brd):
+        """Return the selected data from a section of a KiCad BOARD object."""
+
+        section_data = section.eject(brd)
+        if self.fields is None or isinstance(section, ModulesByRef):
+            return section_data  # Part data is already limited to the selected fields.
+        return select_fields(section_data, self.fields)
+
     def inject(self, data_dict, brd):
-        """Inject board data from data_dict into a KiCad BOARD object."""
+        """
+        Inject board data from data_dict into a KiCad BOARD object.
 
-        # Get the design rule settings from the data dict.
-        brd_data = data_dict.get(self.dict_key, {})
+        The injection is all or nothing: the state of each section is recorded
+        before it's changed and, if any section fails, all the recorded
+        sections are restored before the exception is raised again. So the
+        BOARD object can still be used without reloading it.
 
-        # Load the design rules into the board.
-        BoardSetup().inject(brd_data, brd)
+        Zones affected by the injected data aren't refilled here. Call
+        refill_zones(brd) once before the board is saved.
+        """
 
-        # Load the plot settings into the board.
-        Plot().inject(brd_data, brd)
+        # Get the board data from the data dict.
+        brd_data = data_dict.get(self.dict_key, {})
 
-        # Load the module positions into the board.
-        ModulesByRef().inject(brd_data, brd)
+        # The parts and zones marked by the sections are part of the state, too.
+        cache = board_cache(brd)
+        marks = {key: set(cache[key]) for key in self.cache_marks if key in cache}
+
+        # Load each section of board data into the board.
+        snapshots = []
+        try:
+            for section in self.injectors():
+                if section.dict_key not in brd_data:
+                    continue
+                snapshots.append((section, section.snapshot(brd_data, brd)))
+                section.inject(brd_data, brd)
+        except Exception:
+            # Undo the changes in the opposite order they were made. A section
+            # that can't be restored doesn't stop the others or hide the error.
+            for section, snapshot in reversed(snapshots):
+                try:
+                    section.restore(snapshot, brd)
+                except Exception:
+                    logger.exception(
+                        "Couldn't restore the {} section.".format(section.dict_key)
+                    )
+            # Forget the parts and zones marked by the undone changes.
+            for key in self.cache_marks:
+                if key in marks:
+                    cache[key] = marks[key]
+                else:
+                    cache.pop(key, None)
+            raise
+
+    def validate(self, data_dict, path=()):
+        """
+        Check board data in data_dict before it's injected into a KiCad BOARD object.
+
+        Args:
+            data_dict: The dict of board data to check.
+            path: Tuple of keys leading from the top of the data dict to data_dict.
+
+        Returns:
+            A list of error messages for every unknown key or bad value that
+            was found (empty if no errors were found).
+        """
+
+        return check_sections(data_dict, self.dict_key, self.injectors(), path)
 
     def eject(self, brd):
         """Return a dict of board data from a KiCad BOARD object."""
 
         brd_data = {}
-        brd_data.update(BoardSetup().eject(brd))
-        brd_data.update(Plot().eject(brd))
-        brd_data.update(ModulesByRef().eject(brd))
+        for section in self.ejectors():
+            brd_data.update(self.eject_section(section, brd))
         return {self.dict_key: brd_data}
+
+    def diff(self, brd, baseline_dict, path=()):
+        """
+        Generate the changes between baseline data and a KiCad BOARD object.
+
+        Args:
+            brd: The KiCad BOARD object.
+            baseline_dict: Board data ejected at some earlier time.
+            path: Tuple of keys leading from the top of the data dict to baseline_dict.
+
+        Yields:
+            JSON Patch (RFC 6902) operations that change baseline_dict into
+            the data that would be ejected from the board now.
+        """
+
+        try:
+            brd_baseline = baseline_dict[self.dict_key]
+        except KeyError:
+            yield {
+                "op": "add",
+                "path": json_pointer(path + (self.dict_key,)),
+                "value": self.eject(brd)[self.dict_key],
+            }
+            return
+
+        path = path + (self.dict_key,)
+        if self.fields is None:
+            for section in self.ejectors():
+                for op in section.diff(brd, brd_baseline, path):
+                    yield op
+            return
+
+        # Only compare the selected fields with the baseline.
+        brd_baseline = select_fields(brd_baseline, self.fields)
+        for section in self.ejectors():
+            if isinstance(section, ModulesByRef):
+                for op in section.diff(brd, brd_baseline, path):
+                    yield op
+                continue
+            baseline_section = {}
+            if section.dict_key in brd_baseline:
+                baseline_section[section.dict_key] = brd_baseline[section.dict_key]
+            for op in diff_dicts(
+                baseline_section, self.eject_section(section, brd), path
+            ):
+                yield op
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+"""
+Keep track of the memory used while updating boards and keep it under a limit.
+
+The resident memory (RSS) of the process is sampled while each target file
+is updated to find its high-water mark. With a memory ceiling, KiCad boards
+are updated in a worker process that's replaced by a fresh one whenever the
+next board might push the memory of the run over the ceiling, since the
+memory used by pcbnew isn't always given back when a board is released.
+"""
+
+import gc
+import multiprocessing
+import os
+import pickle
+import re
+
+try:
+    import psutil
+except ImportError:
+    psutil = None  # Optional dependency.
+
+# Highest RSS sampled since the high-water mark was reset.
+sampled_peak = None
+
+# True if the kernel's own high-water mark (VmHWM) was reset along with sampled_peak.
+hwm_reset = False
+
+size_units = {"": 1 << 20, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(text):
+    """
+    Return the number of bytes for a size like "512M" or "2G".
+
+    A number without a unit is in megabytes. Raises ValueError for a bad size.
+    """
+
+    match = re.match(r"^\s*(\d+(?:\.\d*)?)\s*([KMGT]?)i?B?\s*$", text, re.IGNORECASE)
+    if match is None:
+        raise ValueError("Bad memory size: {!r}".format(text))
+    return int(float(match.group(1)) * size_units[match.group(2).upper()])
+
+
+def format_size(size):
+    """Return a size in bytes as a string in megabytes."""
+
+    return "{:.1f} MB".format(size / float(1 << 20))
+
+
+def current_rss():
+    """Return the resident memory of this process in bytes, or None if it can't be found."""
+
+    try:
+        with open("/proc/self/statm", "r") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return None
+
+
+def sample_rss():
+    """Sample the resident memory of this process for the high-water mark and return it."""
+
+    global sampled_peak
+    rss = current_rss()
+    if rss is not None and (sampled_peak is None or rss > sampled_peak):
+        sampled_peak = rss
+    return rss
+
+
+def reset_peak_rss():
+    """Start a new high-water mark for the resident memory of this process."""
+
+    global sampled_peak, hwm_reset
+    sampled_peak = None
+    sample_rss()
+
+    # Linux can reset its high-water mark, so peaks between samples are seen too.
+    try:
+        with open("/proc/self/clear_refs", "w") as fp:
+            fp.write("5")
+        hwm_reset = True
+    except (IOError, OSError):
+        hwm_reset = False
+
+
+def peak_rss():
+    """Return the high-water mark of the resident memory since reset_peak_rss(), or None."""
+
+    sample_rss()
+    peak = sampled_peak
+    if hwm_reset:
+        try:
+            with open("/proc/self/status", "r") as fp:
+                for line in fp:
+                    if line.startswith("VmHWM:"):
+                        peak = max(peak or 0, int(line.split()[1]) * 1024)
+        except (IOError, OSError, ValueError):
+            pass
+    return peak
+
+
+def worker_loop(conn, initializer, initargs):
+    """Run the tasks sent to a worker process and send back their results."""
+
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break  # The parent process went away.
+        if task is None:
+            break
+        func, args = task
+        reset_peak_rss()
+        start_rss = current_rss()
+        try:
+            status, value = "ok", func(*args)
+        except SystemExit as e:
+            status, value = "exit", e.code
+        except Exception as e:
+            status, value = "error", e
+            try:
+                pickle.dumps(e)
+            except Exception:
+                value = RuntimeError("{}: {}".format(type(e).__name__, e))
+        conn.send((status, value, start_rss, current_rss(), peak_rss()))
+    conn.close()
+
+
+class BoardWorker(object):
+    """Process that runs tasks one at a time so its memory can be given back by stopping it."""
+
+    def __init__(self, initializer=None, initargs=()):
+        self.conn, child_conn = multiprocessing.Pipe()
+        # Not a daemon, so the tasks can start processes of their own (e.g., for plotting).
+        self.process = multiprocessing.Process(
+            target=worker_loop, args=(child_conn, initializer, initargs)
+        )
+        self.process.start()
+        child_conn.close()
+
+    def run(self, func, args):
+        """
+        Run func(*args) in the worker process.
+
+        Returns:
+            The status ("ok", "exit" or "error"), the return value, exit code
+            or exception, and the RSS of the worker before and after the task
+            along with its high-water mark during the task.
+        """
+
+        self.conn.send((func, args))
+        try:
+            return self.conn.recv()
+        except EOFError:
+            raise RuntimeError("The worker process died (it may have run out of memory).")
+
+    def close(self):
+        """Stop the worker process."""
+
+        try:
+            self.conn.send(None)
+        except (IOError, OSError):
+            pass
+        self.conn.close()
+        self.process.join()
+
+
+class MemoryCeiling(object):
+    """Run board tasks in a worker process that's recycled to keep the memory of a run under a limit."""
+
+    def __init__(self, limit, logger, flush=None, initializer=None, initargs=()):
+        """
+        Args:
+            limit: Memory ceiling in bytes for this process and the worker together.
+            logger: Logger for reporting when the worker is recycled.
+            flush: Function that frees the caches of this process.
+            initializer: Function called with initargs when a worker starts.
+        """
+
+        self.limit = limit
+        self.logger = logger
+        self.flush = flush
+        self.initializer = initializer
+        self.initargs = initargs
+        self.worker = None
+        self.max_growth = 0  # Most memory taken by a single task so far.
+
+    def run(self, func, *args):
+        """
+        Run func(*args) in the worker process and return its high-water mark.
+
+        Exceptions and exits in the worker are raised here. Afterwards, the
+        caches are flushed and then the worker is recycled if the next task
+        might push the memory over the limit.
+        """
+
+        if self.worker is None:
+            self.worker = BoardWorker(self.initializer, self.initargs)
+        status, value, start_rss, end_rss, peak = self.worker.run(func, args)
+        if None not in (start_rss, peak):
+            self.max_growth = max(self.max_growth, peak - start_rss)
+
+        if self.projected_rss(end_rss) > self.limit:
+            # Free what this process can before giving up on the worker.
+            if self.flush is not None:
+                self.flush()
+            gc.collect()
+        if self.projected_rss(end_rss) > self.limit:
+            self.logger.info(
+                "Recycling the board worker to stay under {} (it's using {}).".format(
+                    format_size(self.limit), format_size(end_rss or 0)
+                )
+            )
+            self.close()
+
+        if status == "exit":
+            raise SystemExit(value)
+        if status == "error":
+            raise value
+        return peak
+
+    def projected_rss(self, worker_rss):
+        """Return the memory the run might need for the next task."""
+
+        return (current_rss() or 0) + (worker_rss or 0) + self.max_growth
+
+    def close(self):
+        """Stop the worker process (a new one is started for the next task)."""
+
+        if self.worker is not None:
+            self.worker.close()
+            self.worker = None
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+"""
+Find the sections of a KiCad board file without parsing all of it.
+
+The board file is memory-mapped and scanned once for the byte offsets of
+its top-level sections (setup, net_class, module, ...) and of the (at ...)
+position of each part. The offsets are stored next to the board in a small
+sidecar file (my_board.kicad_pcb.idx) along with the size, modification
+time and SHA-256 hash of the board, so later runs can go straight to the
+sections they need:
+
+    with SectionIndex("my_board.kicad_pcb") as index:
+        setup = index.nodes("setup")[0]
+        x, y, angle = index.module_position("R1")
+
+The sidecar is rebuilt whenever the board changes. If only the modification
+time of the board changed (e.g., after a checkout), the hash is used to
+check whether the offsets are still good.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import re
+
+from .fileio import STDIO, split_compression
+from .sexpr import parse_sexpr, to_nm
+
+# Version of the sidecar file format.
+index_version = 1
+
+# Quoted strings (which may hold parentheses) and parentheses.
+paren_re = re.compile(br'"(?:[^"\\]|\\.)*"|[()]')
+
+# Key of an S-expression node.
+key_re = re.compile(br"\(\s*([^\s()\"]+)")
+
+# Reference of a part in KiCad 5 and KiCad 6 boards.
+ref_re = re.compile(
+    br'\((?:fp_text\s+reference|property\s+"Reference")\s+("(?:[^"\\]|\\.)*"|[^\s()"]+)'
+)
+
+# Position of a part.
+at_re = re.compile(br"\(at\s+([^\s()]+)\s+([^\s()]+)(?:\s+([^\s()]+))?\s*\)")
+
+# Keys of the top-level nodes that hold parts.
+module_keys = ("module", "footprint")
+
+
+def index_file_name(file):
+    """Return the name of the sidecar file that holds the index of a board file."""
+
+    return file + ".idx"
+
+
+def file_mtime(file):
+    st = os.stat(file)
+    return getattr(st, "st_mtime_ns", st.st_mtime)
+
+
+def unquote(text):
+    if text.startswith('"'):
+        return re.sub(r"\\(.)", r"\1", text[1:-1])
+    return text
+
+
+def scan_sections(buf):
+    """
+    Find the top-level sections of a board held in a buffer.
+
+    Args:
+        buf: Bytes or memory-mapped contents of a board file.
+
+    Returns:
+        A dict of the (start, end) offsets of the sections with each key,
+        and a dict of the (start, end, at_start, at_end) offsets of the
+        part with each reference.
+
+    Raises:
+        ValueError: If the parentheses in the board aren't balanced.
+    """
+
+    sections = {}
+    modules = {}
+    depth = 0
+    start = None
+    for match in paren_re.finditer(buf):
+        paren = match.group()
+        if paren == b"(":
+            depth += 1
+            if depth == 2:
+                start = match.start()
+        elif paren == b")":
+            depth -= 1
+            if depth == 1:
+                end = match.end()
+                key = key_re.match(buf, start).group(1).decode("utf-8")
+                sections.setdefault(key, []).append((start, end))
+                if key in module_keys:
+                    ref = ref_re.search(buf, start, end)
+                    at = at_re.search(buf, start, end)
+                    if ref and at:
+                        ref = unquote(ref.group(1).decode("utf-8"))
+                        modules.setdefault(ref, []).append(
+                            (start, end, at.start(), at.end())
+                        )
+            elif depth < 0:
+                raise ValueError("Unbalanced ')' at byte {}.".format(match.start()))
+    if depth != 0:
+        raise ValueError("Unbalanced '(' in board.")
+    return sections, modules
+
+
+class SectionIndex(object):
+    """Offsets of the sections of a memory-mapped board file."""
+
+    def __init__(self, file, rebuild=False, save=True):
+        """
+        Map a board file into memory and read or build the index of its sections.
+
+        Args:
+            file: Path to an uncompressed board file.
+            rebuild: If true, scan the board even if its sidecar is up to date.
+            save: If false, the sidecar is only read, never written, so the
+                board is scanned each time unless it already has a sidecar.
+
+        Raises:
+            ValueError: If the board is compressed, empty or unbalanced.
+            IOError, OSError: If the board can't be read.
+        """
+
+        if file == STDIO or split_compression(file)[1] is not None:
+            raise ValueError("Only uncompressed board files can be indexed: {}".format(file))
+        self.file = file
+        self.index_file = index_file_name(file)
+        self.save_sidecar = save
+        with open(file, "rb") as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                raise ValueError("Board file is empty: {}".format(file))
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.view = memoryview(self.mm)
+        except TypeError:
+            self.view = self.mm  # Python 2 can't make a memoryview of an mmap, so slices are copied.
+
+        # True if the sections were found by scanning the board rather than read from the sidecar.
+        self.built = False
+        if rebuild or not self.load():
+            self.build()
+
+    def load(self):
+        """Read the offsets from the sidecar file. Return False if it's missing or out of date."""
+
+        try:
+            with open(self.index_file, "r") as fp:
+                index = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return False
+        if index.get("version") != index_version or index.get("size") != len(self.mm):
+            return False
+        mtime = file_mtime(self.file)
+        if index.get("mtime") != mtime:
+            # The board was touched, but its contents may be the same.
+            if index.get("sha256") != hashlib.sha256(self.mm).hexdigest():
+                return False
+            index["mtime"] = mtime
+            self.save(index)
+        self.sections = {k: [tuple(s) for s in v] for k, v in index["sections"].items()}
+        self.modules = {k: [tuple(m) for m in v] for k, v in index["modules"].items()}
+        return True
+
+    def build(self):
+        """Scan the board for its sections and store their offsets in the sidecar file."""
+
+        self.sections, self.modules = scan_sections(self.mm)
+        self.built = True
+        self.save(
+            {
+                "version": index_version,
+                "size": len(self.mm),
+                "mtime": file_mtime(self.file),
+                "sha256": hashlib.sha256(self.mm).hexdigest(),
+                "sections": self.sections,
+                "modules": self.modules,
+            }
+        )
+
+    def save(self, index):
+        if not self.save_sidecar:
+            return
+        tmp_file = self.index_file + ".tmp"
+        try:
+            with open(tmp_file, "w") as fp:
+                json.dump(index, fp)
+            getattr(os, "replace", os.rename)(tmp_file, self.index_file)
+        except (IOError, OSError):
+            pass  # The offsets can still be used, they just won't be kept for next time.
+
+    def keys(self):
+        """Return the keys of the top-level sections of the board."""
+
+        return list(self.sections)
+
+    def raw(self, key):
+        """Return zero-copy memoryview slices of the board for the sections with a key."""
+
+        return [self.view[start:end] for start, end in self.sections.get(key, [])]
+
+    def nodes(self, key):
+        """Return the parsed S-expression nodes for the sections with a key."""
+
+        return [parse_sexpr(bytes(v).decode("utf-8")) for v in self.raw(key)]
+
+    def module_refs(self):
+        """Return the references of the parts on the board."""
+
+        return list(self.modules)
+
+    def module_raw(self, ref):
+        """Return a zero-copy memoryview slice of the board for a part. Raises KeyError if missing."""
+
+        start, end = self.modules[ref][0][:2]
+        return self.view[start:end]
+
+    def module_node(self, ref):
+        """Return the parsed S-expression node for a part. Raises KeyError if missing."""
+
+        return parse_sexpr(bytes(self.module_raw(ref)).decode("utf-8"))
+
+    def module_position(self, ref):
+        """Return the (X, Y, angle) of a part in nm and degrees. Raises KeyError if missing."""
+
+        at_start, at_end = self.modules[ref][0][2:]
+        x, y, angle = at_re.match(self.mm, at_start, at_end).groups()
+        return to_nm(x), to_nm(y), float(angle) if angle else 0.0
+
+    def close(self):
+        """Unmap the board. Any slices still in use keep it mapped until they're released."""
+
+        if isinstance(self.view, memoryview):
+            self.view.release()
+        try:
+            self.mm.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""
+Read and write the S-expressions that KiCad board files are made of.
+
+A node is a list whose first item is its key, followed by atoms (strings)
+and child nodes. Quoted strings are kept as Quoted so they're quoted again
+when the node is written.
+"""
+
+import re
+
+class Quoted(str):
+    """String that was quoted in the board file, so it's quoted when it's written."""
+
+
+token_re = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+
+
+def parse_sexpr(text):
+    """Return the nested lists of strings for the S-expression in some text."""
+
+    stack = [[]]
+    pos = 0
+    end = len(text.rstrip())
+    while pos < end:
+        match = token_re.match(text, pos)
+        if match is None:
+            raise IOError("Bad S-expression at character {}.".format(pos))
+        pos = match.end()
+        open_paren, close_paren, quoted, atom = match.groups()
+        if open_paren:
+            stack.append([])
+        elif close_paren:
+            if len(stack) < 2:
+                raise IOError("Unbalanced ')' at character {}.".format(pos))
+            node = stack.pop()
+            stack[-1].append(node)
+        elif quoted is not None:
+            stack[-1].append(Quoted(re.sub(r"\\(.)", r"\1", quoted)))
+        else:
+            stack[-1].append(atom)
+    if len(stack) != 1 or len(stack[0]) != 1:
+        raise IOError("Unbalanced '(' in S-expression.")
+    return stack[0][0]
+
+
+def format_atom(atom):
+    if isinstance(atom, Quoted) or not atom or re.search(r'[\s()"]', atom):
+        return '"{}"'.format(atom.replace("\\", "\\\\").replace('"', '\\"'))
+    return atom
+
+
+def format_sexpr(node, indent=0):
+    """Return the text for an S-expression, with each node holding other nodes on its own lines."""
+
+    atoms = []
+    children = []
+    for item in node:
+        if isinstance(item, list):
+            children.append(item)
+        elif children:
+            # An atom after a child node keeps everything on one line.
+            return "(" + " ".join(format_inline(i) for i in node) + ")"
+        else:
+            atoms.append(format_atom(item))
+    if not children or all(not any(isinstance(i, list) for i in c) for c in children):
+        if len(children) <= 4:
+            return "(" + " ".join(format_inline(i) for i in node) + ")"
+    pad = "  " * (indent + 1)
+    lines = ["(" + " ".join(atoms)]
+    for child in children:
+        lines.append(pad + format_sexpr(child, indent + 1))
+    return "\n".join(lines) + "\n" + "  " * indent + ")"
+
+
+def format_inline(item):
+    if isinstance(item, list):
+        return "(" + " ".join(format_inline(i) for i in item) + ")"
+    return format_atom(item)
+
+
+def find_child(node, key):
+    """Return the first child node of a node that starts with key, or None."""
+
+    for item in node:
+        if isinstance(item, list) and item and item[0] == key:
+            return item
+    return None
+
+
+def find_children(node, key):
+    return [item for item in node if isinstance(item, list) and item and item[0] == key]
+
+
+def set_child(node, key, *values):
+    """Replace the values of the first child node starting with key, adding the child if needed."""
+
+    child = find_child(node, key)
+    if child is None:
+        child = [key]
+        node.append(child)
+    child[1:] = list(values)
+    return child
+
+
+def set_children(node, key, value_lists):
+    """Replace all the child nodes starting with key by a node for each list of values."""
+
+    new_children = [[key] + list(values) for values in value_lists]
+    indices = [i for i, item in enumerate(node) if isinstance(item, list) and item and item[0] == key]
+    index = indices[0] if indices else len(node)
+    for i in reversed(indices):
+        del node[i]
+    node[index:index] = new_children
+
+
+def to_nm(mm):
+    return int(round(float(mm) * 1000000))
+
+
+def to_mm(nm):
+    text = "{:.6f}".format(nm / 1000000.0).rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
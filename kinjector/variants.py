@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""
+Make variants of a KiCad board by injecting different parameter values into it.
+
+The base board is loaded once. Each variant is made in a worker process
+forked from the process holding the base board, so it starts with a
+copy-on-write copy of the board and only has to inject and save.
+"""
+
+import copy
+import itertools
+import multiprocessing
+import os
+
+from .backend import pcbnew
+from .kinjector import Board, merge_dicts, patch_to_dict, refill_zones
+
+# The base board loaded before the worker processes are forked from this process.
+base_brd = None
+
+# Where variant boards are stored if the sweep doesn't say.
+default_output = "{base}_variant{index}.kicad_pcb"
+
+
+def sweep_variants(sweep):
+    """
+    Generate the injection data for every variant in a sweep.
+
+    Args:
+        sweep: Dict with a "parameters" dict that maps JSON Pointers into
+            the board data (e.g., "/board/board setup/design rules/min track width")
+            to lists of values, and an optional "data" dict that is injected
+            into every variant.
+
+    Yields:
+        A dict of the parameter values and the injection dict for each
+        combination of parameter values.
+    """
+
+    parameters = sweep.get("parameters", {})
+    pointers = sorted(parameters)
+    for values in itertools.product(*[parameters[p] for p in pointers]):
+        injection_dict = copy.deepcopy(sweep.get("data", {}))
+        merge_dicts(
+            injection_dict,
+            patch_to_dict(
+                [
+                    {"op": "replace", "path": pointer, "value": value}
+                    for pointer, value in zip(pointers, values)
+                ]
+            ),
+        )
+        yield dict(zip(pointers, values)), injection_dict
+
+
+def make_variant(task):
+    """Inject data into the base board and save it as a variant."""
+
+    base_file, injection_dict, out_file, refill = task
+
+    # Use the base board inherited from the parent process or, if workers
+    # can't be forked, load it.
+    brd = base_brd if base_brd is not None else pcbnew.LoadBoard(base_file)
+
+    Board().inject(injection_dict, brd)
+    if refill:
+        refill_zones(brd)
+    brd.Save(out_file)
+    return out_file
+
+
+def generate_variants(base_file, sweep, jobs=None, refill=True):
+    """
+    Make a variant of a board for each combination of parameter values in a sweep.
+
+    Args:
+        base_file: Path to the base KiCad board file.
+        sweep: Dict describing the variants (see sweep_variants()). An
+            optional "output" template names the variant files using the
+            name of the base board ({base}) and the variant number ({index}).
+        jobs: Number of worker processes. Defaults to the number of CPUs.
+        refill: If true, the affected zones of each variant are refilled.
+
+    Returns:
+        A list with the file name and parameter values of each variant.
+
+    Raises:
+        ValueError: If the data for any variant has errors. No variants
+            are made in that case.
+    """
+
+    global base_brd
+
+    base_name = os.path.splitext(base_file)[0]
+    output = sweep.get("output", default_output)
+
+    variants = []
+    errors = []
+    for index, (params, injection_dict) in enumerate(sweep_variants(sweep)):
+        out_file = output.format(base=base_name, index=index)
+        variants.append((out_file, params, injection_dict))
+        errors.extend(
+            "variant {}: {}".format(index, error)
+            for error in Board().validate(injection_dict)
+        )
+    if errors:
+        raise ValueError("\n".join(errors))
+
+    if hasattr(os, "fork"):
+        # Load the base board once and fork a worker for each variant
+        # so every variant starts from an unchanged copy of the board.
+        base_brd = pcbnew.LoadBoard(base_file)
+        try:
+            context = multiprocessing.get_context("fork")
+        except AttributeError:
+            context = multiprocessing  # Python 2 always forks.
+    else:
+        # Without fork, each worker loads the base board for itself.
+        context = multiprocessing
+
+    tasks = [
+        (base_file, injection_dict, out_file, refill)
+        for out_file, _, injection_dict in variants
+    ]
+    pool = context.Pool(jobs, maxtasksperchild=1)
+    try:
+        pool.map(make_variant, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        base_brd = None
+
+    return [(out_file, params) for out_file, params, _ in variants]
@@ -0,0 +1,7 @@
+"""Configuration for the `kinjector` tests."""
+
+import os
+
+# Run the tests with the pure-Python pcbnew stand-in unless a backend was
+# selected (e.g., KINJECTOR_BACKEND=pcbnew to test with KiCad).
+os.environ.setdefault("KINJECTOR_BACKEND", "fake")
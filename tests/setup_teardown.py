@@ -11,3 +11,7 @@ def setup():
             data_dict = json.load(json_fp)
             with open(filename_stub + "_test_in.yaml", "w") as yaml_fp:
                 yaml.safe_dump(data_dict, yaml_fp, default_flow_style=False)
+
+
+# Newer versions of pytest only call the setup function by this name.
+setup_module = setup
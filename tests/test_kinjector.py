@@ -1,12 +1,13 @@
 """Tests for `kinjector` package."""
 
 import json
+import os
 
-import pcbnew
 import pytest
 import yaml
 
 import kinjector
+from kinjector.backend import pcbnew
 
 from .setup_teardown import *  # This creates YAML test files from the JSON files.
 
@@ -46,3 +47,1024 @@ def test_inject_eject(brd_file, data_file, obj):
         data_dict = obj.eject(brd)
         with open(data_file + "_out" + ext, "w") as data_fp:
             dump(data_dict, data_fp, **dump_kw)
+
+
+def test_validate():
+    """Test that unknown keys and bad values are all reported before injection."""
+
+    with open("brd_test_in.json", "r") as data_fp:
+        data_dict = json.load(data_fp)
+    assert kinjector.Board().validate(data_dict) == []
+
+    data_dict["board"]["plot"]["mirored plot"] = True
+    data_dict["board"]["plot"]["scale"] = "big"
+    data_dict["board"]["modules"]["R1"]["position"]["side"] = "up"
+    errors = kinjector.Board().validate(data_dict)
+    assert len(errors) == 3
+    assert any("mirrored plot" in error for error in errors)
+
+
+def test_module_index():
+    """Test finding parts by reference and by path after they're renamed."""
+
+    brd = pcbnew.LoadBoard("test.kicad_pcb")
+    index = kinjector.ModuleIndex.of(brd)
+    assert index is kinjector.ModuleIndex.of(brd)
+    assert sorted(index.by_ref) == ["D1", "R1", "R2", "R3"]
+
+    data_dict = kinjector.ModulesByPath().eject(brd)
+
+    # Parts without a path aren't indexed by it.
+    index.by_ref["R2"].SetPath("")
+    assert "" not in kinjector.ModuleIndex(brd).by_path
+
+    # Rename a part on a fresh board before its index is built.
+    brd = pcbnew.LoadBoard("test.kicad_pcb")
+    kinjector.ModuleIndex(brd).by_ref["R1"].SetReference("R10")
+    index = kinjector.ModuleIndex.of(brd)
+    assert "R1" not in index.by_ref
+    assert index.by_ref["R10"].GetReference() == "R10"
+    region = {"rect": [0, 0, 10 ** 9, 10 ** 9]}
+    refs = [ref for ref, _ in kinjector.ModuleGrid.of(brd).query(region)]
+    assert "R10" in refs and "R1" not in refs
+
+    # Data indexed by path is still injected after the reference changes.
+    for data_module in data_dict["modules by path"].values():
+        data_module["position"]["x"] += 1000000
+    kinjector.ModulesByPath().inject(data_dict, brd)
+    assert (
+        index.by_ref["R10"].GetPosition().x
+        == data_dict["modules by path"][index.get_path(index.by_ref["R10"])][
+            "position"
+        ]["x"]
+    )
+
+
+def test_diff():
+    """Test ejecting only the board data that changed from a baseline."""
+
+    brd = pcbnew.LoadBoard("test.kicad_pcb")
+    baseline_dict = kinjector.Board().eject(brd)
+    assert list(kinjector.Board().diff(brd, baseline_dict)) == []
+
+    with open("brd_test_in.json", "r") as data_fp:
+        data_dict = json.load(data_fp)
+    kinjector.Board().inject(data_dict, brd)
+    patch = list(kinjector.Board().diff(brd, baseline_dict))
+    assert patch
+    assert all(op["op"] == "replace" for op in patch)
+
+    # Injecting the patch into the original board gives the same result.
+    patched_brd = pcbnew.LoadBoard("test.kicad_pcb")
+    kinjector.Board().inject(kinjector.patch_to_dict(patch), patched_brd)
+    assert kinjector.Board().eject(patched_brd) == kinjector.Board().eject(brd)
+
+
+def test_diff_inputs():
+    """Test diffing the combined data from several input files against a baseline."""
+
+    import os
+    import subprocess
+    import sys
+
+    baseline_dict = {}
+    for file in ("ncd_test_in.json", "nca_test_in.json"):
+        with open(file, "r") as data_fp:
+            kinjector.merge_dicts(baseline_dict, json.load(data_fp))
+    baseline_dict["definitions"]["Default"]["clearance"] = 100000
+    with open("brd_test_out.json", "w") as data_fp:
+        json.dump(baseline_dict, data_fp)
+
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=repo_dir)
+    cmd = [sys.executable, "-m", "kinjector.cli", "--format", "json"]
+    cmd += ["-f", "ncd_test_in.json", "nca_test_in.json", "-t", "-"]
+    patch = json.loads(
+        subprocess.check_output(cmd + ["--baseline", "brd_test_out.json"], env=env)
+    )
+    assert patch == [
+        {"op": "replace", "path": "/definitions/Default/clearance", "value": 600000}
+    ]
+
+
+def test_compact_eject():
+    """Test ejecting part data as compact records."""
+
+    brd = pcbnew.LoadBoard("test.kicad_pcb")
+    data_dict = kinjector.Board().eject(brd)
+    compact_dict = kinjector.Board(compact=True).eject(brd)
+    assert isinstance(compact_dict["board"]["modules"]["R1"], kinjector.ModuleRecord)
+    assert compact_dict == data_dict
+    assert kinjector.plain_data(compact_dict) == data_dict
+
+    # Compact records can be merged and injected just like dicts.
+    kinjector.merge_dicts(
+        compact_dict, {"board": {"modules": {"R1": {"position": {"x": 1000000}}}}}
+    )
+    assert compact_dict["board"]["modules"]["R1"]["position"]["y"] == (
+        data_dict["board"]["modules"]["R1"]["position"]["y"]
+    )
+    kinjector.Board().inject(compact_dict, brd)
+    assert brd.FindModuleByReference("R1").GetPosition().x == 1000000
+
+
+def test_fields():
+    """Test ejecting only selected fields from a board."""
+
+    brd = pcbnew.LoadBoard("test.kicad_pcb")
+    data_dict = kinjector.Board(fields=["modules.*.value"]).eject(brd)
+    assert list(data_dict["board"]) == ["modules"]
+    r1_data = data_dict["board"]["modules"]["R1"]
+    assert r1_data == {"value": str(brd.FindModuleByReference("R1").GetValue())}
+
+    data_dict = kinjector.Board(
+        fields=["modules.R*.position.x", "plot.layers"]
+    ).eject(brd)
+    assert sorted(data_dict["board"]) == ["modules", "plot"]
+    assert list(data_dict["board"]["plot"]) == ["layers"]
+    assert "D1" not in data_dict["board"]["modules"]
+    assert data_dict["board"]["modules"]["R1"] == {
+        "position": {"x": brd.FindModuleByReference("R1").GetPosition().x}
+    }
+
+    # Values and lock states can be injected back.
+    kinjector.Board().inject(
+        {"board": {"modules": {"R1": {"value": "4K7", "locked": True}}}}, brd
+    )
+    data_dict = kinjector.Board(
+        fields=["modules.R1.value", "modules.R1.locked"]
+    ).eject(brd)
+    assert data_dict["board"]["modules"]["R1"] == {"value": "4K7", "locked": True}
+
+
+def test_regions():
+    """Test finding parts in regions of a board."""
+
+    brd = pcbnew.LoadBoard("test.kicad_pcb")
+    r1 = brd.FindModuleByReference("R1")
+    x, y = r1.GetPosition().x, r1.GetPosition().y
+    region = {"rect": [x - 1000, y - 1000, x + 1000, y + 1000]}
+
+    grid = kinjector.ModuleGrid.of(brd)
+    assert [ref for ref, _ in grid.query(region)] == ["R1"]
+    assert kinjector.ModuleGrid.of(brd) is grid
+
+    data_dict = kinjector.Board(region=region).eject(brd)
+    assert list(data_dict["board"]["modules"]) == ["R1"]
+
+    # Move everything in the region and check that the index follows.
+    data_dict = {
+        "board": {"module regions": [dict(region, offset={"x": 5000000, "y": 0})]}
+    }
+    assert kinjector.Board().validate(data_dict) == []
+    kinjector.Board().inject(data_dict, brd)
+    assert r1.GetPosition().x == x + 5000000
+    assert grid.query(region) == []
+    moved_region = {
+        "polygon": [
+            [x + 4900000, y],
+            [x + 5100000, y - 100000],
+            [x + 5100000, y + 100000],
+        ]
+    }
+    assert [ref for ref, _ in grid.query(moved_region)] == ["R1"]
+
+    errors = kinjector.Board().validate(
+        {"board": {"module regions": [{"rect": [0, 0], "side": "up"}]}}
+    )
+    assert len(errors) == 2
+
+
+def test_overlaps():
+    """Test finding parts that overlap after they're moved."""
+
+    brd = pcbnew.LoadBoard("test.kicad_pcb")
+    pos = brd.FindModuleByReference("R1").GetPosition()
+    kinjector.Board().inject(
+        {
+            "board": {
+                "modules": {
+                    "R1": {"position": {"side": "top"}},
+                    "R2": {"position": {"x": pos.x, "y": pos.y, "side": "top"}},
+                }
+            }
+        },
+        brd,
+    )
+    assert kinjector.moved_modules(brd) == ["R1", "R2"]
+    overlaps = kinjector.find_overlaps(brd, kinjector.moved_modules(brd))
+    assert ("R1", "R2") in overlaps
+    assert ("R1", "R2") in kinjector.find_overlaps(brd, use_courtyards=False)
+
+
+def test_overlaps_error(tmpdir):
+    """Test that a board with overlaps isn't saved but the other targets are."""
+
+    import shutil
+    import subprocess
+    import sys
+
+    brd_file = str(tmpdir.join("overlap.kicad_pcb"))
+    shutil.copy("test.kicad_pcb", brd_file)
+    pos = pcbnew.LoadBoard(brd_file).FindModuleByReference("R1").GetPosition()
+    data_file = str(tmpdir.join("overlap.json"))
+    with open(data_file, "w") as data_fp:
+        json.dump(
+            {"board": {"modules": {"R2": {"position": {"x": pos.x, "y": pos.y}}}}},
+            data_fp,
+        )
+
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=repo_dir)
+    out_file = str(tmpdir.join("out.json"))
+    cmd = [sys.executable, "-m", "kinjector.cli", "-f", data_file, "-t", brd_file]
+    cmd += [out_file, "--overlaps", "error", "--nobackup", "--overwrite"]
+    with open(os.devnull, "w") as null:
+        assert subprocess.call(cmd, env=env, stdout=null) == 1
+    with open("test.kicad_pcb", "r") as fp1, open(brd_file, "r") as fp2:
+        assert fp1.read() == fp2.read()
+    with open(out_file, "r") as fp:
+        assert json.load(fp)["board"]["modules"]["R2"]["position"]["x"] == pos.x
+
+
+def test_tracks():
+    """Test ejecting the optional tracks section as columns of data."""
+
+    brd = pcbnew.LoadBoard("test.kicad_pcb")
+    assert "tracks" not in kinjector.Board().eject(brd)["board"]
+
+    data_dict = kinjector.Board(include=["tracks"]).eject(brd)
+    data_tracks = data_dict["board"]["tracks"]
+    assert tuple(data_tracks["segments"]) == kinjector.Tracks.segment_columns
+    assert tuple(data_tracks["vias"]) == kinjector.Tracks.via_columns
+    assert kinjector.Board().validate(data_dict) == []
+    kinjector.Board().inject(data_dict, brd)
+
+    data_tracks["segments"]["width"].append(250000)
+    assert len(kinjector.Board().validate(data_dict)) == 1
+
+
+def test_zones(tmpdir):
+    """Test injecting zone settings and refilling only the affected zones."""
+
+    brd_file = str(tmpdir.join("zones.kicad_pcb"))
+    make_zone_board(brd_file)
+    brd = pcbnew.LoadBoard(brd_file)
+    data_dict = kinjector.Board(include=["zones"]).eject(brd)
+    assert len(data_dict["board"]["zones"]) == 1
+    kinjector.Board().inject({"board": {"zones": data_dict["board"]["zones"]}}, brd)
+    assert kinjector.refill_zones(brd) == 0
+    if hasattr(brd, "filled_zones"):
+        assert brd.filled_zones == []  # Only the pcbnew stand-in records fills.
+
+    # Changing a net class makes every zone stale, and they're filled in one batch.
+    with open("brd_test_in.json", "r") as data_fp:
+        data_dict = json.load(data_fp)
+    kinjector.Board().inject(data_dict, brd)
+    assert kinjector.refill_zones(brd) == 1
+    if hasattr(brd, "filled_zones"):
+        assert brd.filled_zones == [list(brd.Zones())]
+
+
+def make_zone_board(file):
+    """Make a copy of the test board with a copper zone on it."""
+
+    zone = """
+  (zone (net 1) (net_name "Net-(D1-Pad2)") (layer F.Cu) (tstamp 5CD0A000) (hatch edge 0.508)
+    (connect_pads (clearance 0.508))
+    (min_thickness 0.254)
+    (fill yes (arc_segments 32) (thermal_gap 0.508) (thermal_bridge_width 0.508))
+    (polygon
+      (pts
+        (xy 155 95) (xy 172 95) (xy 172 106) (xy 155 106)
+      )
+    )
+  )
+"""
+    with open("test.kicad_pcb", "r") as brd_fp:
+        text = brd_fp.read().rstrip()
+    with open(file, "w") as brd_fp:
+        brd_fp.write(text[:-1] + zone + ")\n")
+
+
+def test_design_rules_refill(tmpdir):
+    """Test that injecting design rules or mask/paste settings refills the zones."""
+
+    brd_file = str(tmpdir.join("zones.kicad_pcb"))
+    make_zone_board(brd_file)
+    brd = pcbnew.LoadBoard(brd_file)
+    assert len(brd.Zones()) == 1
+
+    with open("dr_test_in.json", "r") as data_fp:
+        data_dict = {"board": {"board setup": json.load(data_fp)}}
+    kinjector.Board().inject(data_dict, brd)
+    assert kinjector.refill_zones(brd) == 1
+    assert kinjector.refill_zones(brd) == 0
+
+    mask_dict = {
+        "board": {
+            "board setup": {"solder mask/paste": {"solder mask min width": 100000}}
+        }
+    }
+    kinjector.Board().inject(mask_dict, brd)
+    assert kinjector.refill_zones(brd) == 1
+
+
+def test_variants():
+    """Test making variants of a board from a sweep of parameter values."""
+
+    from kinjector.variants import generate_variants
+
+    pointer = "/board/board setup/design rules/min track width"
+    sweep = {
+        "output": "{base}_variant{index}_out.kicad_pcb",
+        "parameters": {pointer: [150000, 200000, 250000]},
+    }
+    variants = generate_variants("test.kicad_pcb", sweep, jobs=2)
+    assert len(variants) == 3
+    for out_file, params in variants:
+        brd = pcbnew.LoadBoard(out_file)
+        data_dict = kinjector.DesignRules().eject(brd)
+        assert data_dict["design rules"]["min track width"] == params[pointer]
+
+
+def test_compressed_files():
+    """Test reading and writing compressed data and board files."""
+
+    from kinjector.fileio import copy_file, local_board, open_file
+
+    brd = pcbnew.LoadBoard("test.kicad_pcb")
+    data_dict = kinjector.Board().eject(brd)
+    with open_file("brd_test_out.json.gz", "w") as fp:
+        json.dump(data_dict, fp)
+    with open_file("brd_test_out.json.gz", "r") as fp:
+        assert json.load(fp) == data_dict
+
+    # Compressed boards are loaded and saved through an uncompressed copy.
+    copy_file("test.kicad_pcb", "test_out.kicad_pcb.gz")
+    with local_board("test_out.kicad_pcb.gz", save=True) as brd_file:
+        brd = pcbnew.LoadBoard(brd_file)
+        kinjector.Board().inject(
+            {"board": {"modules": {"R1": {"position": {"x": 1000000}}}}}, brd
+        )
+        brd.Save(brd_file)
+    with local_board("test_out.kicad_pcb.gz") as brd_file:
+        brd = pcbnew.LoadBoard(brd_file)
+        assert brd.FindModuleByReference("R1").GetPosition().x == 1000000
+
+
+def test_stdio(monkeypatch):
+    """Test piping data through the standard input and output."""
+
+    import io
+    import subprocess
+    import sys
+
+    from kinjector import fileio
+
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=repo_dir)
+    cmd = [sys.executable, "-m", "kinjector.cli"]
+    ejected = subprocess.check_output(
+        cmd + ["-f", "test.kicad_pcb", "-t", "-", "--format", "json"], env=env
+    )
+    data_dict = json.loads(ejected.decode("utf-8"))
+    assert data_dict == kinjector.Board().eject(pcbnew.LoadBoard("test.kicad_pcb"))
+
+    # Boards can also come from the standard input.
+    with open("test.kicad_pcb", "rb") as brd_fp:
+        ejected = subprocess.check_output(
+            cmd + ["-f", "-", "-t", "-", "--format", "yaml"], stdin=brd_fp, env=env
+        )
+    assert yaml.safe_load(ejected) == data_dict
+
+    # Closing a reader for the standard input leaves it open for the next one.
+    stdin_buffer = io.BufferedReader(io.BytesIO(b"a: 1\n"))
+    monkeypatch.setattr(fileio, "stdin_buffer", stdin_buffer)
+    with fileio.open_file("-", "r") as fp:
+        assert fp.readline() == "a: 1\n"
+    assert not stdin_buffer.closed
+    with fileio.open_file("-", "r") as fp:
+        assert fp.read() == ""
+
+    # The standard input can't be given twice since it can only be read once.
+    with open("test.kicad_pcb", "rb") as brd_fp, open(os.devnull, "w") as null:
+        assert (
+            subprocess.call(
+                cmd + ["-f", "-", "-", "-t", "-", "--format", "json"],
+                stdin=brd_fp,
+                stdout=null,
+                stderr=null,
+                env=env,
+            )
+            == 1
+        )
+
+
+def test_file_locks():
+    """Test that a locked file can't be locked again until it's released."""
+
+    from kinjector.fileio import FileLocks, fcntl
+
+    if fcntl is None:
+        pytest.skip("No advisory file locks on this platform.")
+
+    with FileLocks(["brd_test_out.json", "test_out.kicad_pcb"]):
+        locks = FileLocks(["test_out.kicad_pcb"])
+        with pytest.raises(IOError):
+            locks.acquire(timeout=0.2)
+        assert locks.wait_time >= 0.2
+        assert os.path.exists("test_out.kicad_pcb.lock")
+    locks.acquire(timeout=0.2)
+    locks.release()
+
+    # The lock files are removed along with the locks.
+    assert not os.path.exists("test_out.kicad_pcb.lock")
+    assert not os.path.exists("brd_test_out.json.lock")
+
+
+def test_inject_rollback(tmpdir, monkeypatch):
+    """Test that a failed injection leaves the board unchanged."""
+
+    brd_file = str(tmpdir.join("zones.kicad_pcb"))
+    make_zone_board(brd_file)
+    brd = pcbnew.LoadBoard(brd_file)
+    before = kinjector.Board().eject(brd)
+
+    # The tracks section fails after the other sections have been injected.
+    data_dict = {
+        "board": {
+            "board setup": {
+                "net classes": {
+                    "definitions": {"rollback_class": {"clearance": 100000}},
+                    "assignments": {"Net-(R1-Pad2)": "rollback_class"},
+                }
+            },
+            "plot": {"scale": 3.5},
+            "modules": {"R1": {"position": {"x": 1000000}, "value": "new"}},
+            "tracks": {"segments": {"width": [1]}},
+        }
+    }
+    with pytest.raises(ValueError):
+        kinjector.Board().inject(data_dict, brd)
+
+    after = kinjector.Board().eject(brd)
+    assert after == before
+    assert "rollback_class" not in after["board"]["board setup"]["net classes"]["definitions"]
+
+    # The undone changes don't leave parts to check or zones to refill.
+    assert kinjector.moved_modules(brd) == []
+    assert kinjector.refill_zones(brd) == 0
+
+    # A section that can't be restored doesn't hide the error or stop the others.
+    def bad_restore(self, snapshot, brd):
+        raise RuntimeError("Can't restore.")
+
+    monkeypatch.setattr(kinjector.Plot, "restore", bad_restore)
+    with pytest.raises(ValueError):
+        kinjector.Board().inject(data_dict, brd)
+    after = kinjector.Board().eject(brd)
+    assert after["board"]["modules"] == before["board"]["modules"]
+    assert after["board"]["board setup"] == before["board"]["board setup"]
+
+
+def test_journal():
+    """Test that the journal finds files that are already up to date."""
+
+    import os
+
+    from kinjector.fileio import data_hash
+    from kinjector.journal import Journal
+
+    if os.path.isfile("test_journal_out.jsonl"):
+        os.remove("test_journal_out.jsonl")
+
+    input_hash = data_hash({"board": {"plot": {"scale": 2.0}}})
+    with open("brd_test_out.json", "w") as fp:
+        json.dump({"board": {"plot": {"scale": 2.0}}}, fp)
+    journal = Journal("test_journal_out.jsonl")
+    assert not journal.is_done("brd_test_out.json", input_hash)
+    journal.record("brd_test_out.json", input_hash, "started")
+    assert not journal.is_done("brd_test_out.json", input_hash)
+    journal.record("brd_test_out.json", input_hash, "done")
+
+    # The journal is read back by a later run.
+    journal = Journal("test_journal_out.jsonl")
+    assert journal.is_done("brd_test_out.json", input_hash)
+    assert not journal.is_done("brd_test_out.json", data_hash({}))
+
+    # Changing the file means it has to be updated again.
+    with open("brd_test_out.json", "w") as fp:
+        json.dump({}, fp)
+    assert not journal.is_done("brd_test_out.json", input_hash)
+
+
+def test_database():
+    """Test storing board data in an SQLite database."""
+
+    import os
+    import sqlite3
+
+    from kinjector.database import export_boards
+
+    if os.path.isfile("boards_out.sqlite"):
+        os.remove("boards_out.sqlite")
+
+    brd = pcbnew.LoadBoard("test.kicad_pcb")
+    data_dict = kinjector.Board().eject(brd)
+    assert export_boards("boards_out.sqlite", [("test", data_dict)]) == (1, 0)
+
+    # Exporting the same board again doesn't add anything.
+    assert export_boards("boards_out.sqlite", [("test2", data_dict)]) == (0, 1)
+
+    conn = sqlite3.connect("boards_out.sqlite")
+    r1_pos = data_dict["board"]["modules"]["R1"]["position"]
+    assert conn.execute(
+        "SELECT b.name, m.x, m.y FROM modules m JOIN boards b ON b.id = m.board_id WHERE m.ref = 'R1'"
+    ).fetchall() == [("test2", r1_pos["x"], r1_pos["y"])]
+    num_classes = len(data_dict["board"]["board setup"]["net classes"]["definitions"])
+    assert conn.execute("SELECT COUNT(*) FROM net_classes").fetchone()[0] == num_classes
+    conn.close()
+
+    # Only boards are stored, not the data files given with them, and the
+    # database isn't backed up.
+    import subprocess
+    import sys
+
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=repo_dir)
+    cmd = [sys.executable, "-m", "kinjector.cli", "-f", "test.kicad_pcb"]
+    cmd += ["dr_test_in.json", "-t", "boards_out.sqlite"]
+    with open(os.devnull, "w") as null:
+        subprocess.check_call(cmd, env=env, stdout=null)
+    conn = sqlite3.connect("boards_out.sqlite")
+    names = conn.execute("SELECT name FROM boards").fetchall()
+    conn.close()
+    assert names == [("test.kicad_pcb",)]
+    assert not os.path.isfile("boards_out.sqlite.1.bak")
+
+
+def test_centroids():
+    """Test streaming part positions to/from centroid CSV files."""
+
+    import io
+
+    from kinjector.centroid import (
+        board_centroids,
+        inject_centroids,
+        read_centroids,
+        write_centroids,
+    )
+    from kinjector.cli import positions_dict
+
+    csv_text = u"Designator,Mid X,Mid Y,Rotation,Layer\nR1,1000,2000,90,Bottom\n"
+    columns = {
+        "ref": "Designator",
+        "x": "Mid X",
+        "y": "Mid Y",
+        "rotation": "Rotation",
+        "side": "Layer",
+    }
+    parts = list(
+        read_centroids(io.StringIO(csv_text), columns, units="mil", origin=(100, 200))
+    )
+    assert parts == [
+        (
+            "R1",
+            {
+                "position": {
+                    "x": 100 + 1000 * 25400,
+                    "y": 200 + 2000 * 25400,
+                    "angle": 90.0,
+                    "side": "bottom",
+                }
+            },
+        )
+    ]
+
+    # Rows with bad values are reported with their line numbers.
+    with pytest.raises(ValueError, match="Line 2"):
+        list(read_centroids(io.StringIO(u"Ref,PosX\nR1,abc\n")))
+
+    # Move a part and write the positions back out.
+    brd = pcbnew.LoadBoard("test.kicad_pcb")
+    assert inject_centroids(io.StringIO(u"Ref,PosX,PosY\nR1,12.5,25\n"), brd) == 1
+    r1_pos = kinjector.Board().eject(brd)["board"]["modules"]["R1"]["position"]
+    assert (r1_pos["x"], r1_pos["y"]) == (12500000, 25000000)
+
+    fp = io.StringIO()
+    write_centroids(fp, [("R1", r1_pos)])
+    assert fp.getvalue().splitlines()[1].startswith("R1,12.5,25,")
+
+    # The positions of a board's parts are the same as the ejected ones.
+    modules = kinjector.Board().eject(brd)["board"]["modules"]
+    parts = list(board_centroids(brd))
+    assert [ref for ref, _ in parts] == sorted(modules)
+    assert positions_dict(parts)["board"]["modules"] == {
+        ref: {"position": modules[ref]["position"]} for ref in modules
+    }
+
+
+def test_changed(tmpdir):
+    """Test finding the output files affected by changes in a git repository."""
+
+    import os
+    import subprocess
+
+    from kinjector.changes import affected_targets, changed_files
+
+    def git(*args):
+        subprocess.check_call(("git",) + args, cwd=str(tmpdir))
+
+    git("init", "-q")
+    for name in ("rules.yaml", "a.kicad_pcb", "b.kicad_pcb"):
+        tmpdir.join(name).write("0")
+    git("add", ".")
+    git("-c", "user.name=test", "-c", "user.email=test", "commit", "-q", "-m", "1")
+
+    rules, a, b = [
+        str(tmpdir.join(name)) for name in ("rules.yaml", "a.kicad_pcb", "b.kicad_pcb")
+    ]
+    tmpdir.join("b.kicad_pcb").write("1")
+    changed = changed_files("HEAD", str(tmpdir))
+    assert changed == set([os.path.realpath(b)])
+    assert affected_targets([a, b], [rules], changed) == [b]
+
+    # A changed input affects all the outputs.
+    tmpdir.join("rules.yaml").write("1")
+    changed = changed_files("HEAD", str(tmpdir))
+    assert affected_targets([a, b], [rules], changed) == [a, b]
+
+    # Nothing is loaded if no input, fragment or output changed. (The input
+    # board isn't a board at all, so loading it would fail.)
+    import sys
+
+    tmpdir.join("main.yaml").write("board: !include frag.yaml#/board\n")
+    tmpdir.join("frag.yaml").write("board: {plot: {}}\n")
+    git("add", ".")
+    git("-c", "user.name=test", "-c", "user.email=test", "commit", "-q", "-m", "2")
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=repo_dir)
+    out_file = tmpdir.join("out.json")
+    cmd = [sys.executable, "-m", "kinjector.cli", "--changed", "HEAD", "-f"]
+    cmd += ["main.yaml", "a.kicad_pcb", "-t", str(out_file)]
+    subprocess.check_call(cmd, cwd=str(tmpdir), env=env)
+    assert not out_file.check()
+
+    # A changed fragment affects all the outputs, too.
+    tmpdir.join("frag.yaml").write("board: {plot: {output directory: gerbers}}\n")
+    cmd = [sys.executable, "-m", "kinjector.cli", "--changed", "HEAD"]
+    cmd += ["-f", "main.yaml", "-t", str(out_file)]
+    subprocess.check_call(cmd, cwd=str(tmpdir), env=env)
+    assert json.loads(out_file.read()) == {
+        "board": {"plot": {"output directory": "gerbers"}}
+    }
+
+
+def test_fragments(tmpdir):
+    """Test resolving references to shared fragments in data files."""
+
+    from kinjector.fileio import read_data
+    from kinjector.fragments import fragment_cache, resolve_file_refs
+
+    rules = {"design rules": {"min via size": 400000}}
+    tmpdir.join("rules.json").write(json.dumps({"board setup": rules}))
+    tmpdir.join("cycle.yaml").write("a: !include main.yaml\n")
+    main = tmpdir.join("main.yaml")
+    main.write(
+        "board:\n"
+        "  board setup: !include rules.json#/board setup\n"
+        "  plot: {$ref: rules.json, plot: {}}\n"
+    )
+
+    with open(str(main), "r") as fp:
+        data = resolve_file_refs(read_data(fp), str(main))
+    assert data["board"]["board setup"] == rules
+    assert data["board"]["plot"] == {"board setup": rules, "plot": {}}
+
+    # The fragment is parsed once and the cached data isn't changed by its users.
+    assert len(fragment_cache) == 1
+    data["board"]["board setup"]["design rules"]["min via size"] = 0
+    with open(str(main), "r") as fp:
+        data = resolve_file_refs(read_data(fp), str(main))
+    assert data["board"]["board setup"] == rules
+
+    main.write("board: !include cycle.yaml\n")
+    with open(str(main), "r") as fp:
+        with pytest.raises(ValueError, match="Circular reference"):
+            resolve_file_refs(read_data(fp), str(main))
+
+
+def test_aio(monkeypatch):
+    """Test the asyncio API for loading, ejecting and injecting boards."""
+
+    import shutil
+    import sys
+
+    if sys.version_info < (3, 7):
+        pytest.skip("The asyncio API needs Python 3.7.")
+
+    import asyncio
+
+    from kinjector import aio
+
+    # The boards loaded from files are released when they're done with.
+    released = []
+
+    def release_board(brd):
+        released.append(brd.GetFileName())
+        kinjector.release_board(brd)
+
+    monkeypatch.setattr(aio, "release_board", release_board)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        data_dict, ejected = loop.run_until_complete(
+            asyncio.gather(
+                aio.load_data("dr_test_in.yaml"), aio.eject("test.kicad_pcb")
+            )
+        )
+        assert ejected == kinjector.Board().eject(pcbnew.LoadBoard("test.kicad_pcb"))
+
+        # Tasks working on the same board take turns.
+        shutil.copy("test.kicad_pcb", "test_out.kicad_pcb")
+        move = {"board": {"modules": {"R1": {"position": {"x": 1000000}}}}}
+        loop.run_until_complete(
+            asyncio.gather(
+                aio.inject_and_save(move, "test_out.kicad_pcb"),
+                aio.inject_and_save(
+                    {"board": {"board setup": data_dict}}, "test_out.kicad_pcb"
+                ),
+            )
+        )
+        brd = pcbnew.LoadBoard("test_out.kicad_pcb")
+        assert brd.FindModuleByReference("R1").GetPosition().x == 1000000
+        rules = kinjector.DesignRules().eject(brd)["design rules"]
+        assert rules["min track width"] == data_dict["design rules"]["min track width"]
+        assert len(released) == 3
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    # The same executor works in another event loop.
+    loop = asyncio.new_event_loop()
+    try:
+        ejected = loop.run_until_complete(aio.eject("test_out.kicad_pcb"))
+        assert ejected["board"]["modules"]["R1"]["position"]["x"] == 1000000
+    finally:
+        loop.close()
+
+
+def test_fake_backend():
+    """Test that boards saved by the pcbnew stand-in load back with the same data."""
+
+    from kinjector import fake_pcbnew
+
+    brd = fake_pcbnew.LoadBoard("test.kicad_pcb")
+    with open("brd_test_in.json", "r") as data_fp:
+        kinjector.Board().inject(json.load(data_fp), brd)
+    brd.Save("test_out.kicad_pcb")
+    saved_brd = fake_pcbnew.LoadBoard("test_out.kicad_pcb")
+    assert kinjector.Board().eject(saved_brd) == kinjector.Board().eject(brd)
+
+    # Check the stand-in against KiCad when it's installed.
+    import os
+    import subprocess
+    import sys
+
+    env = dict(os.environ, KINJECTOR_BACKEND="pcbnew")
+    check = [sys.executable, "-c", "import kinjector.backend"]
+    with open(os.devnull, "w") as null:
+        missing = subprocess.call(check, env=env, stdout=null, stderr=null)
+    if missing:
+        pytest.skip("KiCad's pcbnew module isn't installed.")
+    cmd = [sys.executable, "-m", "kinjector.cli", "--format", "json"]
+    for file in ("test.kicad_pcb", "test_out.kicad_pcb"):
+        ejected = subprocess.check_output(cmd + ["-f", file, "-t", "-"], env=env)
+        fake_ejected = kinjector.Board().eject(fake_pcbnew.LoadBoard(file))
+        assert json.loads(ejected.decode("utf-8")) == json.loads(
+            json.dumps(fake_ejected)
+        )
+
+
+def test_section_index(tmpdir):
+    """Test finding the sections of a board through its offset index."""
+
+    import os
+    import shutil
+
+    from kinjector.sections import SectionIndex, index_file_name
+
+    brd_file = str(tmpdir.join("test.kicad_pcb"))
+    shutil.copy("test.kicad_pcb", brd_file)
+    brd = pcbnew.LoadBoard(brd_file)
+
+    with SectionIndex(brd_file) as index:
+        assert index.built
+        assert os.path.isfile(index_file_name(brd_file))
+        assert bytes(index.raw("setup")[0]).startswith(b"(setup")
+        assert [n[1] for n in index.nodes("net_class")] == ["Default", "new_new_class"]
+        assert sorted(index.module_refs()) == sorted(
+            m.GetReference() for m in brd.GetModules()
+        )
+        for ref in index.module_refs():
+            module = brd.FindModuleByReference(ref)
+            pos = module.GetPosition()
+            assert index.module_position(ref) == (
+                pos.x,
+                pos.y,
+                module.GetOrientationDegrees(),
+            )
+
+    # The sidecar is used until the board changes.
+    with SectionIndex(brd_file) as index:
+        assert not index.built
+    os.utime(brd_file, (0, 0))
+    with SectionIndex(brd_file) as index:
+        assert not index.built
+    with open(brd_file, "a") as brd_fp:
+        brd_fp.write("\n")
+    with SectionIndex(brd_file) as index:
+        assert index.built
+
+
+class StubPlotter(object):
+    """Stand-in for PLOT_CONTROLLER that writes a small file for each layer."""
+
+    # Layer name that can't be plotted.
+    bad_layer = None
+
+    def __init__(self, brd):
+        self.brd = brd
+
+    def GetPlotOptions(self):
+        return self
+
+    def SetOutputDirectory(self, out_dir):
+        self.out_dir = out_dir
+
+    def SetLayer(self, layer):
+        self.layer = layer
+
+    def OpenPlotfile(self, suffix, format, sheet_desc):
+        if sheet_desc == self.bad_layer:
+            raise RuntimeError("Can't plot {}.".format(sheet_desc))
+        self.file = os.path.join(self.out_dir, "test-{}.gbr".format(suffix))
+
+    def PlotLayer(self):
+        with open(self.file, "w") as fp:
+            fp.write("{}\n".format(self.layer))
+
+    def GetPlotFileName(self):
+        return self.file
+
+    def ClosePlot(self):
+        pass
+
+
+class StubDrillWriter(object):
+    """Stand-in for EXCELLON_WRITER that writes an empty plated drill file."""
+
+    def __init__(self, brd):
+        self.brd = brd
+
+    def SetOptions(self, *args):
+        pass
+
+    def SetFormat(self, *args):
+        pass
+
+    def CreateDrillandMapFilesSet(self, out_dir, gen_drill, gen_map):
+        brd_name = os.path.splitext(os.path.basename(self.brd.GetFileName()))[0]
+        open(os.path.join(out_dir, brd_name + "-PTH.drl"), "w").close()
+
+
+def test_plot_fab_files(tmpdir, monkeypatch):
+    """Test dividing the plotting of the fabrication files among worker processes."""
+
+    import multiprocessing
+
+    from kinjector import fab
+
+    if multiprocessing.get_start_method() != "fork":
+        pytest.skip("The stub plotters only reach worker processes that are forked.")
+
+    monkeypatch.setattr(fab.pcbnew, "PLOT_CONTROLLER", StubPlotter, raising=False)
+    monkeypatch.setattr(fab.pcbnew, "EXCELLON_WRITER", StubDrillWriter, raising=False)
+    monkeypatch.setattr(fab.pcbnew, "PLOT_FORMAT_GERBER", 1, raising=False)
+
+    brd = pcbnew.LoadBoard("test.kicad_pcb")
+    layers = [pcbnew.F_Cu, pcbnew.B_Cu, brd.GetLayerID("Edge.Cuts")]
+    out_dir = str(tmpdir.join("gerbers"))
+    manifest = fab.plot_fab_files("test.kicad_pcb", layers, out_dir, jobs=2)
+    assert manifest["board"] == os.path.abspath("test.kicad_pcb")
+    assert [(o["file"], o["layer"]) for o in manifest["outputs"]] == [
+        ("test-B_Cu.gbr", "B.Cu"),
+        ("test-Edge_Cuts.gbr", "Edge.Cuts"),
+        ("test-F_Cu.gbr", "F.Cu"),
+        ("test-PTH.drl", "drill"),
+    ]
+    for output in manifest["outputs"]:
+        file = os.path.join(out_dir, output["file"])
+        assert output["sha256"] == fab.file_checksum(file)
+    with open(os.path.join(out_dir, "test-manifest.json"), "r") as fp:
+        assert json.load(fp) == manifest
+
+    # An error in a worker is raised in the calling process.
+    monkeypatch.setattr(StubPlotter, "bad_layer", "B.Cu")
+    with pytest.raises(RuntimeError, match="Can't plot B.Cu"):
+        fab.plot_fab_files("test.kicad_pcb", layers, out_dir, jobs=2)
+
+
+def test_audit(tmpdir):
+    """Test auditing boards against reference data."""
+
+    import shutil
+
+    from kinjector.audit import audit_boards, audit_report, indexed_positions
+
+    with open("dr_test_in.json", "r") as data_fp:
+        reference = {"board": {"board setup": json.load(data_fp)}}
+    reference["board"]["plot"] = {"output directory": "gerbers"}
+    matching_file = str(tmpdir.join("matching.kicad_pcb"))
+    shutil.copy("test.kicad_pcb", matching_file)
+    brd = pcbnew.LoadBoard(matching_file)
+    kinjector.Board().inject(reference, brd)
+    brd.Save(matching_file)
+
+    missing_file = str(tmpdir.join("missing.kicad_pcb"))
+    results = audit_boards(
+        reference, ["test.kicad_pcb", matching_file, missing_file], jobs=2
+    )
+    assert [r[0] for r in results] == ["test.kicad_pcb", matching_file, missing_file]
+
+    deviations = results[0][1]
+    pointers = [pointer for pointer, _, _ in deviations]
+    assert "/board/plot/output directory" in pointers
+    assert "/board/board setup/design rules/min track width" in pointers
+    for pointer, expected, actual in deviations:
+        assert expected != actual
+    assert results[1][1:] == ([], None)
+    assert results[2][2] is not None
+
+    report = audit_report(results)
+    assert report[0] == "test.kicad_pcb: {} deviation(s)".format(len(deviations))
+    assert "{}: OK".format(matching_file) in report
+    assert "    /board/plot/output directory: 1 of 3 boards" in report
+
+    # Part positions are read from the board file without loading the board.
+    modules = kinjector.Board().eject(brd)["board"]["modules"]
+    reference = {"board": {"modules": {}}}
+    for ref in ("R1", "D1"):
+        reference["board"]["modules"][ref] = {"position": modules[ref]["position"]}
+    index_file = matching_file + ".idx"
+    if os.path.exists(index_file):
+        os.remove(index_file)
+    assert indexed_positions(matching_file, reference) == reference
+    assert not os.path.exists(index_file)
+    assert indexed_positions(matching_file, reference, save_index=True) == reference
+    assert os.path.exists(index_file)
+    os.remove(index_file)
+    r1_x = modules["R1"]["position"]["x"]
+    reference["board"]["modules"]["R1"]["position"] = {"x": r1_x + 1000000}
+    assert audit_boards(reference, [matching_file], jobs=1)[0][1] == [
+        ("/board/modules/R1/position/x", r1_x + 1000000, r1_x)
+    ]
+
+
+def test_memory():
+    """Test releasing boards and keeping the memory of a run under a ceiling."""
+
+    import logging
+
+    from kinjector.memory import MemoryCeiling, current_rss, parse_size
+
+    assert parse_size("512M") == 512 << 20
+    assert parse_size("2G") == 2 << 30
+    assert parse_size("100") == 100 << 20
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+    brd = pcbnew.LoadBoard("test.kicad_pcb")
+    kinjector.ModuleIndex.of(brd)
+    assert kinjector.board_cache(brd)
+    kinjector.release_board(brd)
+    assert not hasattr(brd, "kinjector_cache")
+
+    logger = logging.getLogger("kinjector")
+    ceiling = MemoryCeiling(parse_size("100G"), logger)
+    try:
+        assert ceiling.run(current_rss) > 0
+        worker = ceiling.worker
+        ceiling.run(current_rss)
+        assert ceiling.worker is worker  # Plenty of room, so the worker is kept.
+        with pytest.raises(ValueError):
+            ceiling.run(parse_size, "lots")
+
+        # The worker is replaced when the next task might go over the ceiling.
+        ceiling.limit = 1
+        ceiling.run(current_rss)
+        assert ceiling.worker is None
+    finally:
+        ceiling.close()